@@ -20,7 +20,8 @@ function createPythonLambda(stack: PythonStack, name: string, options?: Function
         layers: stack.lambdaLayers,
         environment: {
             LOG_LEVEL: 'INFO',
-            POWERTOOLS_SERVICE_NAME: name
+            POWERTOOLS_SERVICE_NAME: name,
+            POWERTOOLS_METRICS_NAMESPACE: Stack.of(stack).stackName
         }
     }
 
@@ -1,14 +1,40 @@
 #!/usr/bin/env python
+import os
 
-import serverless_wsgi
+from cdk_example_app.common import invocation
+from cdk_example_app.common.connexion.api_gateway import ApiGatewayDispatcher
+from cdk_example_app.common.connexion.application_factory import (
+    aws_client_factories,
+    create_app,
+    generated_dir,
+    warm_up,
+)
+from cdk_example_app.common.connexion.compression import (
+    COMPRESSION_MIN_SIZE_ENV_VARIABLE,
+)
+from cdk_example_app.common.tracing.lazy_tracer import force_flush
 
-from cdk_example_app.common.connexion.application_factory import create_app
-
-app = create_app(__name__, "openApi.yaml").app
+compression_min_size = os.environ.get(COMPRESSION_MIN_SIZE_ENV_VARIABLE)
+connexion_app = create_app(
+    __name__,
+    "openApi.yaml",
+    spec_cache_dir=generated_dir(),
+    compression_min_size=int(compression_min_size) if compression_min_size else None,
+)
+# the example operations don't call AWS services: this primes the boto3 session, and the clients of WARM_UP_AWS_CLIENTS
+warm_up(connexion_app, *aws_client_factories())
+app = connexion_app.app
+# serverless_wsgi remains the fallback for the operations that the dispatcher does not support
+dispatcher = ApiGatewayDispatcher(connexion_app)
 
 
 def handler(event, context):
-    return serverless_wsgi.handle_request(app, event, context)
+    invocation.start(context)
+    try:
+        return dispatcher(event, context)
+    finally:
+        # export the buffered spans of the http and AWS clients before the runtime freezes
+        force_flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+"""asyncio HTTP client (httpx) with the same defaults as the requests based `http_session`.
+
+Sessions use HTTP/2 when the server supports it and keep connections alive, get a default timeout of 5 seconds, retry
+the same statuses with the same backoff (honouring Retry-After) and propagate the trace context when tracing is enabled,
+with one client span per request like the requests instrumentation.
+
+Async code creates its own session with `create_async_session()` (a session is bound to the event loop that uses it).
+Synchronous handlers can fan out requests with `run_concurrently`, which runs them on a background event loop with a
+shared session, so that connections are reused across invocations:
+
+    hello, info = run_concurrently(lambda session: session.get(hello_url), lambda session: session.get(info_url))
+"""
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+from urllib3.util.retry import RequestHistory, Retry
+
+from cdk_example_app.common.http_session import DEFAULT_TIMEOUT, retries
+from cdk_example_app.common.tracing.lazy_tracer import (
+    get_tracer,
+    set_error_status,
+    tracing_enabled,
+)
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60  # seconds
+
+_lock = threading.Lock()
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """Retries requests that fail with one of the statuses or a connection error of the `Retry` configuration"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, retry: Retry = retries):
+        self.transport = transport
+        self.retry = retry
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        retry = self.retry
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if not retry.total:
+                    raise
+                retry = self._increment(retry, request, error=e)
+                await asyncio.sleep(retry.get_backoff_time())
+                continue
+            has_retry_after = "Retry-After" in response.headers
+            if not retry.total or not retry.is_retry(request.method, response.status_code, has_retry_after):
+                return response
+            retry = self._increment(retry, request, status=response.status_code)
+            await response.aclose()
+            await asyncio.sleep(self._sleep_time(retry, response))
+
+    @staticmethod
+    def _increment(retry: Retry, request: httpx.Request, error: Exception = None, status: int = None) -> Retry:
+        history = retry.history + (RequestHistory(request.method, str(request.url), error, status, None),)
+        return retry.new(total=retry.total - 1, history=history)
+
+    @staticmethod
+    def _sleep_time(retry: Retry, response: httpx.Response) -> float:
+        retry_after = response.headers.get("Retry-After")
+        if retry.respect_retry_after_header and retry_after:
+            try:
+                return retry.parse_retry_after(retry_after)
+            except Exception:  # pylint: disable=broad-except
+                pass
+        return retry.get_backoff_time()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """Wraps every request (including its retries) in a client span and injects the trace context in the headers"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not tracing_enabled():
+            return await self.transport.handle_async_request(request)
+        # pylint: disable=import-outside-toplevel
+        from opentelemetry.propagate import inject
+        from opentelemetry.trace import SpanKind
+
+        attributes = {"http.method": request.method, "http.url": str(request.url)}
+        with get_tracer().start_as_current_span(
+            f"HTTP {request.method}", kind=SpanKind.CLIENT, attributes=attributes
+        ) as span:
+            inject(request.headers)
+            response = await self.transport.handle_async_request(request)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 400:
+                set_error_status(span, f"HTTP {response.status_code}")
+            return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def create_async_session(transport: httpx.AsyncBaseTransport = None, **kwargs) -> httpx.AsyncClient:
+    """Returns a new AsyncClient, the kwargs are passed to the client (f.e. `base_url` or `timeout`)"""
+    if transport is None:
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        transport = httpx.AsyncHTTPTransport(http2=True, limits=limits)
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return httpx.AsyncClient(transport=TracingTransport(RetryTransport(transport)), **kwargs)
+
+
+async def gather(*aws: Awaitable, max_concurrency: Optional[int] = None, return_exceptions: bool = False) -> List:
+    """asyncio.gather, that runs at most `max_concurrency` of the awaitables at the same time"""
+    if not max_concurrency:
+        return await asyncio.gather(*aws, return_exceptions=return_exceptions)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def limited(awaitable: Awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(limited(awaitable) for awaitable in aws), return_exceptions=return_exceptions)
+
+
+@lru_cache
+def _background_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="async-http-session", daemon=True).start()
+    return loop
+
+
+@lru_cache
+def _shared_session() -> httpx.AsyncClient:
+    """Returns the session of the background loop (must be called on that loop)"""
+    return create_async_session()
+
+
+async def _in_trace_context(coroutine: Awaitable, trace_context):
+    # pylint: disable=import-outside-toplevel
+    from opentelemetry import context
+
+    token = context.attach(trace_context)
+    try:
+        return await coroutine
+    finally:
+        context.detach(token)
+
+
+def run_sync(coroutine: Awaitable, timeout: Optional[float] = None):
+    """Run a coroutine on the background event loop and wait for its result (from synchronous code).
+
+    The loop runs in another thread, so the trace context of the caller is passed explicitly.
+    """
+    if tracing_enabled():
+        # pylint: disable=import-outside-toplevel
+        from opentelemetry import context
+
+        coroutine = _in_trace_context(coroutine, context.get_current())
+    with _lock:
+        loop = _background_loop()
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout)
+
+
+def run_concurrently(
+    *requests: Callable[[httpx.AsyncClient], Awaitable],
+    max_concurrency: Optional[int] = None,
+    return_exceptions: bool = False,
+) -> List:
+    """Run the request functions concurrently with the shared session and return their results (in order).
+
+    Every function gets the session and returns an awaitable, f.e. `lambda session: session.get(url)`.
+    """
+
+    async def run():
+        session = _shared_session()
+        return await gather(
+            *(request(session) for request in requests),
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    return run_sync(run())
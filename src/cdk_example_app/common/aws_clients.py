@@ -0,0 +1,121 @@
+"""Shared factory for boto3 clients with a tuned botocore config.
+
+All clients are created from one boto3 session (creating clients from a session is not thread safe, so `client()`
+serializes it) with a larger connection pool, shorter timeouts, TCP keepalive and adaptive retries. The same pool size
+and timeouts are applied to the PynamoDB models (in their Meta class), PynamoDB creates its own botocore session.
+
+The number of concurrent requests per service is tracked to detect pool saturation: a request that is sent while
+`max_pool_connections` requests are in flight waits for a connection (or opens a connection that is discarded).
+"""
+import os
+import threading
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+
+MAX_POOL_CONNECTIONS_ENV_VARIABLE = "AWS_MAX_POOL_CONNECTIONS"
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+CONNECT_TIMEOUT = 2  # seconds
+READ_TIMEOUT = 30  # seconds
+MAX_ATTEMPTS = 3
+
+_lock = threading.Lock()
+
+
+def max_pool_connections() -> int:
+    return int(os.environ.get(MAX_POOL_CONNECTIONS_ENV_VARIABLE, DEFAULT_MAX_POOL_CONNECTIONS))
+
+
+@lru_cache
+def botocore_config() -> Config:
+    return Config(
+        max_pool_connections=max_pool_connections(),
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": MAX_ATTEMPTS},
+    )
+
+
+@lru_cache
+def session() -> boto3.session.Session:
+    return boto3.session.Session()
+
+
+class PoolMetrics:
+    """Thread safe counters of the concurrent requests of one service"""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated_requests = 0
+        self._lock = threading.Lock()
+
+    def request_sent(self, **_kwargs):
+        with self._lock:
+            if self.in_flight >= self.max_connections:
+                self.saturated_requests += 1
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def response_received(self, **_kwargs):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Returns the counters, which start over from the requests in flight when `reset` is set"""
+        with self._lock:
+            snapshot = {
+                "maxConnections": self.max_connections,
+                "requests": self.requests,
+                "inFlight": self.in_flight,
+                "peakInFlight": self.peak_in_flight,
+                "saturatedRequests": self.saturated_requests,
+            }
+            if reset:
+                self.requests = 0
+                self.peak_in_flight = self.in_flight
+                self.saturated_requests = 0
+        return snapshot
+
+
+_pool_metrics = {}
+
+
+@lru_cache
+def _create_client(service_name: str):
+    aws_client = session().client(service_name, config=botocore_config())
+    metrics = PoolMetrics(aws_client.meta.config.max_pool_connections)
+    # both events are emitted for every attempt, the handlers must return None to not short circuit the request
+    aws_client.meta.events.register("before-send", metrics.request_sent)
+    aws_client.meta.events.register("response-received", metrics.response_received)
+    _pool_metrics[service_name] = metrics
+    return aws_client
+
+
+def client(service_name: str):
+    """Returns the shared (thread safe) client for the service"""
+    with _lock:
+        return _create_client(service_name)
+
+
+def pool_metrics(reset: bool = False) -> dict:
+    """Returns the connection pool metrics per service, see PoolMetrics.snapshot"""
+    with _lock:
+        return {service_name: metrics.snapshot(reset) for service_name, metrics in _pool_metrics.items()}
+
+
+def add_pool_metrics(metrics):
+    """Add the peak concurrency and saturated requests per service since the previous call to an
+    aws_lambda_powertools Metrics instance
+    """
+    # pylint: disable=import-outside-toplevel
+    from aws_lambda_powertools.metrics import MetricUnit
+
+    for service_name, snapshot in pool_metrics(reset=True).items():
+        for name in ("peakInFlight", "saturatedRequests"):
+            metrics.add_metric(name=f"AwsClientPool.{service_name}.{name}", unit=MetricUnit.Count, value=snapshot[name])
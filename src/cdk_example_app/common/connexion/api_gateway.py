@@ -0,0 +1,269 @@
+"""Dispatch API Gateway proxy events directly to the connexion operation functions.
+
+serverless_wsgi translates every event into a WSGI environ and runs the complete Flask/connexion stack. The
+`ApiGatewayDispatcher` matches the event against the operations of the api instead, validates the path and query
+parameters and the json body with json schema validators that are created once, and converts the return value of the
+operation with Flask's `make_response`.
+
+Operations that need more than that are handled by the WSGI fallback:
+* operations with header, cookie or form parameters, or with a body that is not json
+* operations marked with `x-wsgi: true` in the specification, f.e. because they use `flask.request`
+* operations without an operationId, of which the function is only known to the resolver (f.e. RestyResolver)
+
+The routes are built from the specification and the resolver of the api, so the dispatcher does not depend on the
+internals of connexion's operation objects.
+
+Responses of operations with an `x-cache-ttl` are cached in the response cache of the api (see response_cache) and
+responses are compressed when compression is enabled on the app (see compression).
+"""
+import base64
+import inspect
+import json
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlencode
+
+import serverless_wsgi
+from connexion import ProblemException, Resolver
+from connexion.apps.flask_app import FlaskApp
+from connexion.exceptions import ResolverError
+from jsonschema import Draft4Validator, ValidationError
+
+from cdk_example_app.common.connexion.application_factory import (
+    api_operations,
+    json_response,
+    render_problem_exception,
+)
+from cdk_example_app.common.connexion.compression import (
+    COMPRESSION_MIN_SIZE_CONFIG,
+    compress_response,
+)
+from cdk_example_app.common.connexion.response_cache import (
+    CACHE_TTL_EXTENSION,
+    cache_key,
+)
+
+logger = logging.getLogger(__name__)
+
+WSGI_EXTENSION = "x-wsgi"
+JSON_MIMETYPE = "application/json"
+
+_PATH_PARAMETER = re.compile(r"\{([^}/]+)}")
+
+
+def _convert(value: str, schema: dict):
+    """Convert a path or query string value to the type of the schema (the schema validator checks the result)"""
+    schema_type = schema.get("type")
+    try:
+        if schema_type == "integer":
+            return int(value)
+        if schema_type == "number":
+            return float(value)
+    except ValueError:
+        return value
+    if schema_type == "boolean":
+        return {"true": True, "false": False}.get(value.lower(), value)
+    return value
+
+
+class _Parameter:
+    def __init__(self, definition: dict):
+        self.name = definition["name"]
+        self.location = definition["in"]
+        self.required = definition.get("required", False)
+        self.schema = definition.get("schema", {})
+        self.validator = Draft4Validator(self.schema)
+
+    def value(self, path_params: Dict[str, str], query: Dict[str, List[str]]):
+        """Returns the converted and validated value or None when the parameter is missing"""
+        if self.location == "path":
+            raw_value = path_params.get(self.name)
+        else:
+            raw_value = query.get(self.name)
+            if raw_value is not None and self.schema.get("type") != "array":
+                raw_value = raw_value[-1]
+        if raw_value is None:
+            if self.required:
+                raise _bad_request(f"Missing {self.location} parameter '{self.name}'")
+            return self.schema.get("default")
+        if self.schema.get("type") == "array":
+            value = [_convert(item, self.schema.get("items", {})) for item in raw_value]
+        else:
+            value = _convert(raw_value, self.schema)
+        _validate(self.validator, value, f"{self.location} parameter '{self.name}'")
+        return value
+
+
+def _bad_request(detail: str) -> ProblemException:
+    return ProblemException(status=400, title="Bad Request", detail=detail)
+
+
+def _validate(validator: Draft4Validator, value, name: str):
+    try:
+        validator.validate(value)
+    except ValidationError as e:
+        raise _bad_request(f"{name}: {e.message}") from e
+
+
+def _path_pattern(path: str) -> re.Pattern:
+    """Regex that matches the path template, with a group for every path parameter"""
+    parts = _PATH_PARAMETER.split(path)  # literal, parameter name, literal, ...
+    regex = "".join(re.escape(part) if index % 2 == 0 else "([^/]+)" for index, part in enumerate(parts))
+    return re.compile(f"^{regex}/?$")
+
+
+def _function(resolver: Resolver, definition: dict) -> Optional[Callable]:
+    """The operation function, None when the operation has no operationId or can't be resolved"""
+    operation_id = definition.get("operationId")
+    if not operation_id:
+        return None
+    router_controller = definition.get("x-openapi-router-controller")
+    if router_controller:
+        operation_id = f"{router_controller}.{operation_id}"
+    try:
+        return resolver.resolve_function_from_operation_id(operation_id)
+    except ResolverError:
+        return None
+
+
+class _Route:  # pylint: disable=too-many-instance-attributes
+    def __init__(self, method: str, path: str, definition: dict, function: Callable, base_path: str):
+        self.method = method.upper()
+        self.path = path
+        self.function = function
+        self.operation_id = definition["operationId"]
+        self.parameters = [_Parameter(parameter) for parameter in definition["parameters"]]
+        request_body = definition.get("requestBody", {})
+        body_schema = request_body.get("content", {}).get(JSON_MIMETYPE, {}).get("schema", {})
+        self.body_validator = Draft4Validator(body_schema) if request_body else None
+        self.body_required = request_body.get("required", False)
+        self.path_names = _PATH_PARAMETER.findall(self.path)
+        self.pattern = _path_pattern(base_path + self.path)
+        signature = inspect.signature(self.function).parameters
+        self.has_kwargs = any(param.kind == inspect.Parameter.VAR_KEYWORD for param in signature.values())
+        self.argument_names = set(signature)
+        self.cache_ttl = definition.get(CACHE_TTL_EXTENSION)
+
+    @staticmethod
+    def supports(definition: dict) -> bool:
+        if definition.get(WSGI_EXTENSION):
+            return False
+        if any(parameter["in"] not in ("path", "query") for parameter in definition["parameters"]):
+            return False
+        request_body = definition.get("requestBody")
+        return not request_body or list(request_body.get("content", {})) == [JSON_MIMETYPE]
+
+    def match(self, method: str, path: str) -> Optional[Dict[str, str]]:
+        if method != self.method:
+            return None
+        match = self.pattern.match(path)
+        return dict(zip(self.path_names, map(unquote, match.groups()))) if match else None
+
+    def arguments(self, path_params: Dict[str, str], query: Dict[str, List[str]], body: Optional[str]) -> dict:
+        arguments = {parameter.name: parameter.value(path_params, query) for parameter in self.parameters}
+        if self.body_validator:
+            if body:
+                try:
+                    arguments["body"] = json.loads(body)
+                except json.JSONDecodeError as e:
+                    raise _bad_request(f"Invalid json body: {e}") from e
+                _validate(self.body_validator, arguments["body"], "body")
+            elif self.body_required:
+                raise _bad_request("Request body is required")
+        return {
+            name: value
+            for name, value in arguments.items()
+            if value is not None and (self.has_kwargs or name in self.argument_names)
+        }
+
+
+def _request(event: dict) -> Tuple[str, str, Dict[str, List[str]], Optional[str]]:
+    """Returns the method, path, query parameters and body of a (v1 or v2) API Gateway proxy event"""
+    if event.get("version") == "2.0":
+        method = event["requestContext"]["http"]["method"]
+        path = event["rawPath"]
+        query = parse_qs(event.get("rawQueryString", ""))
+    else:
+        method = event["httpMethod"]
+        path = event["path"]
+        query = event.get("multiValueQueryStringParameters") or {
+            name: [value] for name, value in (event.get("queryStringParameters") or {}).items()
+        }
+    body = event.get("body")
+    if body and event.get("isBase64Encoded"):
+        body = base64.b64decode(body).decode()
+    return method.upper(), path, query, body
+
+
+def _header(event: dict, name: str) -> Optional[str]:
+    name = name.lower()
+    return next((value for key, value in (event.get("headers") or {}).items() if key.lower() == name), None)
+
+
+class ApiGatewayDispatcher:
+    """Lambda handler that invokes the operations of a connexion app (created with create_app) without WSGI.
+
+    Events that don't match a supported operation are passed to `fallback`, which defaults to serverless_wsgi.
+    """
+
+    def __init__(
+        self,
+        connexion_app: FlaskApp,
+        fallback: Callable[[dict, object], dict] = None,
+        error_renderer: Callable = render_problem_exception,
+    ):
+        self.app = connexion_app.app
+        self.fallback = fallback or (lambda event, context: serverless_wsgi.handle_request(self.app, event, context))
+        self.error_renderer = error_renderer
+        self.routes = []
+        api = connexion_app.api
+        self.response_cache = api.response_cache
+        for path, method, definition in api_operations(api):
+            function = _function(api.resolver, definition)
+            if function is not None and _Route.supports(definition):
+                self.routes.append(_Route(method, path, definition, function, api.base_path))
+
+    def route(self, method: str, path: str) -> Tuple[Optional[_Route], Dict[str, str]]:
+        for route in self.routes:
+            path_params = route.match(method, path)
+            if path_params is not None:
+                return route, path_params
+        return None, {}
+
+    def __call__(self, event: dict, context) -> dict:
+        method, path, query, body = _request(event)
+        route, path_params = self.route(method, path)
+        if route is None:
+            return self.fallback(event, context)
+        with self.app.app_context():
+            if route.cache_ttl:
+                key = cache_key(method, path, urlencode(sorted(query.items()), doseq=True))
+                if_none_match = _header(event, "If-None-Match")
+                response = self.response_cache.respond(
+                    key, route.cache_ttl, if_none_match, lambda: self.invoke(route, path, path_params, query, body)
+                )
+            else:
+                response = self.invoke(route, path, path_params, query, body)
+        compression_min_size = self.app.config.get(COMPRESSION_MIN_SIZE_CONFIG)
+        if compression_min_size is not None:
+            response = compress_response(response, _header(event, "Accept-Encoding"), compression_min_size)
+        return serverless_wsgi.generate_response(response, event)
+
+    def make_response(self, result):
+        """Same as Flask's make_response, but serializes dicts and lists with fast_json"""
+        body, rest = (result[0], result[1:]) if isinstance(result, tuple) else (result, ())
+        if isinstance(body, (dict, list)):
+            body = json_response(body)
+        return self.app.make_response((body, *rest) if rest else body)
+
+    def invoke(self, route: _Route, path: str, path_params: Dict[str, str], query: Dict[str, List[str]], body):
+        try:
+            return self.make_response(route.function(**route.arguments(path_params, query, body)))
+        except ProblemException as e:
+            return self.error_renderer(e)
+        # pylint: disable=broad-except
+        except Exception:
+            logger.exception("Exception on %s %s [%s]", route.operation_id, path, route.method)
+            error = ProblemException(status=500, title="Internal Server Error", type="INTERNAL_SERVER_ERROR")
+            return self.error_renderer(error)
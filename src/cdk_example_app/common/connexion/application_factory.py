@@ -1,12 +1,35 @@
 import json
 import logging
 import os
+import pathlib
+import re
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Iterator, List, Tuple
 
 import serverless_wsgi
 from connexion import ProblemException
+from connexion.apis import flask_utils
+from connexion.apis.flask_api import FlaskApi
 from connexion.apps.flask_app import FlaskApp
+from connexion.jsonifier import Jsonifier
 from connexion.security.security_handler_factory import AbstractSecurityHandlerFactory
-from flask import Response, jsonify
+from flask import Flask, Response
+
+from cdk_example_app.common import aws_clients, fast_json
+from cdk_example_app.common.connexion.compression import install_compression
+from cdk_example_app.common.connexion.response_cache import (
+    CACHE_TTL_EXTENSION,
+    ResponseCache,
+    cached_view,
+)
+from cdk_example_app.common.connexion.spec_cache import load_spec, skip_spec_validation
+
+# comma separated AWS services (f.e. "dynamodb,s3") of which the clients are created during the warm up
+WARM_UP_AWS_CLIENTS_ENV_VARIABLE = "WARM_UP_AWS_CLIENTS"
+
+_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+_FLASK_CONVERTER = re.compile(r"<[^:<>]+:")
 
 
 def render_problem_exception(error):
@@ -15,7 +38,57 @@ def render_problem_exception(error):
     if error.detail:
         result["errors"] = [error.detail]
     result["code"] = error.type if error.type else "VALIDATION_ERROR"
-    return Response(response=json.dumps(result), status=error.status, mimetype="application/json")
+    return Response(response=fast_json.dumps_bytes(result), status=error.status, mimetype="application/json")
+
+
+def json_response(obj, status: int = 200, headers: dict = None) -> Response:
+    """Replacement for flask.jsonify that uses fast_json"""
+    return Response(response=fast_json.dumps_bytes(obj), status=status, headers=headers, mimetype="application/json")
+
+
+class FastJsonFlaskApi(FlaskApi):
+    """FlaskApi that serializes json with fast_json and has a response cache for the operations with an x-cache-ttl
+    (see response_cache)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.response_cache = ResponseCache()
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def _set_jsonifier(cls):
+        cls.jsonifier = Jsonifier(fast_json)
+
+
+def api_operations(api: FlaskApi) -> Iterator[Tuple[str, str, dict]]:
+    """The path, method and definition of the operations in the (resolved) specification of the api.
+
+    The parameters of the path item are merged into the parameters of the definition.
+    """
+    for path, path_item in api.specification.get("paths", {}).items():
+        path_parameters = path_item.get("parameters", [])
+        for method, definition in path_item.items():
+            if method not in _METHODS:
+                continue
+            parameters = {
+                (parameter["name"], parameter["in"]): parameter
+                for parameter in path_parameters + definition.get("parameters", [])
+            }
+            yield path, method, {**definition, "parameters": list(parameters.values())}
+
+
+def _cache_responses(app: Flask, api: FastJsonFlaskApi):
+    """Wrap the views of the operations with an x-cache-ttl with cached_view"""
+    ttls = {
+        (flask_utils.flaskify_path(api.base_path + path), method.upper()): definition[CACHE_TTL_EXTENSION]
+        for path, method, definition in api_operations(api)
+        if definition.get(CACHE_TTL_EXTENSION)
+    }
+    for rule in app.url_map.iter_rules():
+        path = _FLASK_CONVERTER.sub("<", rule.rule)  # /items/<int:item_id> -> /items/<item_id>
+        ttl = next((ttls[path, method] for method in rule.methods if (path, method) in ttls), None)
+        if ttl:
+            app.view_functions[rule.endpoint] = cached_view(app.view_functions[rule.endpoint], api.response_cache, ttl)
 
 
 def _disable_connexion_security():
@@ -33,29 +106,67 @@ def create_app(
     options=None,
     resolver=None,
     error_renderer=render_problem_exception,
+    spec_cache_dir=None,
+    compression_min_size=None,
 ):
-    """Create a connexion app with swagger_ui disabled by default"""
+    """Create a connexion app with swagger_ui disabled by default
+
+    The api is available as `api` on the returned app. When `spec_cache_dir` contains an up-to-date cache of the
+    specification (see spec_cache), the parsed specification is loaded from the cache and not validated again.
+    With `compression_min_size`, larger responses are compressed (see compression).
+    """
 
     if options is None:
         options = {"swagger_ui": False}
     _disable_connexion_security()
     connexion_app = FlaskApp(name, specification_dir=specification_dir, options=options)
+    connexion_app.api_cls = FastJsonFlaskApi
     connexion_app.app.url_map.strict_slashes = False
-    connexion_app.add_api(specification, base_path=base_path, resolver=resolver)
+    cached_spec = None
+    if spec_cache_dir:
+        cached_spec = load_spec(connexion_app.specification_dir / specification, pathlib.Path(spec_cache_dir))
+    with skip_spec_validation() if cached_spec else nullcontext():
+        connexion_app.api = connexion_app.add_api(cached_spec or specification, base_path=base_path, resolver=resolver)
+    _cache_responses(connexion_app.app, connexion_app.api)
     serverless_wsgi.TEXT_MIME_TYPES.append("application/problem+json")  # mimetype of connexion validation errors
     connexion_app.add_error_handler(ProblemException, error_renderer)
+    if compression_min_size is not None:
+        install_compression(connexion_app.app, compression_min_size)
 
     # TODO instrument flask app
     return connexion_app
 
 
+def warm_up(connexion_app: FlaskApp, *client_factories: Callable):
+    """Do the lazy initialization of the first request during the Lambda init phase (which can be snapshotted).
+
+    Creates the (cached) AWS clients of the given factories and runs an empty request context, which creates the url
+    adapter and the request/session classes of the app.
+    """
+    for client_factory in client_factories:
+        client_factory()
+    with connexion_app.app.test_request_context():
+        pass
+
+
+def aws_client_factories() -> List[Callable]:
+    """Factories of the shared boto3 session and of the clients of the WARM_UP_AWS_CLIENTS services, for warm_up"""
+    services = os.environ.get(WARM_UP_AWS_CLIENTS_ENV_VARIABLE, "").split(",")
+    return [aws_clients.session] + [
+        partial(aws_clients.client, service.strip()) for service in services if service.strip()
+    ]
+
+
+def generated_dir() -> pathlib.Path:
+    """Directory with the files that are generated during the build"""
+    return pathlib.Path(os.environ.get("LAMBDA_TASK_ROOT", "./"), "generated")
+
+
 def info():
     try:
-        with open(
-            os.path.join(os.environ.get("LAMBDA_TASK_ROOT", "./"), "generated/app-info.json"), "r", encoding="utf-8"
-        ) as file:
+        with open(generated_dir() / "app-info.json", "r", encoding="utf-8") as file:
             app_info = json.load(file)
             app_info["region"] = os.environ.get("AWS_REGION", "?")
-        return jsonify(app_info)
+        return json_response(app_info)
     except FileNotFoundError:
-        return jsonify("No app-info.json found. Make sure to generate it during the build?")
+        return json_response("No app-info.json found. Make sure to generate it during the build?")
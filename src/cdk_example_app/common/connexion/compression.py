@@ -0,0 +1,91 @@
+"""Content negotiated gzip/brotli compression of API responses.
+
+Compressed responses get a Content-Encoding header, so serverless_wsgi and the ApiGatewayDispatcher return them base64
+encoded (isBase64Encoded). API Gateway REST APIs only decode such responses when the Accept header of the request
+matches one of the `binaryMediaTypes` of the API, so enable compression only when those are configured.
+"""
+import gzip
+from typing import Optional
+
+from flask import Flask, Response, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# minimum response size (bytes) for compression, compression is disabled when not set
+COMPRESSION_MIN_SIZE_ENV_VARIABLE = "API_COMPRESSION_MIN_SIZE"
+COMPRESSION_MIN_SIZE_CONFIG = "COMPRESSION_MIN_SIZE"
+DEFAULT_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_COMPRESSIBLE_MIMETYPES = ("application/json", "application/problem+json", "application/javascript", "image/svg+xml")
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> dict:
+    """Returns the encodings of an Accept-Encoding header with their quality"""
+    encodings = {}
+    for item in (accept_encoding or "").split(","):
+        encoding, _, params = item.strip().partition(";")
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if encoding:
+            encodings[encoding.strip().lower()] = quality
+    return encodings
+
+
+def select_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Returns br or gzip (in that order of preference), when accepted"""
+    encodings = accepted_encodings(accept_encoding)
+    candidates = ["br", "gzip"] if brotli else ["gzip"]
+    accepted = [encoding for encoding in candidates if encodings.get(encoding, encodings.get("*", 0)) > 0]
+    return max(accepted, key=lambda encoding: encodings.get(encoding, encodings.get("*")), default=None)
+
+
+def _compressible(response: Response, min_size: int) -> bool:
+    mimetype = response.mimetype or ""
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and (mimetype.startswith("text/") or mimetype in _COMPRESSIBLE_MIMETYPES)
+        and response.content_length is not None
+        and response.content_length >= min_size
+    )
+
+
+def compress_response(response: Response, accept_encoding: Optional[str], min_size: int = DEFAULT_MIN_SIZE):
+    """Compress the response in place when it's large enough and the client accepts gzip or br"""
+    if not _compressible(response, min_size):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = select_encoding(accept_encoding)
+    if encoding == "br":
+        response.set_data(brotli.compress(response.get_data(), quality=BROTLI_QUALITY))
+    elif encoding == "gzip":
+        response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL))
+    else:
+        return response
+    response.headers["Content-Encoding"] = encoding
+    response_etag = response.headers.get("ETag")
+    if response_etag and not response_etag.startswith("W/"):
+        # the compressed body is not byte for byte the same representation
+        response.headers["ETag"] = f"W/{response_etag}"
+    return response
+
+
+def install_compression(app: Flask, min_size: int = DEFAULT_MIN_SIZE):
+    """Compress the responses of the Flask app, the min size is also stored in the app config for the dispatcher"""
+    app.config[COMPRESSION_MIN_SIZE_CONFIG] = min_size
+
+    @app.after_request
+    def compress(response: Response):
+        return compress_response(response, request.headers.get("Accept-Encoding"), min_size)
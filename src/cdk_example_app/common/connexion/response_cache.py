@@ -0,0 +1,108 @@
+"""In-process cache of the responses of operations with an `x-cache-ttl` (seconds) in the OpenAPI specification.
+
+Successful responses are serialized once and served from the cache, without invoking the operation, until the TTL
+expires. Cached responses get an ETag, and requests with a matching If-None-Match header are answered with 304.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Optional
+
+from flask import Response, current_app, request
+
+CACHE_TTL_EXTENSION = "x-cache-ttl"
+DEFAULT_MAX_ENTRIES = 256
+
+# headers that are not stored with a cached response
+_UNCACHED_HEADERS = ("Content-Length", "Date", "ETag", "Cache-Control")
+
+
+def etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(response_etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or response_etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class CachedResponse:
+    def __init__(self, response: Response, ttl: float):
+        self.status = response.status_code
+        self.headers = [(name, value) for name, value in response.headers if name not in _UNCACHED_HEADERS]
+        self.body = response.get_data()
+        self.etag = response.headers.get("ETag") or etag(self.body)
+        self.expires = time.monotonic() + ttl
+
+    def to_response(self, if_none_match: str = None) -> Response:
+        """Returns a new response, or a 304 Not Modified response when the ETag matches"""
+        max_age = max(0, math.ceil(self.expires - time.monotonic()))
+        headers = {"ETag": self.etag, "Cache-Control": f"max-age={max_age}"}
+        if etag_matches(self.etag, if_none_match):
+            return Response(status=304, headers=headers)
+        return Response(self.body, status=self.status, headers=self.headers + list(headers.items()))
+
+
+class ResponseCache:
+    """LRU cache of serialized responses with a TTL per entry"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response: Response, ttl: float) -> CachedResponse:
+        entry = CachedResponse(response, ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def respond(self, key, ttl: float, if_none_match: Optional[str], create_response: Callable[[], Response]):
+        """Returns the cached response for the key, or caches the response of `create_response` when it's a 200"""
+        entry = self.get(key)
+        if entry is None:
+            response = create_response()
+            if response.status_code != 200 or response.is_streamed or "Set-Cookie" in response.headers:
+                return response
+            entry = self.put(key, response, ttl)
+        return entry.to_response(if_none_match)
+
+
+def cache_key(method: str, path: str, query_string: str) -> tuple:
+    return method.upper(), path, "&".join(sorted(query_string.split("&"))) if query_string else ""
+
+
+def cached_view(view: Callable, cache: ResponseCache, ttl: float) -> Callable:
+    """Wrap a Flask view function, so that its responses are cached for `ttl` seconds"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = cache_key(request.method, request.path, request.query_string.decode())
+        return cache.respond(
+            key, ttl, request.headers.get("If-None-Match"), lambda: current_app.make_response(view(*args, **kwargs))
+        )
+
+    return wrapper
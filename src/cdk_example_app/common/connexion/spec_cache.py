@@ -0,0 +1,74 @@
+"""Build time cache of OpenAPI specifications, so that a Lambda cold start does not parse and validate the YAML.
+
+The cache is a pickle of the parsed specification together with the hash of the YAML file it was compiled from.
+Generate it during the build (next to generated/app-info.json) with:
+
+    python -m cdk_example_app.common.connexion.spec_cache src/cdk_example_app/openApi.yaml generated
+"""
+import hashlib
+import logging
+import pathlib
+import pickle  # nosec
+import sys
+from contextlib import contextmanager
+from typing import Optional
+
+import yaml
+from connexion.spec import Specification
+
+logger = logging.getLogger(__name__)
+
+SPEC_CACHE_SUFFIX = ".spec.pickle"
+
+
+def spec_hash(specification: pathlib.Path) -> str:
+    return hashlib.sha256(specification.read_bytes()).hexdigest()
+
+
+def spec_cache_path(specification: pathlib.Path, cache_dir: pathlib.Path) -> pathlib.Path:
+    return cache_dir / (specification.stem + SPEC_CACHE_SUFFIX)
+
+
+def compile_spec(specification: pathlib.Path, cache_dir: pathlib.Path) -> pathlib.Path:
+    """Parse and validate the specification and write it to the cache directory"""
+    raw_spec = yaml.safe_load(specification.read_text(encoding="utf-8"))
+    Specification.from_dict(raw_spec)  # raises InvalidSpecification
+    cache_path = spec_cache_path(specification, cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with cache_path.open("wb") as file:
+        pickle.dump({"hash": spec_hash(specification), "spec": raw_spec}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return cache_path
+
+
+def load_spec(specification: pathlib.Path, cache_dir: pathlib.Path) -> Optional[dict]:
+    """Returns the cached specification, or None when there is no cache or when it is outdated"""
+    cache_path = spec_cache_path(specification, cache_dir)
+    if not cache_path.exists():
+        return None
+    with cache_path.open("rb") as file:
+        cache = pickle.load(file)  # nosec: generated during the build
+    if cache["hash"] != spec_hash(specification):
+        logger.warning("ignoring outdated specification cache %s", cache_path)
+        return None
+    return cache["spec"]
+
+
+@contextmanager
+def skip_spec_validation():
+    """Don't validate specifications that were already validated by `compile_spec`"""
+    # pylint: disable=protected-access
+    validate_spec = Specification.__dict__["_validate_spec"]
+    Specification._validate_spec = classmethod(lambda cls, spec: None)
+    try:
+        yield
+    finally:
+        Specification._validate_spec = validate_spec
+
+
+def main():
+    specification, cache_dir = sys.argv[1:3]
+    print(f"compiled {compile_spec(pathlib.Path(specification), pathlib.Path(cache_dir))}")
+
+
+if __name__ == "__main__":
+    main()
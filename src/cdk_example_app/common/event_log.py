@@ -1,33 +1,117 @@
+import heapq
+import itertools
 import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional
 
 from aws_lambda_powertools import Logger
-from botocore.session import Session
 from pynamodb.attributes import (
     BooleanAttribute,
     TTLAttribute,
     UnicodeAttribute,
     UTCDateTimeAttribute,
 )
-from pynamodb.indexes import AllProjection, GlobalSecondaryIndex
+from pynamodb.exceptions import PutError
+from pynamodb.expressions.condition import Condition
+from pynamodb.indexes import (
+    AllProjection,
+    GlobalSecondaryIndex,
+    IncludeProjection,
+    KeysOnlyProjection,
+    Projection,
+)
 from pynamodb.models import Model
 
+from cdk_example_app.common.aws_clients import (
+    CONNECT_TIMEOUT,
+    MAX_ATTEMPTS,
+    READ_TIMEOUT,
+    max_pool_connections,
+)
+from cdk_example_app.common.profiling import PHASE_EVENT_LOG_WRITE, phase
+from cdk_example_app.common.util import parallel_iter
+
 EVENT_LOG_TTL = timedelta(days=1)
 
 STATUS_PROCESSING = "PROCESSING"
 STATUS_DONE = "DONE"
 STATUS_FAILED = "FAILED"
 
+# DynamoDB limits for BatchWriteItem and BatchGetItem
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_ITEMS = 100
+
+# number of processed objects that a warm Lambda container remembers for idempotent processing
+PROCESSED_CACHE_SIZE = 1024
+# a PROCESSING entry that was claimed longer ago is considered abandoned (by a crashed or timed out Lambda) and can be
+# claimed again, the maximum Lambda timeout
+PROCESSING_LEASE_TIMEOUT = timedelta(minutes=15)
+
+# projection of the status index: ALL, KEYS_ONLY or INCLUDE (only the attributes that reprocessing needs), so that
+# the index does not replicate complete items on every write. Changing it requires recreating the index.
+STATUS_INDEX_PROJECTION_ENV_VARIABLE = "EVENT_LOG_STATUS_INDEX_PROJECTION"
+STATUS_INDEX_INCLUDED_ATTRIBUTES = ["bucket", "version", "etag", "function", "region", "received"]
+
+# the status index is write sharded: its hash key is `<status>#<shard>`, with the shard derived from the hash of the
+# s3 key, so that the writes of a status are spread over the partitions of the index. Changing the number of shards
+# requires running the backfill (event_log_migration).
+STATUS_INDEX_SHARDS_ENV_VARIABLE = "EVENT_LOG_STATUS_INDEX_SHARDS"
+DEFAULT_STATUS_INDEX_SHARDS = 10
+STATUS_INDEX_NAME = "status_shard_index"
+
+# attributes that can change after the PROCESSING entry is written
+_UPDATABLE_ATTRIBUTES = (
+    "status",
+    "status_shard",
+    "gzip",
+    "functional_key_name",
+    "functional_key_value",
+    "trace_id",
+    "processed_time",
+    "error",
+)
+
+# idempotency keys of the objects that this container processed, most recently used last
+_processed_cache = OrderedDict()
+_processed_cache_lock = threading.Lock()
+
+
+def status_index_projection(name: str = None) -> Projection:
+    name = (name or os.environ.get(STATUS_INDEX_PROJECTION_ENV_VARIABLE, AllProjection.projection_type)).upper()
+    if name == AllProjection.projection_type:
+        return AllProjection()
+    if name == KeysOnlyProjection.projection_type:
+        return KeysOnlyProjection()
+    if name == IncludeProjection.projection_type:
+        return IncludeProjection(STATUS_INDEX_INCLUDED_ATTRIBUTES)
+    raise ValueError(f"unsupported status index projection {name}")
+
+
+def status_index_shards() -> int:
+    return int(os.environ.get(STATUS_INDEX_SHARDS_ENV_VARIABLE, DEFAULT_STATUS_INDEX_SHARDS))
+
+
+def shard_key(status: str, s3_key: str) -> str:
+    """Hash key of the status index"""
+    return f"{status}#{zlib.crc32(s3_key.encode()) % status_index_shards()}"
+
 
 class StatusIndex(GlobalSecondaryIndex):
+    """Index on the sharded status, sorted by received time"""
+
     class Meta:
-        # All attributes are projected
-        projection = AllProjection()
+        index_name = STATUS_INDEX_NAME
+        projection = status_index_projection()
         read_capacity_units = 1000
         write_capacity_units = 1000
 
-    status = UnicodeAttribute(hash_key=True)
+    status_shard = UnicodeAttribute(hash_key=True, attr_name="statusShard")
+    received_time = UTCDateTimeAttribute(range_key=True, attr_name="received")
 
 
 class EventLog(Model):
@@ -35,47 +119,308 @@ class EventLog(Model):
 
     class Meta:
         table_name = os.environ.get("EVENT_LOG_TABLE", "event-log")
+        max_pool_connections = max_pool_connections()
+        connect_timeout_seconds = CONNECT_TIMEOUT
+        read_timeout_seconds = READ_TIMEOUT
+        max_retry_attempts = MAX_ATTEMPTS
 
     s3_key = UnicodeAttribute(hash_key=True)
     s3_bucket = UnicodeAttribute(attr_name="bucket")
     status = UnicodeAttribute()
+    # null for items that were written before the index was sharded, until the backfill
+    status_shard = UnicodeAttribute(null=True, attr_name="statusShard")
     gzip = BooleanAttribute(default=False)
+    etag = UnicodeAttribute(null=True)
+    s3_version = UnicodeAttribute(null=True, attr_name="version")
     function = UnicodeAttribute()
     region = UnicodeAttribute()
     functional_key_name = UnicodeAttribute(null=True, attr_name="funcKeyName")
     functional_key_value = UnicodeAttribute(null=True, attr_name="funcKeyVal")
     trace_id = UnicodeAttribute(null=True, attr_name="trace")
     received_time = UTCDateTimeAttribute(attr_name="received")
+    # when an idempotent handler claimed the object
+    claimed_time = UTCDateTimeAttribute(null=True, attr_name="claimed")
     processed_time = UTCDateTimeAttribute(null=True, attr_name="processed")
     error = UnicodeAttribute(null=True)
     expires = TTLAttribute(default_for_new=EVENT_LOG_TTL)
 
     status_index = StatusIndex()
 
+    # optional EventLogBatchWriter that buffers the writes of this log
+    writer = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.status and self.s3_key and self.status_shard is None:
+            self.status_shard = shard_key(self.status, self.s3_key)
+        self.persisted = False
+        self.duplicate = False
+        # seconds spent writing this log to DynamoDB (or to the batch writer)
+        self.write_time = 0.0
+        self._deferred_write = None
+        self._write_lock = threading.Lock()
+
+    def set_status(self, status: str):
+        self.status = status
+        self.status_shard = shard_key(status, self.s3_key)
+
     def set_functional_key(self, functional_key_name: str, functional_key_value: str):
-        self.functional_key_name = functional_key_name
-        self.functional_key_value = functional_key_value
+        self.set_attributes(functional_key_name=functional_key_name, functional_key_value=functional_key_value)
 
-    def mark_processed(self):
-        if not self.processed_time:
+    def set_attributes(self, **attributes):
+        """Set attributes while a deferred write may be serializing the log in its timer thread"""
+        with self._write_lock:
+            for name, value in attributes.items():
+                setattr(self, name, value)
+
+    @property
+    def object_version(self) -> Optional[str]:
+        return self.s3_version or self.etag
+
+    @property
+    def idempotency_key(self):
+        return self.s3_bucket, self.s3_key, self.object_version
+
+    def claim(self) -> bool:
+        """Write the PROCESSING entry, unless the same version of the object is already processed or being processed.
+
+        Returns False when the event log contains a DONE entry, or a PROCESSING entry that was claimed less than
+        `PROCESSING_LEASE_TIMEOUT` ago, for the same object version (or ETag).
+        """
+        self.claimed_time = datetime.now(timezone.utc)
+        lease_expired = EventLog.claimed_time.does_not_exist() | (
+            EventLog.claimed_time < self.claimed_time - PROCESSING_LEASE_TIMEOUT
+        )
+        condition = (
+            EventLog.s3_key.does_not_exist()
+            | (EventLog.status == STATUS_FAILED)
+            | ((EventLog.status == STATUS_PROCESSING) & lease_expired)
+        )
+        if self.s3_version:
+            condition |= EventLog.s3_version.does_not_exist() | (EventLog.s3_version != self.s3_version)
+        elif self.etag:
+            condition |= EventLog.etag.does_not_exist() | (EventLog.etag != self.etag)
+        try:
+            with self._timed_write():
+                self.save(condition=condition)
+        except PutError as e:
+            if e.cause_response_code == "ConditionalCheckFailedException":
+                return False
+            raise
+        self.persisted = True
+        return True
+
+    @contextmanager
+    def _timed_write(self):
+        start = time.perf_counter()
+        try:
+            with phase(PHASE_EVENT_LOG_WRITE):
+                yield
+        finally:
+            self.write_time += time.perf_counter() - start
+
+    def write(self):
+        with self._timed_write():
+            if self.writer:
+                self.writer.save(self)
+            else:
+                self.save()
+        self.persisted = True
+
+    def defer_write(self, delay: float):
+        """Postpone writing the PROCESSING entry with `delay` seconds.
+
+        When processing finishes within the delay, only the final state is written. Records that take longer still
+        leave a PROCESSING entry, but a Lambda that crashes or times out before the delay leaves no entry at all.
+        Attributes must be set with `set_attributes` (or `set_functional_key`) while the write is deferred.
+        """
+        self._deferred_write = threading.Timer(delay, self._write_deferred)
+        self._deferred_write.daemon = True
+        self._deferred_write.start()
+
+    def _write_deferred(self):
+        with self._write_lock:
+            if not self.persisted and not self.processed_time:
+                self.write()
+
+    def _write_final_state(self, status: str, error: str = None) -> bool:
+        """Set and write the final state, returns False when it was already written"""
+        with self._write_lock:
+            if self.processed_time:
+                return False
             self.processed_time = datetime.now(timezone.utc)
-            self.status = STATUS_DONE
-            self.save()
-            if self.logger:
-                self.logger.info("processed s3 object")
+            self.error = error
+            self.set_status(status)
+            if self._deferred_write:
+                self._deferred_write.cancel()
+            if self.persisted and not self.writer:
+                # only update the attributes that can have changed instead of rewriting the complete item
+                with self._timed_write():
+                    self.update(
+                        actions=[
+                            getattr(EventLog, name).set(getattr(self, name))
+                            for name in _UPDATABLE_ATTRIBUTES
+                            if getattr(self, name) is not None
+                        ]
+                    )
+            else:
+                self.write()
+            return True
+
+    def mark_processed(self):
+        if self._write_final_state(STATUS_DONE) and self.logger:
+            self.logger.info("processed s3 object")
 
     def mark_failed(self, error: str):
-        if not self.processed_time:
-            self.processed_time = datetime.now(timezone.utc)
-            self.error = str(error)
-            self.status = STATUS_FAILED
-            self.save()
-            if self.logger:
-                self.logger.warning(f"processing s3 object failed: {error}")
+        if self._write_final_state(STATUS_FAILED, str(error)) and self.logger:
+            self.logger.warning(f"processing s3 object failed: {error}")
+
+
+def _received_condition(received_after: datetime = None, received_before: datetime = None) -> Optional[Condition]:
+    if received_after and received_before:
+        return EventLog.received_time.between(received_after, received_before)
+    if received_after:
+        return EventLog.received_time >= received_after
+    if received_before:
+        return EventLog.received_time < received_before
+    return None
+
+
+def query_status(
+    statuses: Iterable[str],
+    filter_condition: Condition = None,
+    page_size: int = None,
+    rate_limit: float = None,
+    received_after: datetime = None,
+    received_before: datetime = None,
+    ordered: bool = False,
+) -> Iterator[EventLog]:
+    """Query every shard of the status index for every status in parallel and merge the (projected) logs.
+
+    The logs are streamed as the pages come in, or in order of received time when `ordered`. The received time bounds
+    are evaluated as key condition. `rate_limit` limits the consumed read capacity units per second of every shard.
+    """
+    range_key_condition = _received_condition(received_after, received_before)
+    queries = [
+        EventLog.status_index.query(
+            f"{status}#{shard}",
+            range_key_condition=range_key_condition,
+            filter_condition=filter_condition,
+            page_size=page_size,
+            rate_limit=rate_limit,
+        )
+        for status in statuses
+        for shard in range(status_index_shards())
+    ]
+    if ordered:
+        # every shard is sorted by received time, and is fetched in the background
+        return heapq.merge(*(parallel_iter([query]) for query in queries), key=lambda log: log.received_time)
+    return parallel_iter(queries)
+
+
+def hydrate(logs: Iterable[EventLog], attributes_to_get: Iterable[str] = None) -> Iterator[EventLog]:
+    """Fetch the complete items (or the `attributes_to_get`) of projected logs with BatchGetItem"""
+    logs = iter(logs)
+    while True:
+        keys = [log.s3_key for log in itertools.islice(logs, BATCH_GET_MAX_ITEMS)]
+        if not keys:
+            return
+        yield from EventLog.batch_get(keys, attributes_to_get=attributes_to_get)
+
+
+def _is_processed(idempotency_key) -> bool:
+    with _processed_cache_lock:
+        if idempotency_key in _processed_cache:
+            _processed_cache.move_to_end(idempotency_key)
+            return True
+        return False
+
+
+def _remember_processed(idempotency_key):
+    with _processed_cache_lock:
+        _processed_cache[idempotency_key] = True
+        _processed_cache.move_to_end(idempotency_key)
+        if len(_processed_cache) > PROCESSED_CACHE_SIZE:
+            _processed_cache.popitem(last=False)
+
+
+class EventLogBatchWriter:
+    """Buffers event log writes and flushes them with BatchWriteItem (retrying unprocessed items).
+
+    Successive writes of the same log (f.e. PROCESSING followed by DONE) are coalesced into one write. The buffer is
+    flushed when it contains `max_items` logs, when the oldest buffered write is older than `max_delay` seconds (checked
+    on every write) and when the writer is used as context manager, on exit, even when an exception is raised.
+    """
+
+    def __init__(self, max_items: int = BATCH_WRITE_MAX_ITEMS, max_delay: float = None):
+        self.max_items = min(max_items, BATCH_WRITE_MAX_ITEMS)
+        self.max_delay = max_delay
+        # seconds spent in BatchWriteItem
+        self.flush_time = 0.0
+        self._buffer = {}
+        self._oldest_write = None
+        self._lock = threading.Lock()
+
+    def save(self, log: EventLog):
+        # buffer a snapshot, the log can still change before the buffer is flushed
+        snapshot = EventLog.from_raw_data(log.serialize())
+        with self._lock:
+            if not self._buffer:
+                self._oldest_write = time.monotonic()
+            self._buffer[log.s3_key] = snapshot
+            flush = len(self._buffer) >= self.max_items or (
+                self.max_delay is not None and time.monotonic() - self._oldest_write >= self.max_delay
+            )
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            logs = list(self._buffer.values())
+            self._buffer = {}
+        if logs:
+            start = time.perf_counter()
+            try:
+                with phase(PHASE_EVENT_LOG_WRITE), EventLog.batch_write() as batch:
+                    for log in logs:
+                        batch.save(log)
+            finally:
+                with self._lock:
+                    self.flush_time += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
 
 
 @contextmanager
-def event_log(s3_bucket: str, s3_key: str, function_name: str, logger: Logger) -> EventLog:
+def event_log(
+    s3_bucket: str,
+    s3_key: str,
+    function_name: str,
+    logger: Logger,
+    writer: EventLogBatchWriter = None,
+    deferred_write_delay: float = None,
+    idempotent: bool = False,
+    etag: str = None,
+    version_id: str = None,
+    received_time: datetime = None,
+) -> EventLog:
+    """Context manager that logs the processing of an S3 object in the event log table.
+
+    A PROCESSING entry is written on entry, unless `deferred_write_delay` is given: then the PROCESSING entry is only
+    written when processing takes longer than the delay (in seconds), see `EventLog.defer_write`.
+
+    When `idempotent`, the PROCESSING entry is written with a condition that the same object version (or ETag) is not
+    DONE or being processed yet (see `EventLog.claim`). Objects that were processed by the same warm container are
+    recognized without calling DynamoDB. For duplicates, the yielded log has `duplicate` set and the caller should skip
+    processing. Objects without version and ETag are always processed, because a re-upload can't be told apart from a
+    duplicate notification.
+
+    `received_time` is the time of the S3 event, it defaults to now.
+    """
     logger.append_keys(s3_bucket=s3_bucket, s3_key=s3_key)
     logger.debug("processing s3 event")
     log = EventLog(
@@ -84,14 +429,29 @@ def event_log(s3_bucket: str, s3_key: str, function_name: str, logger: Logger) -
         s3_bucket=s3_bucket,
         function=function_name,
         region=os.environ.get("AWS_REGION", "eu-west-1"),
-        received_time=datetime.now(timezone.utc),  # TODO get from s3 record
+        received_time=received_time or datetime.now(timezone.utc),
+        etag=etag,
+        s3_version=version_id,
     )
     # pylint: disable=attribute-defined-outside-init
     log.logger = logger
-    log.save()
+    log.writer = writer
+    idempotent = idempotent and log.object_version is not None
+    if idempotent:
+        if _is_processed(log.idempotency_key) or not log.claim():
+            log.duplicate = True
+            logger.info("skipping already processed s3 object")
+            yield log
+            return
+    elif deferred_write_delay is None or deferred_write_delay <= 0:
+        log.write()
+    else:
+        log.defer_write(deferred_write_delay)
     try:
         yield log
         log.mark_processed()
+        if idempotent and log.status == STATUS_DONE:
+            _remember_processed(log.idempotency_key)
     except Exception as e:
         if logger.log_level == "DEBUG":
             logger.exception("error processing s3 object")
@@ -0,0 +1,216 @@
+"""Processing throughput, latency percentiles and failure rates from the event log.
+
+The logs are streamed (from a parallel scan, or from the status index for a time range) and aggregated in one pass.
+Memory does not grow with the number of logs:
+* latencies (processed - received time) go into a log-linear histogram per function, a fixed size `array` of counters
+  with buckets that are `HISTOGRAM_GROWTH` apart (percentiles are accurate within 2.5%)
+* throughput is counted per function and minute (the event log TTL bounds the number of minutes)
+
+    python -m cdk_example_app.common.event_log_analytics --since 60 --format csv --output summary.csv
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from pynamodb.indexes import AllProjection
+
+from cdk_example_app.common.event_log import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_PROCESSING,
+    EventLog,
+    hydrate,
+    query_status,
+)
+from cdk_example_app.common.util import parallel_iter
+
+HISTOGRAM_GROWTH = 1.05
+HISTOGRAM_MIN = 0.001  # seconds, smaller latencies are counted in the first bucket
+HISTOGRAM_MAX = 86400  # seconds, larger latencies are counted in the last bucket
+PERCENTILES = (50, 95, 99)
+DEFAULT_SEGMENTS = 4
+# the attributes that the analytics need (DynamoDB names), the scan doesn't fetch the others
+ANALYTICS_ATTRIBUTES = ["s3_key", "function", "status", "received", "processed"]
+
+_LOG_GROWTH = math.log(HISTOGRAM_GROWTH)
+_BUCKETS = int(math.log(HISTOGRAM_MAX / HISTOGRAM_MIN) / _LOG_GROWTH) + 2
+
+
+class LatencyHistogram:
+    """Fixed size histogram of latencies (in seconds) with logarithmic buckets"""
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * _BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket(latency: float) -> int:
+        if latency <= HISTOGRAM_MIN:
+            return 0
+        return min(_BUCKETS - 1, int(math.log(latency / HISTOGRAM_MIN) / _LOG_GROWTH) + 1)
+
+    @staticmethod
+    def bucket_value(bucket: int) -> float:
+        """Midpoint of the bucket"""
+        if bucket == 0:
+            return HISTOGRAM_MIN
+        return HISTOGRAM_MIN * HISTOGRAM_GROWTH ** (bucket - 0.5)
+
+    def add(self, latency: float):
+        self.counts[self.bucket(latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percentile / 100))
+        bucket = next(bucket for bucket, seen in enumerate(itertools.accumulate(self.counts)) if seen >= rank)
+        return min(self.bucket_value(bucket), self.max)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class FunctionStats:
+    def __init__(self):
+        self.statuses = Counter()
+        self.latency = LatencyHistogram()
+        self.received_per_minute = Counter()
+        self.processed_per_minute = Counter()
+
+
+def _minute(time: datetime) -> datetime:
+    return time.replace(second=0, microsecond=0)
+
+
+class EventLogAnalytics:
+    """Aggregates event logs per function (and minute)"""
+
+    def __init__(self):
+        self.functions: Dict[str, FunctionStats] = defaultdict(FunctionStats)
+
+    def add(self, log: EventLog):
+        stats = self.functions[log.function]
+        stats.statuses[log.status] += 1
+        if log.received_time:
+            stats.received_per_minute[_minute(log.received_time)] += 1
+        if log.processed_time:
+            stats.processed_per_minute[_minute(log.processed_time)] += 1
+            if log.received_time and log.status == STATUS_DONE:
+                stats.latency.add((log.processed_time - log.received_time).total_seconds())
+
+    def add_all(self, logs: Iterable[EventLog]) -> "EventLogAnalytics":
+        for log in logs:
+            self.add(log)
+        return self
+
+    def summary(self) -> List[dict]:
+        """One row per function with the counts, failure rate, latency percentiles (seconds) and peak throughput"""
+        rows = []
+        for function, stats in sorted(self.functions.items()):
+            total = sum(stats.statuses.values())
+            finished = stats.statuses[STATUS_DONE] + stats.statuses[STATUS_FAILED]
+            row = {
+                "function": function,
+                "total": total,
+                "done": stats.statuses[STATUS_DONE],
+                "failed": stats.statuses[STATUS_FAILED],
+                "processing": stats.statuses[STATUS_PROCESSING],
+                "failureRate": stats.statuses[STATUS_FAILED] / finished if finished else None,
+                "meanLatency": stats.latency.mean,
+                **{f"p{percentile}Latency": stats.latency.percentile(percentile) for percentile in PERCENTILES},
+                "maxLatency": stats.latency.max if stats.latency.count else None,
+                "peakProcessedPerMinute": max(stats.processed_per_minute.values(), default=0),
+            }
+            rows.append(row)
+        return rows
+
+    def throughput(self) -> List[dict]:
+        """One row per function and minute with the number of received and processed objects"""
+        rows = []
+        for function, stats in sorted(self.functions.items()):
+            for minute in sorted(stats.received_per_minute.keys() | stats.processed_per_minute.keys()):
+                rows.append(
+                    {
+                        "function": function,
+                        "minute": minute.isoformat(),
+                        "received": stats.received_per_minute[minute],
+                        "processed": stats.processed_per_minute[minute],
+                    }
+                )
+        return rows
+
+
+def scan_logs(segments: int = DEFAULT_SEGMENTS, rate_limit: float = None) -> Iterator[EventLog]:
+    """Stream all logs with a parallel scan, only fetching the attributes that the analytics need"""
+    return parallel_iter(
+        [
+            EventLog.scan(
+                segment=segment,
+                total_segments=segments,
+                rate_limit=rate_limit,
+                attributes_to_get=ANALYTICS_ATTRIBUTES,
+            )
+            for segment in range(segments)
+        ]
+    )
+
+
+def recent_logs(since: timedelta, rate_limit: float = None) -> Iterator[EventLog]:
+    """Stream the logs that were received in the last `since` from the status index.
+
+    The status and processed time are only projected with an ALL projection, with the other projections the analytics
+    attributes are fetched with BatchGetItem.
+    """
+    received_after = datetime.now(timezone.utc) - since
+    logs = query_status(
+        [STATUS_PROCESSING, STATUS_DONE, STATUS_FAILED], rate_limit=rate_limit, received_after=received_after
+    )
+    if isinstance(EventLog.status_index.Meta.projection, AllProjection):
+        return logs
+    return hydrate(logs, ANALYTICS_ATTRIBUTES)
+
+
+def write_csv(rows: List[dict], file: TextIO):
+    if rows:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_json(rows: List[dict], file: TextIO):
+    json.dump(rows, file, indent=2)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Throughput and latency of the event log")
+    parser.add_argument("--since", type=float, help="minutes, query the status index instead of scanning the table")
+    parser.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS, help="parallel scan segments")
+    parser.add_argument("--rate-limit", type=float, help="read capacity units per second per segment or shard")
+    parser.add_argument("--report", choices=["summary", "throughput"], default="summary")
+    parser.add_argument("--format", choices=["csv", "json"], default="json")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    options = parser.parse_args(args)
+    if options.since:
+        logs = recent_logs(timedelta(minutes=options.since), options.rate_limit)
+    else:
+        logs = scan_logs(options.segments, options.rate_limit)
+    analytics = EventLogAnalytics().add_all(logs)
+    rows = analytics.summary() if options.report == "summary" else analytics.throughput()
+    (write_csv if options.format == "csv" else write_json)(rows, options.output)
+
+
+if __name__ == "__main__":
+    main()
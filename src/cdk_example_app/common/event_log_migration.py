@@ -0,0 +1,69 @@
+"""Backfill of the sharded status key of the event log.
+
+The status index is keyed on `statusShard` (see `event_log.shard_key`), items that were written before the index was
+sharded don't have that attribute and are not in the index. Migrating a table:
+1. add the `status_shard_index` GSI to the table, new writes populate it right away
+2. run the backfill, which scans the table in parallel segments and sets the missing (or outdated, after changing
+   the number of shards) shard keys
+3. remove the old `status_index` GSI
+
+    python -m cdk_example_app.common.event_log_migration --segments 8 --rate-limit 500
+"""
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from pynamodb.exceptions import UpdateError
+
+from cdk_example_app.common.event_log import EventLog, shard_key
+
+DEFAULT_SEGMENTS = 8
+
+
+def backfill_segment(segment: int, total_segments: int, rate_limit: float = None, dry_run: bool = False) -> Counter:
+    counts = Counter()
+    for log in EventLog.scan(segment=segment, total_segments=total_segments, rate_limit=rate_limit):
+        expected = shard_key(log.status, log.s3_key)
+        if log.status_shard == expected:
+            counts["unchanged"] += 1
+            continue
+        if dry_run:
+            counts["updated"] += 1
+            continue
+        try:
+            # a concurrent status change writes the new shard key itself
+            log.update(actions=[EventLog.status_shard.set(expected)], condition=EventLog.status == log.status)
+            counts["updated"] += 1
+        except UpdateError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            counts["skipped"] += 1
+    return counts
+
+
+def backfill_status_shards(
+    segments: int = DEFAULT_SEGMENTS, rate_limit: float = None, dry_run: bool = False
+) -> Counter:
+    """Set the shard key of every log, scanning `segments` segments in parallel.
+
+    `rate_limit` limits the consumed read capacity units per second of every segment. Returns the number of updated,
+    unchanged and skipped (changed during the backfill) logs.
+    """
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = executor.map(
+            lambda segment: backfill_segment(segment, segments, rate_limit, dry_run), range(segments)
+        )
+        return sum(results, Counter())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Set the sharded status key of the event log items")
+    parser.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS, help="parallel scan segments")
+    parser.add_argument("--rate-limit", type=float, help="read capacity units per second per segment")
+    parser.add_argument("--dry-run", action="store_true", help="only count the items that would be updated")
+    options = parser.parse_args(args)
+    print(dict(backfill_status_shards(options.segments, options.rate_limit, options.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
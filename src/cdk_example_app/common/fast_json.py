@@ -0,0 +1,53 @@
+"""Compact json serialization with orjson when it's installed (the `fast-json` extra), falling back to the stdlib.
+
+Both implementations serialize datetimes and dates as ISO 8601, UUIDs as strings and Decimals (as returned by DynamoDB)
+as numbers.
+"""
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# pylint: disable=no-member
+_SEPARATORS = (",", ":")
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=_SEPARATORS).encode()
+
+
+def dumps(obj, **kwargs) -> str:
+    """Serialize to a compact json string, with the stdlib when kwargs of json.dumps (f.e. indent) are passed"""
+    if kwargs:
+        kwargs.setdefault("default", _default)
+        if kwargs.get("indent") is None:
+            kwargs.setdefault("separators", _SEPARATORS)
+        return json.dumps(obj, **kwargs)
+    if orjson:
+        return dumps_bytes(obj).decode()
+    return json.dumps(obj, default=_default, separators=_SEPARATORS)
+
+
+def loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,9 +1,145 @@
+"""requests session with a default timeout, retries and lazy trace instrumentation.
+
+Every host gets a circuit breaker and a retry budget, so that a degraded service doesn't make every invocation sleep
+through its retries (and amplify the load on that service):
+* the circuit opens after `FAILURE_THRESHOLD` consecutive failed requests (connection errors, timeouts or one of the
+  retried statuses). Requests to the host fail fast with a `CircuitOpenError` until `RESET_TIMEOUT` (or the Retry-After
+  of the last response when that's longer) has passed, then one trial request decides whether the circuit closes again.
+* retries take a token from a token bucket per host, when the bucket is empty the request is not retried.
+* a retry is not attempted when its backoff (or Retry-After) doesn't fit in the remaining time of the Lambda invocation,
+  and request timeouts are shortened to the remaining time.
+"""
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlparse
+
 import requests
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
 from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
 from urllib3.util.retry import Retry
 
+from cdk_example_app.common import invocation
+from cdk_example_app.common.tracing.lazy_tracer import get_tracer, tracing_enabled
+
 DEFAULT_TIMEOUT = 5  # seconds
+FAILURE_THRESHOLD = 5  # consecutive failures that open the circuit of a host
+RESET_TIMEOUT = 30  # seconds before an open circuit lets a trial request through
+RETRY_BUDGET_CAPACITY = 10  # retries per host in a burst
+RETRY_BUDGET_REFILL_RATE = 1.0  # retries per second per host
+# seconds that are kept to finish the invocation after a retry or request
+REMAINING_TIME_MARGIN = 1.0
+MIN_TIMEOUT = 0.1  # seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without sending the request when the circuit of the host is open"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Returns whether a request may be sent, an open circuit lets one trial request through after the timeout"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.open_until = time.monotonic() + max(self.reset_timeout, retry_after or 0)
+
+
+class RetryBudget:
+    """Token bucket that allows `capacity` retries in a burst and refills at `refill_rate` retries per second"""
+
+    def __init__(self, capacity: float = RETRY_BUDGET_CAPACITY, refill_rate: float = RETRY_BUDGET_REFILL_RATE):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class HostGuard:
+    """Circuit breaker, retry budget and request counters of one host"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.budget = RetryBudget()
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Returns the breaker state and the counters, which are reset when `reset` is set"""
+        with self._lock:
+            counters = dict(self.counters)
+            if reset:
+                self.counters.clear()
+        return {"state": self.breaker.state, **counters}
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def host_guard(host: str) -> HostGuard:
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = HostGuard()
+        return _hosts[host]
+
+
+def _fits_in_remaining_time(seconds: float) -> bool:
+    remaining = invocation.remaining_time()
+    return remaining is None or seconds + REMAINING_TIME_MARGIN <= remaining
+
+
+def _limit_timeout(timeout):
+    """Shorten (connect and read) timeouts to the remaining time of the invocation"""
+    remaining = invocation.remaining_time()
+    if remaining is None:
+        return timeout
+    limit = max(MIN_TIMEOUT, remaining - REMAINING_TIME_MARGIN)
+    if isinstance(timeout, tuple):
+        return tuple(limit if value is None else min(value, limit) for value in timeout)
+    return min(timeout, limit)
 
 
 class TimeoutHTTPAdapter(HTTPAdapter):
@@ -21,11 +157,70 @@ class TimeoutHTTPAdapter(HTTPAdapter):
     def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
         if timeout is None:
             timeout = self.timeout
-        return super().send(request, stream, timeout, verify, cert, proxies)
+        host = urlparse(request.url).hostname
+        guard = host_guard(host)
+        if not guard.breaker.allow_request():
+            guard.count("rejected")
+            raise CircuitOpenError(f"Circuit of {host} is open", request=request)
+        guard.count("requests")
+        try:
+            response = super().send(request, stream, _limit_timeout(timeout), verify, cert, proxies)
+        except Exception:
+            guard.count("failures")
+            guard.breaker.record_failure()
+            raise
+        if response.status_code in (self.max_retries.status_forcelist or ()):
+            guard.count("failures")
+            retry_after = response.headers.get("Retry-After")
+            guard.breaker.record_failure(_parse_retry_after(self.max_retries, retry_after))
+        else:
+            guard.breaker.record_success()
+        return response
+
+
+def _parse_retry_after(retry: Retry, retry_after: Optional[str]) -> Optional[float]:
+    try:
+        return retry.parse_retry_after(retry_after) if retry_after else None
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+class BudgetedRetry(Retry):
+    """Retry that is only allowed when the circuit of the host is closed, the retry budget of the host has a token and
+    the backoff fits in the remaining time of the invocation.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if _pool is None:
+            return new_retry
+        guard = host_guard(_pool.host)
+        denied = self._denied(new_retry, response, guard)
+        if denied:
+            guard.count("retriesDenied")
+            raise MaxRetryError(_pool, url, error or ResponseError(denied)) from error
+        guard.count("retries")
+        return new_retry
+
+    @staticmethod
+    def _denied(new_retry: Retry, response, guard: HostGuard) -> Optional[str]:
+        """Returns the reason why the retry is not allowed"""
+        if guard.breaker.state != CLOSED:
+            return "circuit is open"
+        sleep = None
+        if response is not None and new_retry.respect_retry_after_header:
+            sleep = new_retry.get_retry_after(response)
+        if sleep is None:
+            sleep = new_retry.get_backoff_time()
+        if not _fits_in_remaining_time(sleep):
+            return f"retry after {sleep}s exceeds the remaining time"
+        if not guard.budget.try_acquire():
+            return "retry budget exhausted"
+        return None
 
 
 # retry 1 after 1 second, retry 2 after 2 seconds
-retries = Retry(
+retries = BudgetedRetry(
     total=2,
     backoff_factor=2,
     status_forcelist=[
@@ -42,8 +237,52 @@ retries = Retry(
 )
 timeout_adapter = TimeoutHTTPAdapter(max_retries=retries)
 
-http = requests.Session()
+
+@lru_cache
+def _instrument_requests():
+    # pylint: disable=import-outside-toplevel
+    from opentelemetry.instrumentation.requests import RequestsInstrumentor
+
+    get_tracer()
+    RequestsInstrumentor().instrument()
+
+
+def instrument_requests():
+    """Instrument requests (once) when tracing is enabled, the instrumentation is imported on first use"""
+    if tracing_enabled():
+        _instrument_requests()
+
+
+class InstrumentedSession(requests.Session):
+    """Session that instruments requests on the first request instead of at import time"""
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        instrument_requests()
+        return super().request(method, url, *args, **kwargs)
+
+
+http = InstrumentedSession()
 http.mount("https://", timeout_adapter)
 http.mount("http://", timeout_adapter)
 
-RequestsInstrumentor().instrument()
+
+def http_metrics(reset: bool = False) -> dict:
+    """Returns the circuit state and request, failure, rejected and retry counts per host"""
+    with _hosts_lock:
+        guards = dict(_hosts)
+    return {host: guard.snapshot(reset) for host, guard in guards.items()}
+
+
+def add_http_metrics(metrics):
+    """Add the circuit state and the counts since the previous call per host to an aws_lambda_powertools Metrics
+    instance
+    """
+    # pylint: disable=import-outside-toplevel
+    from aws_lambda_powertools.metrics import MetricUnit
+
+    for host, snapshot in http_metrics(reset=True).items():
+        metrics.add_metric(
+            name=f"HttpClient.{host}.circuitOpen", unit=MetricUnit.Count, value=int(snapshot["state"] != CLOSED)
+        )
+        for name in ("requests", "failures", "rejected", "retries", "retriesDenied"):
+            metrics.add_metric(name=f"HttpClient.{host}.{name}", unit=MetricUnit.Count, value=snapshot.get(name, 0))
@@ -0,0 +1,32 @@
+"""Remaining time of the current Lambda invocation.
+
+Lambda runs one invocation at a time in an execution environment, so the deadline is kept in a module level holder
+(instead of a context variable), which makes it visible to the worker threads of the event handlers as well.
+"""
+import time
+from typing import Optional
+
+
+class _Deadline:
+    expires: Optional[float] = None
+
+
+_deadline = _Deadline()
+
+
+def start(context):
+    """Record the deadline of the invocation, it's cleared when the context has no `get_remaining_time_in_millis`"""
+    remaining_millis = None
+    if hasattr(context, "get_remaining_time_in_millis"):
+        remaining_millis = context.get_remaining_time_in_millis()
+    if isinstance(remaining_millis, (int, float)):
+        _deadline.expires = time.monotonic() + remaining_millis / 1000
+    else:
+        _deadline.expires = None
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds until the invocation times out, None when unknown"""
+    if _deadline.expires is None:
+        return None
+    return _deadline.expires - time.monotonic()
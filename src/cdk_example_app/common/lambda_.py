@@ -1,15 +1,118 @@
+"""Lambda function info (last modified time and tags) with a TTL cache and a concurrent bulk lookup."""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from typing import Dict, Iterable, Optional
 
-import boto3
+from botocore.exceptions import ClientError
+
+from cdk_example_app.common import aws_clients
+
+FUNCTION_INFO_TTL = 300  # seconds
+DEFAULT_MAX_CONCURRENCY = 8
+# throttled calls are retried (on top of the botocore retries) with exponential backoff and full jitter
+THROTTLING_RETRIES = 5
+THROTTLING_BASE_DELAY = 0.5  # seconds
+THROTTLING_MAX_DELAY = 8  # seconds
+THROTTLING_ERROR_CODES = ("TooManyRequestsException", "ThrottlingException", "Throttling")
+
+_cache = {}
+_cache_lock = threading.Lock()
 
 
 @lru_cache
 def lambda_client():
-    return boto3.client("lambda")
+    return aws_clients.client("lambda")
+
+
+def _call_with_backoff(operation, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return operation(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES or attempt == THROTTLING_RETRIES:
+                raise
+        time.sleep(random.uniform(0, min(THROTTLING_MAX_DELAY, THROTTLING_BASE_DELAY * 2 ** attempt)))
+        attempt += 1
+
+
+def _cached(lambda_arn: str) -> Optional[dict]:
+    with _cache_lock:
+        entry = _cache.get(lambda_arn)
+    if entry is None or entry[0] <= time.monotonic():
+        return None
+    return entry[1]
+
+
+def _cache_info(lambda_arn: str, info: dict, ttl: float):
+    with _cache_lock:
+        _cache[lambda_arn] = (time.monotonic() + ttl, info)
+
+
+def clear_function_info_cache():
+    with _cache_lock:
+        _cache.clear()
 
 
-def get_function_info(lambda_arn):
-    fn_info = lambda_client().get_function(FunctionName=lambda_arn)
-    info = {"lastModified": fn_info["Configuration"]["LastModified"]}
-    info.update(lambda_client().list_tags(Resource=lambda_arn)["Tags"])
+def _fetch_function_info(lambda_arn: str, last_modified: str = None) -> dict:
+    if last_modified is None:
+        fn_info = _call_with_backoff(lambda_client().get_function, FunctionName=lambda_arn)
+        last_modified = fn_info["Configuration"]["LastModified"]
+    info = {"lastModified": last_modified}
+    info.update(_call_with_backoff(lambda_client().list_tags, Resource=lambda_arn)["Tags"])
     return info
+
+
+def get_function_info(lambda_arn, ttl: float = FUNCTION_INFO_TTL):
+    """Returns the last modified time and the tags of the function, cached for `ttl` seconds per ARN"""
+    info = _cached(lambda_arn)
+    if info is None:
+        info = _fetch_function_info(lambda_arn)
+        _cache_info(lambda_arn, info, ttl)
+    return info
+
+
+def list_last_modified() -> Dict[str, str]:
+    """Returns the last modified time of every function (by ARN and by name) with one paginated list_functions sweep"""
+    last_modified = {}
+    for page in lambda_client().get_paginator("list_functions").paginate():
+        for function in page["Functions"]:
+            last_modified[function["FunctionArn"]] = function["LastModified"]
+            last_modified[function["FunctionName"]] = function["LastModified"]
+    return last_modified
+
+
+def get_functions_info(
+    lambda_arns: Iterable[str],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    prefetch: bool = False,
+    ttl: float = FUNCTION_INFO_TTL,
+) -> Dict[str, Optional[dict]]:
+    """Bulk variant of get_function_info that fetches the uncached functions concurrently.
+
+    With `prefetch`, the last modified times are taken from one list_functions sweep, so only the tags are fetched per
+    function. Functions that don't exist are returned as None.
+    """
+    lambda_arns = list(dict.fromkeys(lambda_arns))
+    result = {lambda_arn: _cached(lambda_arn) for lambda_arn in lambda_arns}
+    missing = [lambda_arn for lambda_arn, info in result.items() if info is None]
+    if not missing:
+        return result
+    last_modified = list_last_modified() if prefetch else {}
+
+    def fetch(lambda_arn: str) -> Optional[dict]:
+        try:
+            info = _fetch_function_info(lambda_arn, last_modified.get(lambda_arn))
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ResourceNotFoundException":
+                return None
+            raise
+        _cache_info(lambda_arn, info, ttl)
+        return info
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(missing))) as executor:
+        result.update(zip(missing, executor.map(fetch, missing)))
+    return result
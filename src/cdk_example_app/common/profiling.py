@@ -0,0 +1,226 @@
+"""Hot path profiling of the event handlers, switched on with environment variables.
+
+With PROFILING_ENABLED, the event handlers time their phases (S3 GetObject, body decoding, functional key extraction,
+the wrapped handler and the event log writes) with `perf_counter_ns` and log a summary per invocation. A fraction
+PROFILING_SAMPLE_RATE of those invocations additionally runs tracemalloc, and cProfile in either the invoking thread or
+the record worker threads (Python 3.12+ allows only one active profiler). The profiles are written in pstats format to
+PROFILING_OUTPUT, a directory (default /tmp) or an s3://bucket/prefix, and can be inspected with `python -m pstats` or
+snakeviz.
+
+Like the invocation deadline, the profile of the current invocation is kept in a module level holder. When profiling
+is disabled, `phase` returns a shared no-op context manager, so the instrumented hot path only pays for one attribute
+lookup.
+"""
+# pylint: disable=import-outside-toplevel
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from typing import ContextManager, Dict, List, Optional
+
+from cdk_example_app.common import aws_clients
+
+PROFILING_ENABLED_ENV_VARIABLE = "PROFILING_ENABLED"
+PROFILING_SAMPLE_RATE_ENV_VARIABLE = "PROFILING_SAMPLE_RATE"
+PROFILING_OUTPUT_ENV_VARIABLE = "PROFILING_OUTPUT"
+DEFAULT_PROFILING_OUTPUT = "/tmp"
+
+PHASE_S3_GET = "s3Get"
+PHASE_DECODE = "decode"
+PHASE_FUNCTIONAL_KEY = "functionalKey"
+PHASE_HANDLER = "handler"
+PHASE_EVENT_LOG_WRITE = "eventLogWrite"
+
+_DISABLED = nullcontext()
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILING_ENABLED_ENV_VARIABLE, "false").lower() in ("true", "1", "yes", "on")
+
+
+def sample_rate() -> float:
+    return float(os.environ.get(PROFILING_SAMPLE_RATE_ENV_VARIABLE, 0))
+
+
+@lru_cache
+def s3_client():
+    return aws_clients.client("s3")
+
+
+class _PhaseTimer:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: "InvocationProfile", name: str):
+        self.profile = profile
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.add(self.name, time.perf_counter_ns() - self.start)
+
+
+class InvocationProfile:
+    """Phase timings of an invocation, and the cProfile profiles and tracemalloc peak when `sampled`"""
+
+    def __init__(self, name: str, sampled: bool = False):
+        self.name = name
+        self.sampled = sampled
+        self.start = time.perf_counter_ns()
+        self.duration = None
+        # phase name -> [count, total ns, max ns]
+        self.phases: Dict[str, List[int]] = {}
+        self.profiles = []
+        self.peak_memory = None
+        self.output = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration_ns: int):
+        with self._lock:
+            timing = self.phases.setdefault(name, [0, 0, 0])
+            timing[0] += 1
+            timing[1] += duration_ns
+            timing[2] = max(timing[2], duration_ns)
+
+    @contextmanager
+    def profile_thread(self):
+        """Run cProfile in the current thread when the invocation is sampled"""
+        if not self.sampled:
+            yield
+            return
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows only one active profiler (f.e. of another worker thread), profiling is best effort
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self.profiles.append(profiler)
+
+    def summary(self) -> dict:
+        """Log fields with the durations in milliseconds"""
+        summary = {
+            "message": "invocation profile",
+            "handler": self.name,
+            "durationMs": _millis(self.duration),
+            "phases": {
+                name: {"count": count, "totalMs": _millis(total), "maxMs": _millis(max_)}
+                for name, (count, total, max_) in self.phases.items()
+            },
+        }
+        if self.peak_memory is not None:
+            summary["peakMemoryBytes"] = self.peak_memory
+        if self.output:
+            summary["profile"] = self.output
+        return summary
+
+
+class _Current:
+    profile: Optional[InvocationProfile] = None
+
+
+_current = _Current()
+
+
+def _millis(duration_ns: Optional[int]) -> Optional[float]:
+    return None if duration_ns is None else round(duration_ns / 1_000_000, 3)
+
+
+def phase(name: str) -> ContextManager:
+    """Time a phase of the current invocation, a no-op when it isn't profiled"""
+    profile = _current.profile
+    if profile is None:
+        return _DISABLED
+    return _PhaseTimer(profile, name)
+
+
+def profile_thread() -> ContextManager:
+    """Run cProfile in a worker thread of a sampled invocation"""
+    profile = _current.profile
+    if profile is None:
+        return _DISABLED
+    return profile.profile_thread()
+
+
+def write_profile(profile: InvocationProfile, request_id: str = None) -> Optional[str]:
+    """Write the merged cProfile profiles to PROFILING_OUTPUT, returns the path or S3 URL"""
+    if not profile.profiles:
+        return None
+    import pstats
+
+    stats = pstats.Stats(profile.profiles[0])
+    for profiler in profile.profiles[1:]:
+        stats.add(profiler)
+    output = os.environ.get(PROFILING_OUTPUT_ENV_VARIABLE, DEFAULT_PROFILING_OUTPUT)
+    file_name = f"{profile.name}-{request_id or uuid.uuid4().hex}.prof"
+    if not output.startswith("s3://"):
+        path = os.path.join(output, file_name)
+        stats.dump_stats(path)
+        return path
+    path = os.path.join(DEFAULT_PROFILING_OUTPUT, file_name)
+    stats.dump_stats(path)
+    bucket, _, prefix = output[len("s3://") :].partition("/")
+    key = f"{prefix.rstrip('/')}/{file_name}" if prefix else file_name
+    try:
+        s3_client().upload_file(path, bucket, key)
+    finally:
+        os.remove(path)
+    return f"s3://{bucket}/{key}"
+
+
+def handler_name(func) -> str:
+    """Name of the profiles of a handler function"""
+    return f"{func.__module__}.{func.__name__}"
+
+
+@contextmanager
+def profile_invocation(name: str, context, logger, in_thread: bool = True):
+    """Profile an invocation when PROFILING_ENABLED, logging the summary with `logger` at the end.
+
+    Without `in_thread`, cProfile does not run in the invoking thread, only in the worker threads that use
+    `profile_thread`.
+    """
+    if not profiling_enabled():
+        yield None
+        return
+    profile = InvocationProfile(name, sampled=random.random() < sample_rate())
+    started_tracemalloc = False
+    if profile.sampled:
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracemalloc = True
+        elif hasattr(tracemalloc, "reset_peak"):
+            # Python 3.9+, on 3.8 the peak of a tracemalloc started by someone else includes earlier allocations
+            tracemalloc.reset_peak()
+    _current.profile = profile
+    try:
+        with profile.profile_thread() if in_thread else nullcontext():
+            yield profile
+    finally:
+        _current.profile = None
+        profile.duration = time.perf_counter_ns() - profile.start
+        if profile.sampled:
+            profile.peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracemalloc:
+                tracemalloc.stop()
+            try:
+                request_id = getattr(context, "aws_request_id", None)
+                profile.output = write_profile(profile, request_id if isinstance(request_id, str) else None)
+            # pylint: disable=broad-except
+            except Exception as e:
+                logger.warning({"error": "Exception while writing the profile", "message": str(e)})
+        logger.info(profile.summary())
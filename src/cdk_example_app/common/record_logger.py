@@ -0,0 +1,41 @@
+from aws_lambda_powertools import Logger
+
+
+class RecordLogger:
+    """Logger facade that keeps appended keys local to a single record.
+
+    The powertools Logger stores appended keys in its (shared) formatter, so records that are processed concurrently
+    would overwrite each other's keys. A RecordLogger passes its keys as `extra` with every log call instead.
+    """
+
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self.keys = {}
+
+    @property
+    def log_level(self):
+        return self.logger.log_level
+
+    def append_keys(self, **additional_keys):
+        self.keys.update(additional_keys)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log("debug", msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log("info", msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log("warning", msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log("error", msg, *args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        self._log("exception", msg, *args, **kwargs)
+
+    def _log(self, level: str, msg, *args, **kwargs):
+        kwargs["extra"] = {**self.keys, **kwargs.get("extra", {})}
+        # report the location of the caller instead of this facade
+        kwargs.setdefault("stacklevel", 3)
+        getattr(self.logger, level)(msg, *args, **kwargs)
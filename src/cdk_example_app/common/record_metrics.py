@@ -0,0 +1,95 @@
+"""Per record lag and timing metrics of the event handlers, in CloudWatch Embedded Metric Format.
+
+The timings of all records of an invocation are added to an aws_lambda_powertools `Metrics` instance, which keeps the
+values of a metric in one array: flushing the metrics once per invocation (decorate the handler with
+`metrics.log_metrics`) writes one EMF log line instead of one per record.
+
+The event handlers add the metrics of the AWS and HTTP clients to the same instance, see `add_client_metrics`.
+"""
+import sys
+import threading
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from cdk_example_app.common import aws_clients
+
+HTTP_SESSION_MODULE = "cdk_example_app.common.http_session"
+
+
+def parse_event_time(event_time: Optional[str]) -> Optional[datetime]:
+    """Parse the ISO 8601 eventTime of an S3 record (f.e. 2021-06-01T12:00:00.123Z)"""
+    if not event_time:
+        return None
+    return datetime.fromisoformat(event_time.replace("Z", "+00:00"))
+
+
+def parse_epoch_millis(timestamp: Optional[str]) -> Optional[datetime]:
+    """Parse an SQS timestamp attribute (milliseconds since the epoch)"""
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(int(timestamp) / 1000, timezone.utc)
+
+
+@dataclass
+class RecordTimings:
+    """Timings of one record in seconds, the metric names are the field names in camel case"""
+
+    # from the S3 event (or sending the SQS message) until processing starts
+    queue_lag: Optional[float] = None
+    # from sending the SQS message until it was first received
+    sqs_queue_time: Optional[float] = None
+    # S3 GetObject
+    fetch_time: Optional[float] = None
+    # the wrapped handler function
+    handler_time: Optional[float] = None
+    # event log writes, with an EventLogBatchWriter only the buffering (and a flush when the write fills the buffer)
+    log_write_time: Optional[float] = None
+
+
+def _metric_name(field_name: str) -> str:
+    first, *rest = field_name.split("_")
+    return first + "".join(part.capitalize() for part in rest)
+
+
+class InvocationTimings:
+    """Thread safe collection of the record timings of an invocation"""
+
+    def __init__(self):
+        self.records: List[RecordTimings] = []
+        # all BatchWriteItem calls of the EventLogBatchWriter of the invocation
+        self.log_flush_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, timings: RecordTimings):
+        with self._lock:
+            self.records.append(timings)
+
+    def add_metrics(self, metrics):
+        """Add the timings in milliseconds to an aws_lambda_powertools Metrics instance"""
+        # pylint: disable=import-outside-toplevel
+        from aws_lambda_powertools.metrics import MetricUnit
+
+        with self._lock:
+            records = list(self.records)
+        for field in fields(RecordTimings):
+            name = _metric_name(field.name)
+            for timings in records:
+                value = getattr(timings, field.name)
+                if value is not None:
+                    metrics.add_metric(name=name, unit=MetricUnit.Milliseconds, value=round(value * 1000, 3))
+        if self.log_flush_time is not None:
+            metrics.add_metric(
+                name="logFlushTime", unit=MetricUnit.Milliseconds, value=round(self.log_flush_time * 1000, 3)
+            )
+
+
+def add_client_metrics(metrics):
+    """Add the connection pool metrics of the AWS clients (see aws_clients) and, when the http session is used, the
+    circuit breaker and retry budget metrics per host (see http_session) to an aws_lambda_powertools Metrics instance
+    """
+    aws_clients.add_pool_metrics(metrics)
+    # importing http_session here would import requests in every Lambda, also in the ones that don't use it
+    http_session = sys.modules.get(HTTP_SESSION_MODULE)
+    if http_session is not None:
+        http_session.add_http_metrics(metrics)
@@ -0,0 +1,179 @@
+"""Find stuck (PROCESSING) and FAILED objects in the event log and re-drive them through their S3 event handler.
+
+All shards of the status index are queried in parallel and the logs are streamed, so they are never all in memory.
+Every log is passed as a synthetic S3 event to the handler (a function decorated with `s3_event_handler`), with
+bounded concurrency and an optional rate limit:
+
+    python -m cdk_example_app.common.reprocessing cdk_example_app.s3_integration_event_lambda:handler \\
+        --status FAILED --older-than 30 --max-concurrency 4 --rate 10
+"""
+import argparse
+import importlib
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, Optional
+
+from pynamodb.indexes import KeysOnlyProjection
+
+from cdk_example_app.common.event_log import (
+    STATUS_FAILED,
+    STATUS_PROCESSING,
+    EventLog,
+    hydrate,
+    query_status,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+@dataclass
+class ReprocessingContext:
+    """Stand-in for the Lambda context, the logs are written with the function name of the original log"""
+
+    function_name: str
+
+
+class RateLimiter:
+    """Spaces the calls of `acquire` so that at most `rate` calls per second pass (blocking the caller)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _matches(log: EventLog, function: Optional[str], region: Optional[str]):
+    return (function is None or log.function == function) and (region is None or log.region == region)
+
+
+def find_events(
+    statuses: Iterable[str] = (STATUS_PROCESSING, STATUS_FAILED),
+    older_than: timedelta = None,
+    function: str = None,
+    region: str = None,
+    page_size: int = None,
+    rate_limit: float = None,
+) -> Iterator[EventLog]:
+    """Stream the logs with one of the statuses that were received more than `older_than` ago, optionally of one
+    function or region.
+
+    The age is a key condition of the status index. The other filters are evaluated by DynamoDB, unless the status
+    index only projects the keys: then the complete items are fetched first. `rate_limit` limits the consumed read
+    capacity units per second of every shard query.
+    """
+    received_before = datetime.now(timezone.utc) - older_than if older_than else None
+    if isinstance(EventLog.status_index.Meta.projection, KeysOnlyProjection):
+        logs = query_status(statuses, page_size=page_size, rate_limit=rate_limit, received_before=received_before)
+        return (log for log in hydrate(logs) if _matches(log, function, region))
+    conditions = []
+    if function:
+        conditions.append(EventLog.function == function)
+    if region:
+        conditions.append(EventLog.region == region)
+    filter_condition = None
+    for condition in conditions:
+        filter_condition = condition if filter_condition is None else filter_condition & condition
+    return query_status(statuses, filter_condition, page_size, rate_limit, received_before=received_before)
+
+
+def s3_event(log: EventLog) -> dict:
+    """Synthetic S3 event with one record for the object of the log"""
+    s3_object = {"key": log.s3_key}
+    if log.s3_version:
+        s3_object["versionId"] = log.s3_version
+    if log.etag:
+        s3_object["eTag"] = log.etag
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "eventName": "ObjectCreated:Reprocess",
+                "awsRegion": log.region,
+                "s3": {"bucket": {"name": log.s3_bucket}, "object": s3_object},
+            }
+        ]
+    }
+
+
+def reprocess(
+    logs: Iterable[EventLog],
+    handler: Callable[[dict, object], None],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    rate: float = None,
+    dry_run: bool = False,
+) -> Counter:
+    """Invoke the handler for every log with at most `max_concurrency` concurrent invocations and `rate` invocations
+    per second. Returns the number of reprocessed and failed logs.
+    """
+    limiter = RateLimiter(rate) if rate else None
+    counts = Counter()
+    counts_lock = threading.Lock()
+    # bounds the submitted invocations, so that the logs are consumed as they are processed
+    slots = threading.BoundedSemaphore(max_concurrency * 2)
+
+    def invoke(log: EventLog):
+        try:
+            if not dry_run:
+                handler(s3_event(log), ReprocessingContext(log.function))
+            result = "reprocessed"
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.warning("reprocessing s3://%s/%s failed: %s", log.s3_bucket, log.s3_key, e)
+            result = "failed"
+        finally:
+            slots.release()
+        with counts_lock:
+            counts[result] += 1
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for log in logs:
+            slots.acquire()  # pylint: disable=consider-using-with
+            if limiter:
+                limiter.acquire()
+            executor.submit(invoke, log)
+    return counts
+
+
+def _load_handler(name: str) -> Callable:
+    module_name, _, attribute = name.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "handler")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Re-drive stuck or failed S3 objects of the event log")
+    parser.add_argument("handler", help="the s3_event_handler, as module:function")
+    parser.add_argument("--status", action="append", choices=[STATUS_PROCESSING, STATUS_FAILED])
+    parser.add_argument("--older-than", type=float, default=15, help="minutes since the object was received")
+    parser.add_argument("--function", help="only the logs of this Lambda function")
+    parser.add_argument("--region", help="only the logs of this region")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--rate", type=float, help="maximum number of objects per second")
+    parser.add_argument("--dry-run", action="store_true", help="only count the objects that would be reprocessed")
+    options = parser.parse_args(args)
+    logs = find_events(
+        options.status or [STATUS_PROCESSING, STATUS_FAILED],
+        timedelta(minutes=options.older_than),
+        options.function,
+        options.region,
+    )
+    counts = reprocess(logs, _load_handler(options.handler), options.max_concurrency, options.rate, options.dry_run)
+    print(dict(counts))
+
+
+if __name__ == "__main__":
+    main()
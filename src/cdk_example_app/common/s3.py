@@ -1,60 +1,404 @@
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from functools import lru_cache, wraps
+from itertools import chain
 from json import JSONDecodeError
-from typing import Callable
+from typing import Callable, Iterator, List, Optional, Tuple
 
-import boto3
 from aws_lambda_powertools import Logger
-from opentelemetry.trace import Status, StatusCode, format_trace_id
 
-from cdk_example_app.common.event_log import event_log
-from cdk_example_app.common.tracing.s3_propagation import start_s3_root_span
+from cdk_example_app.common import aws_clients, invocation, profiling
+from cdk_example_app.common.event_log import EventLogBatchWriter, event_log
+from cdk_example_app.common.profiling import (
+    PHASE_DECODE,
+    PHASE_FUNCTIONAL_KEY,
+    PHASE_HANDLER,
+    PHASE_S3_GET,
+)
+from cdk_example_app.common.record_logger import RecordLogger
+from cdk_example_app.common.record_metrics import (
+    InvocationTimings,
+    RecordTimings,
+    add_client_metrics,
+    parse_epoch_millis,
+    parse_event_time,
+)
+from cdk_example_app.common.streaming import (
+    DEFAULT_CHUNK_SIZE,
+    STREAM_JSON_ARRAY,
+    STREAM_MODES,
+    STREAM_NDJSON,
+    iter_body,
+    iter_chunks,
+    iter_text,
+)
+from cdk_example_app.common.tracing.lazy_tracer import (
+    force_flush,
+    format_trace_id,
+    init_tracing,
+    set_error_status,
+    start_s3_root_span,
+)
+from cdk_example_app.common.util import decompress_chunks, is_gzip
+
+COMPRESSED_CONTENT_ENCODINGS = ("gzip", "x-gzip", "deflate")
+# a deferred PROCESSING entry is written at least this many seconds before the Lambda times out
+DEFERRED_WRITE_MARGIN = 1.0
 
 
 @lru_cache
 def s3_client():
-    return boto3.client("s3")
+    return aws_clients.client("s3")
 
 
 def get_json(bucket: str, key: str) -> object:
     s3_obj = s3_client().get_object(Bucket=bucket, Key=key)
-    return json.load(s3_obj["Body"]), s3_obj["Metadata"]
+    chunks, _ = body_chunks(s3_obj)
+    return json.loads("".join(iter_text(chunks, content_charset(s3_obj)))), s3_obj["Metadata"]
+
+
+def get_json_stream(bucket: str, key: str, mode: str = STREAM_JSON_ARRAY) -> Tuple[Iterator, dict]:
+    """Streaming variant of get_json that lazily parses the items of a json array or ndjson object"""
+    s3_obj = s3_client().get_object(Bucket=bucket, Key=key)
+    chunks, _ = body_chunks(s3_obj)
+    return iter_body(chunks, mode, content_charset(s3_obj)), s3_obj["Metadata"]
+
+
+def body_chunks(s3_obj: dict, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[Iterator[bytes], bool]:
+    """Returns the (decompressed) byte chunks of the body and whether the body is compressed.
+
+    The body is decompressed when the ContentEncoding is gzip or deflate, or when it starts with the gzip magic bytes.
+    """
+    chunks = iter_chunks(s3_obj["Body"], chunk_size)
+    first_chunk = next(chunks, b"")
+    chunks = chain([first_chunk], chunks)
+    if s3_obj.get("ContentEncoding", "").lower() in COMPRESSED_CONTENT_ENCODINGS or is_gzip(first_chunk):
+        return decompress_chunks(chunks), True
+    return chunks, False
+
+
+def content_charset(s3_obj: dict) -> str:
+    """Returns the charset from the ContentType, falling back to a ContentEncoding that is not a compression"""
+    for param in s3_obj.get("ContentType", "").split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset" and value:
+            return value.strip('"')
+    content_encoding = s3_obj.get("ContentEncoding")
+    if content_encoding and content_encoding.lower() not in COMPRESSED_CONTENT_ENCODINGS:
+        return content_encoding
+    return "utf-8"
+
+
+def _read_body(chunks: Iterator[bytes], charset: str, parse_json: bool, stream: str) -> Tuple[object, object]:
+    """Returns the body and the head of the body that is passed to the functional key extractor"""
+    if stream:
+        body = iter_body(chunks, stream, charset)
+        head = next(body, None)
+        return (chain([head], body) if head is not None else body), head
+    body = "".join(iter_text(chunks, charset))
+    if parse_json:
+        body = json.loads(body)
+    return body, body
+
+
+def _s3_records(records: List[dict], logger: Logger) -> List[dict]:
+    """Returns the S3 records, unwrapping the S3 events in the body of SQS records.
+
+    SQS messages with invalid json are logged and skipped, because a retry would fail again.
+    """
+    s3_records = []
+    for record in records:
+        if record.get("eventSource") != "aws:sqs":
+            s3_records.append(record)
+            continue
+        try:
+            s3_event = json.loads(record["body"])
+        except JSONDecodeError as e:
+            logger.error(
+                {"error": "SQS message is not valid Json", "message": str(e), "messageId": record["messageId"]}
+            )
+            continue
+        sqs = {"messageId": record["messageId"], "attributes": record.get("attributes", {})}
+        # s3:TestEvent messages don't have records
+        s3_records.extend(dict(s3_record, sqs=sqs) for s3_record in s3_event.get("Records", []))
+    return s3_records
+
+
+def _is_sqs_event(event: dict) -> bool:
+    return any(record.get("eventSource") == "aws:sqs" for record in event["Records"])
+
+
+def _received_time(record: dict) -> Optional[datetime]:
+    sent_timestamp = record.get("sqs", {}).get("attributes", {}).get("SentTimestamp")
+    return parse_event_time(record.get("eventTime")) or parse_epoch_millis(sent_timestamp)
+
+
+def _record_timings(record: dict, received_time: Optional[datetime]) -> RecordTimings:
+    timings = RecordTimings()
+    if received_time:
+        timings.queue_lag = (datetime.now(timezone.utc) - received_time).total_seconds()
+    sqs_attributes = record.get("sqs", {}).get("attributes", {})
+    sent = parse_epoch_millis(sqs_attributes.get("SentTimestamp"))
+    first_received = parse_epoch_millis(sqs_attributes.get("ApproximateFirstReceiveTimestamp"))
+    if sent and first_received:
+        timings.sqs_queue_time = (first_received - sent).total_seconds()
+    return timings
+
+
+def _deferred_write_delay(threshold: float, context) -> float:
+    if threshold is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return threshold
+    return min(threshold, context.get_remaining_time_in_millis() / 1000 - DEFERRED_WRITE_MARGIN)
+
+
+@dataclass(frozen=True)
+class _HandlerOptions:  # pylint: disable=too-many-instance-attributes
+    """Options of s3_event_handler"""
+
+    logger: Logger
+    # extracts a (name, value) functional key from the body (or its first chunk/line/item when streaming)
+    functional_key_extractor: Optional[Callable] = None
+    parse_json: bool = False
+    # records are processed in parallel by a bounded thread pool when > 1, a failing record doesn't stop the others
+    max_concurrency: int = 1
+    # one of STREAM_MODES to pass an iterator over the body to the handler instead of the complete body
+    stream: Optional[str] = None
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    # event log writes are buffered and flushed with BatchWriteItem when > 1, see EventLogBatchWriter
+    event_log_batch_size: int = 0
+    event_log_flush_interval: Optional[float] = None
+    # seconds, records that are processed faster only write their final state to the event log
+    deferred_write_threshold: Optional[float] = None
+    # records of object versions (or ETags) that are already DONE in the event log are skipped
+    idempotent: bool = False
+    # aws_lambda_powertools Metrics for the record timings and client metrics, see record_metrics
+    metrics: object = None
+
+
+@dataclass
+class _InvocationState:
+    """State that the records of an invocation share"""
+
+    func: Callable
+    options: _HandlerOptions
+    context: object
+    writer: Optional[EventLogBatchWriter]
+    timings: InvocationTimings = field(default_factory=InvocationTimings)
+
+
+def _record_event_log(state: _InvocationState, record: dict, record_logger, received_time: Optional[datetime]):
+    s3_object = record["s3"]["object"]
+    return event_log(
+        record["s3"]["bucket"]["name"],
+        s3_object["key"],
+        state.context.function_name,
+        record_logger,
+        state.writer,
+        _deferred_write_delay(state.options.deferred_write_threshold, state.context),
+        state.options.idempotent,
+        etag=s3_object.get("eTag"),
+        version_id=s3_object.get("versionId"),
+        received_time=received_time,
+    )
+
 
+def _get_object(s3_bucket: str, s3_key: str, timings: RecordTimings) -> dict:
+    fetch_start = time.perf_counter()
+    with profiling.phase(PHASE_S3_GET):
+        s3_obj = s3_client().get_object(Bucket=s3_bucket, Key=s3_key)
+    timings.fetch_time = time.perf_counter() - fetch_start
+    return s3_obj
+
+
+def _mark_invalid_json(event_log_, span, s3_bucket: str, s3_key: str, error: JSONDecodeError):
+    msg = f"S3 object {s3_key} in bucket {s3_bucket} is not valid Json: {error}"
+    event_log_.mark_failed(msg)
+    set_error_status(span, msg)
+
+
+def _set_functional_key(functional_key_extractor: Callable, head, record_logger, span, event_log_):
+    with profiling.phase(PHASE_FUNCTIONAL_KEY):
+        functional_key_name, functional_key_value = functional_key_extractor(head)
+    record_logger.append_keys(**{functional_key_name: functional_key_value})
+    span.set_attribute(functional_key_name, functional_key_value)
+    event_log_.set_functional_key(functional_key_name, functional_key_value)
+
+
+def _invoke_handler(func: Callable, body, s3_obj: dict, record: dict, timings: RecordTimings):
+    handler_start = time.perf_counter()
+    try:
+        with profiling.phase(PHASE_HANDLER):
+            func(body, s3_obj=s3_obj, record=record)
+    finally:
+        timings.handler_time = time.perf_counter() - handler_start
+
+
+def _process_object(state: _InvocationState, record: dict, s3_obj: dict, record_logger, event_log_, timings):
+    """Decode the body of the S3 object and pass it to the handler function, in the root span of the record"""
+    s3_bucket = record["s3"]["bucket"]["name"]
+    s3_key = record["s3"]["object"]["key"]
+    with start_s3_root_span(state.context.function_name, s3_obj, s3_bucket, s3_key) as span:
+        trace_id = format_trace_id(span.get_span_context().trace_id)
+        record_logger.append_keys(traceId=trace_id)
+        event_log_.set_attributes(trace_id=trace_id)
+
+        chunks, compressed = body_chunks(s3_obj, state.options.chunk_size)
+        event_log_.set_attributes(gzip=compressed)
+        try:
+            with profiling.phase(PHASE_DECODE):
+                body, head = _read_body(chunks, content_charset(s3_obj), state.options.parse_json, state.options.stream)
+        except JSONDecodeError as e:
+            _mark_invalid_json(event_log_, span, s3_bucket, s3_key, e)
+            return
+
+        if state.options.functional_key_extractor:
+            _set_functional_key(state.options.functional_key_extractor, head, record_logger, span, event_log_)
+
+        try:
+            _invoke_handler(state.func, body, s3_obj, record, timings)
+        except JSONDecodeError as e:
+            # json streams are parsed while the wrapped function consumes them
+            if state.options.stream not in (STREAM_NDJSON, STREAM_JSON_ARRAY):
+                raise
+            _mark_invalid_json(event_log_, span, s3_bucket, s3_key, e)
+
+
+def _handle_record(state: _InvocationState, record: dict, record_logger):
+    received_time = _received_time(record)
+    timings = _record_timings(record, received_time)
+    state.timings.add(timings)
+
+    event_log_ = None
+    try:
+        with _record_event_log(state, record, record_logger, received_time) as event_log_:
+            if event_log_.duplicate:
+                return
+            s3_obj = _get_object(record["s3"]["bucket"]["name"], record["s3"]["object"]["key"], timings)
+            _process_object(state, record, s3_obj, record_logger, event_log_, timings)
+    finally:
+        if event_log_ is not None:
+            timings.log_write_time = event_log_.write_time
+
+
+def _handle_record_in_worker(state: _InvocationState, record: dict, record_logger):
+    with profiling.profile_thread():
+        _handle_record(state, record, record_logger)
+
+
+def _handle_records_concurrently(state: _InvocationState, records: List[dict]) -> List[Tuple[dict, Exception]]:
+    s3_client()  # create the (thread safe) client before the workers race to do so
+    with ThreadPoolExecutor(max_workers=min(state.options.max_concurrency, len(records))) as executor:
+        futures = [
+            executor.submit(_handle_record_in_worker, state, record, RecordLogger(state.options.logger))
+            for record in records
+        ]
+    return [(record, future.exception()) for record, future in zip(records, futures) if future.exception()]
+
+
+def _concurrent(options: _HandlerOptions, records: List[dict]) -> bool:
+    return options.max_concurrency > 1 and len(records) > 1
+
+
+def _handle_records(state: _InvocationState, records: List[dict]) -> List[Tuple[dict, Exception]]:
+    """Returns the failed records with their error, S3 events fail on the first error"""
+    if _concurrent(state.options, records):
+        return _handle_records_concurrently(state, records)
+    failures = []
+    for record in records:
+        try:
+            _handle_record(state, record, state.options.logger)
+        # pylint: disable=broad-except
+        except Exception as e:
+            if "sqs" not in record:
+                raise
+            failures.append((record, e))
+    return failures
+
+
+def _add_metrics(state: _InvocationState):
+    metrics = state.options.metrics
+    if state.writer is not None:
+        state.timings.log_flush_time = state.writer.flush_time
+    state.timings.add_metrics(metrics)
+    add_client_metrics(metrics)
+
+
+def _batch_item_failures(failures: List[Tuple[dict, Exception]], logger: Logger) -> dict:
+    """Partial batch response with the SQS messages of the failed records"""
+    failed_message_ids = []
+    for record, error in failures:
+        message_id = record["sqs"]["messageId"]
+        logger.error({"error": "Exception while handling S3 record", "message": str(error), "messageId": message_id})
+        if message_id not in failed_message_ids:
+            failed_message_ids.append(message_id)
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_message_ids]}
+
+
+def s3_event_handler(
+    logger: Logger,
+    functional_key_extractor: Callable = None,
+    parse_json=False,
+    max_concurrency=1,
+    stream: str = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    event_log_batch_size: int = 0,
+    event_log_flush_interval: float = None,
+    deferred_write_threshold: float = None,
+    idempotent: bool = False,
+    metrics=None,
+) -> Callable:
+    """Decorator for S3 event handlers that fetches the S3 object of every record and passes its body to the handler.
+
+    S3 events delivered via SQS are unwrapped and get a partial batch response, see _HandlerOptions for the options.
+    """
+    if stream and stream not in STREAM_MODES:
+        raise ValueError(f"unsupported stream mode {stream}, expected one of {STREAM_MODES}")
+    if stream and parse_json:
+        raise ValueError("parse_json can't be combined with stream, use a json stream mode instead")
+    options = _HandlerOptions(
+        logger,
+        functional_key_extractor,
+        parse_json,
+        max_concurrency,
+        stream,
+        chunk_size,
+        event_log_batch_size,
+        event_log_flush_interval,
+        deferred_write_threshold,
+        idempotent,
+        metrics,
+    )
 
-def s3_event_handler(logger: Logger, functional_key_extractor: Callable = None, parse_json=False) -> Callable:
     def decorator(func: Callable):
+        profile_name = profiling.handler_name(func)
+
         @wraps(func)
         def wrapper(event, context):
-            for record in event["Records"]:
-                s3_bucket = record["s3"]["bucket"]["name"]
-                s3_key = record["s3"]["object"]["key"]
-
-                with event_log(s3_bucket, s3_key, context.function_name, logger) as event_log_:
-                    s3_obj = s3_client().get_object(Bucket=s3_bucket, Key=s3_key)
-                    with start_s3_root_span(context.function_name, s3_obj, s3_bucket, s3_key) as span:
-                        trace_id = format_trace_id(span.get_span_context().trace_id)
-                        logger.append_keys(traceId=trace_id)
-                        event_log_.trace_id = trace_id
-                        # TODO: gzip support
-                        if parse_json:
-                            try:
-                                body = json.loads(s3_obj["Body"].read())
-                            except JSONDecodeError as e:
-                                msg = f"S3 object {s3_key} in bucket {s3_bucket} is not valid Json: {e}"
-                                event_log_.mark_failed(msg)
-                                span.set_status(Status(StatusCode.ERROR, msg))
-                                continue
-                        else:
-                            body = s3_obj["Body"].read().decode(s3_obj.get("ContentEncoding", "utf-8"))
-
-                        if functional_key_extractor:
-                            functional_key_name, functional_key_value = functional_key_extractor(body)
-                            logger.append_keys(**{functional_key_name: functional_key_value})
-                            span.set_attribute(functional_key_name, functional_key_value)
-                            event_log_.set_functional_key(functional_key_name, functional_key_value)
-
-                        # invoke wrapped function
-                        func(body, s3_obj=s3_obj, record=record)
+            invocation.start(context)
+            init_tracing()
+            records = _s3_records(event["Records"], logger)
+            writer = None
+            if event_log_batch_size > 1:
+                writer = EventLogBatchWriter(event_log_batch_size, event_log_flush_interval)
+            state = _InvocationState(func, options, context, writer)
+            # the workers of concurrently processed records run cProfile themselves
+            profile = profiling.profile_invocation(profile_name, context, logger, not _concurrent(options, records))
+            try:
+                with profile, writer or nullcontext():
+                    failures = _handle_records(state, records)
+            finally:
+                if metrics is not None:
+                    _add_metrics(state)
+                force_flush()
+            if _is_sqs_event(event):
+                return _batch_item_failures(failures, logger)
+            if failures:
+                raise failures[0][1]
+            return None
 
         return wrapper
 
@@ -1,23 +1,43 @@
 import inspect
 import json
-from functools import lru_cache, wraps
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial, wraps
 from json import JSONDecodeError
-from typing import Callable
+from typing import Callable, List
 
-import boto3
 from aws_lambda_powertools import Logger
 
-from cdk_example_app.common.tracing.sqs_propagation import (
+from cdk_example_app.common import aws_clients, invocation, profiling
+from cdk_example_app.common.profiling import PHASE_DECODE, PHASE_HANDLER
+from cdk_example_app.common.record_metrics import add_client_metrics
+from cdk_example_app.common.tracing.lazy_tracer import (
+    force_flush,
+    init_tracing,
+    inject_sqs_trace_context,
     sqs_trace_propagator,
     start_sqs_root_span,
 )
+from cdk_example_app.common.util import compress_base64, decompress_base64
 
 logger = Logger()
 
+# SQS limits for SendMessageBatch
+MAX_BATCH_ENTRIES = 10
+MAX_MESSAGE_SIZE = 256 * 1024
+
+# message attribute that marks compressed message bodies
+CONTENT_ENCODING_ATTRIBUTE = "content-encoding"
+ZLIB_BASE64_ENCODING = "zlib+base64"
+
+RETRY_BACKOFF = 0.1  # seconds
+
 
 @lru_cache
 def sqs_client():
-    client = boto3.client("sqs")
+    client = aws_clients.client("sqs")
     client.send_message = sqs_trace_propagator(client.send_message)
     return client
 
@@ -26,35 +46,265 @@ def send_json(obj, **kwargs):
     sqs_client().send_message(MessageBody=json.dumps(obj), **kwargs)
 
 
-def sqs_json_event_handler(func: Callable):
+class BatchSendError(Exception):
+    def __init__(self, failed: List[dict], entries: List[dict] = None):
+        super().__init__(f"failed to send {len(failed)} SQS message(s): {failed}")
+        self.failed = failed
+        # the SendMessageBatch entries of the failed messages, to send them again
+        self.entries = entries or []
+
+
+class JsonBatchSender:
+    """Buffered producer that sends json messages with SendMessageBatch (10 messages / 256 KB per call).
+
+    The trace context is added to every message when it is buffered. Bodies that exceed the SQS message size are
+    compressed with `compress_base64` and marked with a `content-encoding` message attribute, which
+    `sqs_json_event_handler` understands. Entries that fail with a server error are retried with exponential backoff.
+
+    The buffer is sent when it's full, every `flush_interval` seconds from a background thread (if given) and on
+    `close()`, which is called when exiting the context manager. Full buffers are sent outside the buffer lock and in
+    order, so producers don't wait for each other's network calls. Messages that could not be sent are kept and raised
+    as a BatchSendError by the next `flush()` or `close()`.
+    """
+
+    def __init__(self, queue_url: str, flush_interval: float = None, max_retries: int = 3):
+        self.queue_url = queue_url
+        self.max_retries = max_retries
+        self._entries = []
+        self._size = 0
+        self._next_id = 0
+        # batches that are taken from the buffer but not sent yet, in order
+        self._ready = deque()
+        self._failed = []
+        self._failed_entries = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True)
+            self._flusher.start()
+
+    def send(self, obj, **kwargs):
+        """Buffer a message, kwargs are SendMessageBatch entry fields like MessageAttributes or MessageGroupId"""
+        body = json.dumps(obj)
+        message_attributes = inject_sqs_trace_context(dict(kwargs.pop("MessageAttributes", {})))
+        size = _message_size(body, message_attributes)
+        if size > MAX_MESSAGE_SIZE:
+            body = compress_base64(body)
+            message_attributes[CONTENT_ENCODING_ATTRIBUTE] = {"StringValue": ZLIB_BASE64_ENCODING, "DataType": "String"}
+            size = _message_size(body, message_attributes)
+            if size > MAX_MESSAGE_SIZE:
+                raise ValueError(f"compressed SQS message of {size} bytes exceeds {MAX_MESSAGE_SIZE} bytes")
+
+        with self._lock:
+            if self._size + size > MAX_MESSAGE_SIZE:
+                self._take_batch()
+            self._entries.append(
+                {"Id": str(self._next_id), "MessageBody": body, "MessageAttributes": message_attributes, **kwargs}
+            )
+            self._next_id += 1
+            self._size += size
+            if len(self._entries) == MAX_BATCH_ENTRIES:
+                self._take_batch()
+            ready = bool(self._ready)
+        if ready:
+            self._send_ready(wait=False)
+
+    def flush(self):
+        """Send the buffer, raises a BatchSendError for all messages that could not be sent since the last flush"""
+        with self._lock:
+            self._take_batch()
+        self._send_ready()
+        with self._lock:
+            failed, entries = self._failed, self._failed_entries
+            self._failed, self._failed_entries = [], []
+        if failed:
+            raise BatchSendError(failed, entries)
+
+    def close(self):
+        self._closed.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _flush_periodically(self, flush_interval: float):
+        while not self._closed.wait(flush_interval):
+            with self._lock:
+                self._take_batch()
+            self._send_ready(wait=False)
+
+    def _take_batch(self):
+        """Move the buffered entries to the batches that are ready to send, the caller must hold the lock"""
+        if self._entries:
+            self._ready.append(self._entries)
+            self._entries = []
+            self._size = 0
+
+    def _send_ready(self, wait: bool = True):
+        """Send the ready batches. Without `wait`, a batch that is being sent by another thread leaves the sending of
+        the ready batches to that thread."""
+        while True:
+            # pylint: disable=consider-using-with
+            if not self._send_lock.acquire(blocking=wait):
+                return
+            try:
+                while True:
+                    with self._lock:
+                        if not self._ready:
+                            break
+                        entries = self._ready.popleft()
+                    self._send_and_record(entries)
+            finally:
+                self._send_lock.release()
+            # a batch that became ready while releasing the lock
+            with self._lock:
+                if not self._ready:
+                    return
+
+    def _send_and_record(self, entries: List[dict]):
+        try:
+            failed = self._send_batch(entries)
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.error({"error": "Exception while sending SQS messages", "message": str(e)})
+            failed = [{"Id": entry["Id"], "SenderFault": False, "Message": str(e)} for entry in entries]
+        if failed:
+            failed_ids = {failure["Id"] for failure in failed}
+            with self._lock:
+                self._failed += failed
+                self._failed_entries += [entry for entry in entries if entry["Id"] in failed_ids]
+
+    def _send_batch(self, entries: List[dict]) -> List[dict]:
+        """Returns the failures of the entries that could not be sent"""
+        failed = []
+        retries = {}
+        for attempt in range(self.max_retries + 1):
+            if not entries:
+                break
+            if attempt:
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            failures = sqs_client().send_message_batch(QueueUrl=self.queue_url, Entries=entries).get("Failed", [])
+            failed += [failure for failure in failures if failure.get("SenderFault")]
+            retries = {failure["Id"]: failure for failure in failures if not failure.get("SenderFault")}
+            entries = [entry for entry in entries if entry["Id"] in retries]
+        if entries:
+            failed += list(retries.values())
+        return failed
+
+
+def _message_size(body: str, message_attributes: dict) -> int:
+    size = len(body.encode())
+    for name, attribute in message_attributes.items():
+        size += len(name.encode()) + len(attribute["DataType"]) + len(attribute.get("StringValue", "").encode())
+    return size
+
+
+def _message_body(record) -> str:
+    content_encoding = record.get("messageAttributes", {}).get(CONTENT_ENCODING_ATTRIBUTE, {}).get("stringValue")
+    if content_encoding == ZLIB_BASE64_ENCODING:
+        return decompress_base64(record["body"])
+    return record["body"]
+
+
+def _is_fifo(records: List[dict]) -> bool:
+    return bool(records) and records[0].get("eventSourceARN", "").endswith(".fifo")
+
+
+def sqs_json_event_handler(func: Callable = None, *, max_concurrency: int = 1, metrics=None):
+    """Decorator for SQS event handlers that passes the parsed json body of every record to the handler.
+
+    Every record is processed in its own root span, concurrently by a bounded thread pool when `max_concurrency` > 1.
+    The wrapper returns a partial batch response, so that only the failed messages are retried (the event source
+    mapping needs `ReportBatchItemFailures`). Records with invalid json are not retried because they would fail again.
+    For FIFO queues, records are processed in order and all records after the first failure are retried.
+
+    With an aws_lambda_powertools `metrics` instance, the metrics of the AWS and HTTP clients are added at the end of
+    every invocation (see record_metrics). Decorate the handler with `metrics.log_metrics` to write them.
+
+    With PROFILING_ENABLED, decoding and handling of every record are timed and summarized in an "invocation profile"
+    log line, see profiling.
+    """
+    if func is None:
+        return partial(sqs_json_event_handler, max_concurrency=max_concurrency, metrics=metrics)
+
     handler_params = inspect.signature(func).parameters.keys()
     record_arg = "record" in handler_params
     context_arg = "context" in handler_params
     func_name = f"{inspect.getmodule(func)}.{func.__name__}"
 
+    def handle_record(record, context) -> bool:
+        """Returns whether the record must be retried"""
+        try:
+            with start_sqs_root_span(func_name, record):
+                args = {}
+                if record_arg:
+                    args["record"] = record
+                if context_arg:
+                    args["context"] = context
+                with profiling.phase(PHASE_DECODE):
+                    body = json.loads(_message_body(record))  # TODO make parsing optional
+                with profiling.phase(PHASE_HANDLER):
+                    func(body, **args)
+            return False
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.error(
+                {
+                    "error": "Exception while handling SQS record",
+                    "message": str(e),
+                    "messageId": record["messageId"],
+                }
+            )
+            # don't retry in case of invalid JSON because the retry will fail again
+            return not isinstance(e, JSONDecodeError)
+
+    def handle_record_in_worker(record, context) -> bool:
+        with profiling.profile_thread():
+            return handle_record(record, context)
+
+    def handle_fifo_records(records, context) -> List[dict]:
+        for index, record in enumerate(records):
+            if handle_record(record, context):
+                # the remaining records must be retried as well to preserve the order within the message group
+                return records[index:]
+        return []
+
+    def concurrent(records) -> bool:
+        return max_concurrency > 1 and len(records) > 1 and not _is_fifo(records)
+
+    def handle_records(records, context) -> List[dict]:
+        if concurrent(records):
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(records))) as executor:
+                retries = list(executor.map(lambda record: handle_record_in_worker(record, context), records))
+        else:
+            retries = [handle_record(record, context) for record in records]
+        return [record for record, retry in zip(records, retries) if retry]
+
     @wraps(func)
     def wrapper(event, context):
-        logger.info({"message": "sqs_json_event_handler", "records": len(event["Records"])})
-        for record in event["Records"]:
-            try:
-                with start_sqs_root_span(func_name, record):
-                    args = {}
-                    if record_arg:
-                        args["record"] = record
-                    if context_arg:
-                        args["context"] = context
-                    return func(json.loads(record["body"]), **args)  # TODO make parsing optional
-            # pylint: disable=broad-except
-            except Exception as e:
-                logger.error(
-                    {
-                        "error": "Exception while handling SQS record",
-                        "message": str(e),
-                    }
-                )
-                # don't re-throw exception in case of invalid JSON because lambda retry will fail again
-                if not isinstance(e, JSONDecodeError):
-                    raise
-                return None
+        invocation.start(context)
+        init_tracing()
+        records = event["Records"]
+        logger.info({"message": "sqs_json_event_handler", "records": len(records)})
+        # the workers of concurrently processed records run cProfile themselves
+        profile = profiling.profile_invocation(profiling.handler_name(func), context, logger, not concurrent(records))
+        try:
+            with profile:
+                if _is_fifo(records):
+                    failed_records = handle_fifo_records(records, context)
+                else:
+                    failed_records = handle_records(records, context)
+        finally:
+            if metrics is not None:
+                add_client_metrics(metrics)
+            force_flush()
+        return {"batchItemFailures": [{"itemIdentifier": record["messageId"]} for record in failed_records]}
 
     return wrapper
@@ -0,0 +1,167 @@
+import codecs
+import json
+from json import JSONDecodeError
+from typing import BinaryIO, Iterable, Iterator
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_ITEM_SIZE = 16 * 1024 * 1024  # characters
+
+STREAM_BYTES = "bytes"
+STREAM_LINES = "lines"
+STREAM_NDJSON = "ndjson"
+STREAM_JSON_ARRAY = "json-array"
+STREAM_MODES = (STREAM_BYTES, STREAM_LINES, STREAM_NDJSON, STREAM_JSON_ARRAY)
+
+_WHITESPACE = " \t\n\r"
+_ITEM_TERMINATORS = _WHITESPACE + ",]"
+# a decode error this close to the end of the buffer can be a token (f.e. "-Infinity" or "\\uXXXX") split over chunks
+_MAX_TOKEN_TAIL = 16
+
+# json array parser states
+_START = 0
+_FIRST_ITEM = 1
+_ITEM = 2
+_DELIMITER = 3
+_END = 4
+
+
+def iter_chunks(stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_text(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    """Decode byte chunks, also when a multibyte character is split over two chunks"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def iter_lines(text_chunks: Iterable[str]) -> Iterator[str]:
+    """Split text chunks into lines (without line endings)"""
+    pending = ""
+    for chunk in text_chunks:
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def iter_ndjson(lines: Iterable[str]) -> Iterator:
+    """Parse newline delimited json, skipping blank lines"""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_array(text_chunks: Iterable[str], max_item_size: int = DEFAULT_MAX_ITEM_SIZE) -> Iterator:
+    """Incrementally parse the items of a top level json array.
+
+    Only the current item is kept in memory, so the size of the array is not limited by the available memory. Items
+    larger than `max_item_size` characters raise a ValueError. An incomplete item is decoded again once the buffer has
+    doubled, which keeps parsing large items linear in their size.
+    """
+    parser = _JsonArrayParser(max_item_size)
+    for chunk in text_chunks:
+        yield from parser.feed(chunk)
+    yield from parser.feed("", final=True)
+    if parser.state != _END:
+        raise JSONDecodeError("Unterminated json array", parser.buffer, parser.pos)
+
+
+class _JsonArrayParser:
+    def __init__(self, max_item_size: int):
+        self.max_item_size = max_item_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        # chunks that are not appended to the buffer yet, joining every chunk would copy a large item repeatedly
+        self.pending = []
+        self.pending_size = 0
+        self.state = _START
+        # the buffered size (from pos) at which decoding an incomplete item is tried again
+        self.retry_size = 0
+
+    def feed(self, chunk: str, final: bool = False) -> Iterator:
+        """Parse the items that are complete, all remaining items when `final`"""
+        self.pending.append(chunk)
+        self.pending_size += len(chunk)
+        if not final and len(self.buffer) - self.pos + self.pending_size < self.retry_size:
+            return
+        buffer = self.buffer = self.buffer[self.pos :] + "".join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        pos = 0
+        while True:
+            self.pos = pos = _skip_whitespace(buffer, pos)
+            if pos == len(buffer):
+                return
+            char = buffer[pos]
+            if self.state == _START:
+                if char != "[":
+                    raise JSONDecodeError("Expecting '['", buffer, pos)
+                self.state, pos = _FIRST_ITEM, pos + 1
+            elif self.state == _DELIMITER:
+                if char not in ",]":
+                    raise JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                self.state, pos = _ITEM if char == "," else _END, pos + 1
+            elif self.state == _END:
+                raise JSONDecodeError("Extra data", buffer, pos)
+            elif char == "]" and self.state == _FIRST_ITEM:
+                self.state, pos = _END, pos + 1
+            else:
+                try:
+                    item, end = self.decoder.raw_decode(buffer, pos)
+                    # a number could continue in the next chunk
+                    complete = final or (end < len(buffer) and buffer[end] in _ITEM_TERMINATORS)
+                except JSONDecodeError as e:
+                    if final or not _incomplete(e, buffer):
+                        raise
+                    complete = False
+                if not complete:
+                    buffered = len(buffer) - pos
+                    if buffered > self.max_item_size:
+                        raise ValueError(f"json array item exceeds {self.max_item_size} characters")
+                    self.retry_size = 2 * buffered
+                    return
+                yield item
+                self.state, pos, self.retry_size = _DELIMITER, end, 0
+
+
+def _incomplete(error: JSONDecodeError, text: str) -> bool:
+    """Whether a decode error can be caused by the end of the text, instead of by invalid json"""
+    return error.msg.startswith("Unterminated string") or len(text) - error.pos <= _MAX_TOKEN_TAIL
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def stream_body(stream: BinaryIO, mode: str, encoding: str = "utf-8", chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator:
+    """Iterate over a binary stream as byte chunks, lines, ndjson records or json array items"""
+    return iter_body(iter_chunks(stream, chunk_size), mode, encoding)
+
+
+def iter_body(chunks: Iterable[bytes], mode: str, encoding: str = "utf-8") -> Iterator:
+    """Iterate over byte chunks as byte chunks, lines, ndjson records or json array items"""
+    if mode == STREAM_BYTES:
+        return iter(chunks)
+    if mode == STREAM_LINES:
+        return iter_lines(iter_text(chunks, encoding))
+    if mode == STREAM_NDJSON:
+        return iter_ndjson(iter_lines(iter_text(chunks, encoding)))
+    if mode == STREAM_JSON_ARRAY:
+        return iter_json_array(iter_text(chunks, encoding))
+    raise ValueError(f"unsupported stream mode {mode}, expected one of {STREAM_MODES}")
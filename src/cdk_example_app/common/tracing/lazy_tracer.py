@@ -0,0 +1,120 @@
+"""Entry point for tracing that only imports (and initializes) OpenTelemetry when tracing is used.
+
+Importing the tracer module builds the tracer provider and instruments botocore, which adds considerably to the cold
+start. Tracing can be disabled with the TRACING_ENABLED environment variable, in which case OpenTelemetry is not
+imported at all and root spans are replaced by an `UntracedSpan` that only provides a trace id for log correlation.
+"""
+# pylint: disable=import-outside-toplevel
+import os
+import random
+import sys
+from typing import ContextManager
+
+TRACING_ENABLED_ENV_VARIABLE = "TRACING_ENABLED"
+
+_TRACER_MODULE = "cdk_example_app.common.tracing.tracer"
+
+
+def tracing_enabled() -> bool:
+    return os.environ.get(TRACING_ENABLED_ENV_VARIABLE, "true").lower() not in ("false", "0", "no", "off")
+
+
+def get_tracer():
+    """Returns the tracer, initializing the tracer provider and instrumentation on first use"""
+    from cdk_example_app.common.tracing.tracer import tracer
+
+    return tracer
+
+
+def init_tracing():
+    """Initialize tracing (when enabled), so that the AWS calls that precede the first span are instrumented"""
+    if tracing_enabled():
+        get_tracer()
+
+
+def force_flush():
+    """Export the queued spans, unless tracing was never initialized"""
+    tracer_module = sys.modules.get(_TRACER_MODULE)
+    if tracer_module:
+        tracer_module.force_flush()
+
+
+class _UntracedSpanContext:
+    def __init__(self):
+        self.trace_id = random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+
+
+class UntracedSpan:
+    """Stand-in for a span when tracing is disabled"""
+
+    def __init__(self):
+        self._context = _UntracedSpanContext()
+
+    def get_span_context(self):
+        return self._context
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_status(self, status, description=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+def format_trace_id(trace_id: int) -> str:
+    """Same as opentelemetry.trace.format_trace_id"""
+    return format(trace_id, "032x")
+
+
+def set_error_status(span, description: str):
+    if span.is_recording():
+        from opentelemetry.trace import Status, StatusCode
+
+        span.set_status(Status(StatusCode.ERROR, description))
+
+
+def start_s3_root_span(name: str, s3_metadata: dict, s3_bucket: str, s3_key: str) -> ContextManager:
+    if not tracing_enabled():
+        return UntracedSpan()
+    from cdk_example_app.common.tracing.s3_propagation import (
+        start_s3_root_span as start_span,
+    )
+
+    return start_span(name, s3_metadata, s3_bucket, s3_key)
+
+
+def start_sqs_root_span(name: str, sqs_record) -> ContextManager:
+    if not tracing_enabled():
+        return UntracedSpan()
+    from cdk_example_app.common.tracing.sqs_propagation import (
+        start_sqs_root_span as start_span,
+    )
+
+    return start_span(name, sqs_record)
+
+
+def inject_sqs_trace_context(message_attributes: dict) -> dict:
+    if not tracing_enabled():
+        return message_attributes
+    from cdk_example_app.common.tracing.sqs_propagation import inject_trace_context
+
+    return inject_trace_context(message_attributes)
+
+
+def sqs_trace_propagator(func):
+    if not tracing_enabled():
+        return func
+    from cdk_example_app.common.tracing.sqs_propagation import (
+        sqs_trace_propagator as propagator,
+    )
+
+    return propagator(func)
@@ -1,12 +1,38 @@
+import json
+import sys
 import typing
 
 from aws_lambda_powertools import Logger
 from opentelemetry.sdk.trace import Span
 from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
-from opentelemetry.trace import format_span_id, format_trace_id
+from opentelemetry.trace import SpanKind, StatusCode, format_span_id, format_trace_id
 
 logger = Logger(service="span-exporter")
 TYPE_DISTRIBUTED_TRACING = "_DIST_TRACING_DATA_"
+TYPE_DISTRIBUTED_TRACING_BATCH = "_DIST_TRACING_BATCH_"
+COMPACT_FORMAT_VERSION = 1
+# CloudWatch Logs truncates log events larger than 256 KB, which would break the json of a batch line
+MAX_LINE_BYTES = 200 * 1024
+
+
+def span_to_dict(span: Span) -> dict:
+    ctx = span.get_span_context()
+    span_parent = getattr(span, "parent", None)
+    return {
+        "type": TYPE_DISTRIBUTED_TRACING,
+        "name": span.name,
+        "kind": span.kind,
+        "parentSpanId": format_span_id(span_parent.span_id) if span_parent else None,
+        "context": {
+            "spanId": format_span_id(ctx.span_id),
+            "traceId": format_trace_id(ctx.trace_id),
+            "sampled": ctx.trace_flags.sampled,
+        },
+        "startTimestamp": span.start_time,
+        "endTimestamp": span.end_time,
+        "attributes": span.attributes,
+        "status": {"code": span.status.status_code, "description": span.status.description},
+    }
 
 
 class LoggerSpanExporter(SpanExporter):
@@ -14,22 +40,117 @@ class LoggerSpanExporter(SpanExporter):
 
     def export(self, spans: typing.Sequence[Span]) -> SpanExportResult:
         for span in spans:
-            ctx = span.get_span_context()
-            span_parent = getattr(span, "parent", None)
-            msg = {
+            logger.info(span_to_dict(span))
+        return SpanExportResult.SUCCESS
+
+
+class CompactSpanExporter(SpanExporter):
+    """Implementation of :class:`SpanExporter` that writes a batch of spans as one compact json line to stdout.
+
+    Spans are stored column by column. Span names and attribute keys are interned in lookup tables, start timestamps
+    are delta encoded and end timestamps are stored as durations. Use `decode_span_batch` to get the spans in the
+    format of the LoggerSpanExporter.
+
+    Batches that encode to more than `max_line_bytes` are split over several lines (a single span larger than the
+    limit still gets its own line).
+    """
+
+    def __init__(self, out: typing.TextIO = None, max_line_bytes: int = MAX_LINE_BYTES):
+        self.out = out
+        self.max_line_bytes = max_line_bytes
+
+    def export(self, spans: typing.Sequence[Span]) -> SpanExportResult:
+        if spans:
+            out = self.out or sys.stdout
+            for line in self._lines(spans):
+                out.write(line + "\n")
+            out.flush()
+        return SpanExportResult.SUCCESS
+
+    def _lines(self, spans: typing.Sequence[Span]) -> typing.Iterator[str]:
+        line = json.dumps(encode_span_batch(spans), separators=(",", ":"), default=str)
+        if len(spans) == 1 or len(line.encode()) <= self.max_line_bytes:
+            yield line
+            return
+        middle = len(spans) // 2
+        yield from self._lines(spans[:middle])
+        yield from self._lines(spans[middle:])
+
+
+def encode_span_batch(spans: typing.Sequence[Span]) -> dict:
+    names = {}
+    keys = {}
+    columns = {
+        "name": [],
+        "kind": [],
+        "traceId": [],
+        "spanId": [],
+        "parentSpanId": [],
+        "sampled": [],
+        "start": [],
+        "duration": [],
+        "attributes": [],
+        "status": [],
+        "statusDescription": [],
+    }
+    previous_start = 0
+    for span in spans:
+        ctx = span.get_span_context()
+        span_parent = getattr(span, "parent", None)
+        columns["name"].append(names.setdefault(span.name, len(names)))
+        columns["kind"].append(span.kind.value)
+        columns["traceId"].append(format_trace_id(ctx.trace_id))
+        columns["spanId"].append(format_span_id(ctx.span_id))
+        columns["parentSpanId"].append(format_span_id(span_parent.span_id) if span_parent else None)
+        columns["sampled"].append(int(ctx.trace_flags.sampled))
+        columns["start"].append(span.start_time - previous_start)
+        columns["duration"].append(span.end_time - span.start_time)
+        attributes = []
+        for key, value in (span.attributes or {}).items():
+            attributes += [keys.setdefault(key, len(keys)), value]
+        columns["attributes"].append(attributes)
+        columns["status"].append(span.status.status_code.value)
+        columns["statusDescription"].append(span.status.description)
+        previous_start = span.start_time
+    return {
+        "type": TYPE_DISTRIBUTED_TRACING_BATCH,
+        "version": COMPACT_FORMAT_VERSION,
+        "names": list(names),
+        "keys": list(keys),
+        "spans": columns,
+    }
+
+
+def decode_span_batch(batch: dict) -> typing.List[dict]:
+    """Convert a batch of the CompactSpanExporter into a list of spans in the LoggerSpanExporter format"""
+    if batch.get("version") != COMPACT_FORMAT_VERSION:
+        raise ValueError(f"unsupported span batch version {batch.get('version')}")
+    names = batch["names"]
+    keys = batch["keys"]
+    columns = batch["spans"]
+    spans = []
+    start = 0
+    for index, name in enumerate(columns["name"]):
+        start += columns["start"][index]
+        attributes = columns["attributes"][index]
+        spans.append(
+            {
                 "type": TYPE_DISTRIBUTED_TRACING,
-                "name": span.name,
-                "kind": span.kind,
-                "parentSpanId": format_span_id(span_parent.span_id) if span_parent else None,
+                "name": names[name],
+                "kind": SpanKind(columns["kind"][index]),
+                "parentSpanId": columns["parentSpanId"][index],
                 "context": {
-                    "spanId": format_span_id(ctx.span_id),
-                    "traceId": format_trace_id(ctx.trace_id),
-                    "sampled": ctx.trace_flags.sampled,
+                    "spanId": columns["spanId"][index],
+                    "traceId": columns["traceId"][index],
+                    "sampled": bool(columns["sampled"][index]),
+                },
+                "startTimestamp": start,
+                "endTimestamp": start + columns["duration"][index],
+                "attributes": {keys[attributes[i]]: attributes[i + 1] for i in range(0, len(attributes), 2)},
+                "status": {
+                    "code": StatusCode(columns["status"][index]),
+                    "description": columns["statusDescription"][index],
                 },
-                "startTimestamp": span.start_time,
-                "endTimestamp": span.end_time,
-                "attributes": span.attributes,
-                "status": {"code": span.status.status_code, "description": span.status.description},
             }
-            logger.info(msg)
-        return SpanExportResult.SUCCESS
+        )
+    return spans
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from typing import Optional, Sequence
+
+from opentelemetry.context import Context
+from opentelemetry.sdk.trace.sampling import (
+    ALWAYS_ON,
+    Decision,
+    ParentBased,
+    Sampler,
+    SamplingResult,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import Link, SpanKind
+from opentelemetry.trace.span import TraceState
+from opentelemetry.util.types import Attributes
+
+# fraction of the root traces (without sampled parent) that is sampled
+TRACER_SAMPLING_RATIO_ENV_VARIABLE = "TRACER_SAMPLING_RATIO"
+# maximum number of sampled root traces per second per Lambda container
+TRACER_MAX_TRACES_PER_SECOND_ENV_VARIABLE = "TRACER_MAX_TRACES_PER_SECOND"
+
+
+class RateLimitingSampler(Sampler):
+    """Samples at most `max_traces_per_second` of the traces that the delegate sampler samples.
+
+    The limit is enforced with a token bucket (allowing bursts up to one second worth of traces, and at least one
+    trace), so the effective sampling ratio adapts to the traffic of the container.
+    """
+
+    def __init__(self, max_traces_per_second: float, delegate: Sampler = ALWAYS_ON):
+        self.max_traces_per_second = max_traces_per_second
+        self.delegate = delegate
+        # a rate below 1/s must still be able to hold a whole token
+        self._capacity = max(1.0, max_traces_per_second)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def should_sample(
+        self,
+        parent_context: Optional[Context],
+        trace_id: int,
+        name: str,
+        kind: SpanKind = None,
+        attributes: Attributes = None,
+        links: Sequence[Link] = None,
+        trace_state: TraceState = None,
+    ) -> SamplingResult:
+        result = self.delegate.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision != Decision.RECORD_AND_SAMPLE or self._take_token():
+            return result
+        return SamplingResult(Decision.DROP, None, trace_state)
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self.max_traces_per_second)
+            self._last_refill = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def get_description(self) -> str:
+        return f"RateLimitingSampler{{{self.max_traces_per_second}, {self.delegate.get_description()}}}"
+
+
+def create_sampler() -> Optional[Sampler]:
+    """Create a parent based sampler from the TRACER_SAMPLING_RATIO and TRACER_MAX_TRACES_PER_SECOND env variables.
+
+    The sampled flag of a propagated (B3) parent is always honoured, the ratio and rate limit only apply to new traces.
+    Returns None when neither variable is set, so that the SDK default (configurable with OTEL_TRACES_SAMPLER) is used.
+    """
+    ratio = os.environ.get(TRACER_SAMPLING_RATIO_ENV_VARIABLE)
+    max_traces_per_second = os.environ.get(TRACER_MAX_TRACES_PER_SECOND_ENV_VARIABLE)
+    if ratio is None and max_traces_per_second is None:
+        return None
+    root = TraceIdRatioBased(float(ratio)) if ratio is not None else ALWAYS_ON
+    if max_traces_per_second is not None:
+        root = RateLimitingSampler(float(max_traces_per_second), root)
+    return ParentBased(root)
@@ -3,24 +3,28 @@ from functools import wraps
 from typing import Iterator
 
 from opentelemetry import propagate
-from opentelemetry.context import Context
 from opentelemetry.propagators.b3 import B3MultiFormat
-from opentelemetry.propagators.textmap import Getter
+from opentelemetry.propagators.textmap import Getter, Setter
 from opentelemetry.trace import Span, SpanKind
 
 from cdk_example_app.common.tracing.tracer import tracer
 
 
-def _message_attribute_setter(message_attributes, key, value):
-    message_attributes[key] = {"StringValue": value, "DataType": "String"}
+class _MessageAttributeSetter(Setter):
+    def set(self, carrier, key: str, value: str):
+        carrier[key] = {"StringValue": value, "DataType": "String"}
+
+
+def inject_trace_context(message_attributes: dict) -> dict:
+    """Add the B3 headers of the current span to the (send_message) message attributes"""
+    B3MultiFormat().inject(message_attributes, setter=_MessageAttributeSetter())
+    return message_attributes
 
 
 def sqs_trace_propagator(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        message_attributes = kwargs.get("MessageAttributes", {})
-        B3MultiFormat().inject(_message_attribute_setter, Context(message_attributes))
-        kwargs["MessageAttributes"] = message_attributes
+        kwargs["MessageAttributes"] = inject_trace_context(kwargs.get("MessageAttributes", {}))
         return func(*args, **kwargs)
 
     return wrapper
@@ -38,6 +42,6 @@ class _MessageAttributeGetter(Getter):
 def start_sqs_root_span(
     name: str, sqs_record, kind: SpanKind = SpanKind.SERVER, end_on_exit: bool = True, **kwargs
 ) -> Iterator[Span]:
-    ctx = propagate.extract(_MessageAttributeGetter(), sqs_record.get("messageAttributes", {}))
+    ctx = propagate.extract(sqs_record.get("messageAttributes", {}), getter=_MessageAttributeGetter())
     with tracer.start_as_current_span(name, context=ctx, kind=kind, end_on_exit=end_on_exit, **kwargs) as span:
         yield span
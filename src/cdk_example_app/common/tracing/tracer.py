@@ -6,29 +6,66 @@ from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
 from opentelemetry.propagators.b3 import B3MultiFormat
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
 from opentelemetry.trace import Tracer, format_trace_id
 
-from cdk_example_app.common.tracing.logger_span_exporter import LoggerSpanExporter
+from cdk_example_app.common.tracing.logger_span_exporter import (
+    CompactSpanExporter,
+    LoggerSpanExporter,
+)
+from cdk_example_app.common.tracing.sampling import create_sampler
 
 TRACER_SERVICE_NAME_ENV_VARIABLE = "TRACER_SERVICE_NAME"
+# "batch" (default) or "simple" to export every span synchronously when it ends
+TRACER_SPAN_PROCESSOR_ENV_VARIABLE = "TRACER_SPAN_PROCESSOR"
+# "logger" (default) to log every span with the powertools logger or "compact" to write batches of spans to stdout
+TRACER_EXPORT_FORMAT_ENV_VARIABLE = "TRACER_EXPORT_FORMAT"
+FORCE_FLUSH_TIMEOUT_MILLIS = 5000
 
 logger = Logger()
 
 
+def _append_trace_id_to_logger(span):
+    trace_id = format_trace_id(span.context.trace_id)
+    logger.structure_logs(append=True, traceId=trace_id, correlationId=trace_id)
+
+
 class LoggerContextSimpleExportSpanProcessor(SimpleSpanProcessor):
     def on_start(self, span, parent_context=None):
-        trace_id = format_trace_id(span.context.trace_id)
-        logger.structure_logs(append=True, traceId=trace_id, correlationId=trace_id)
+        _append_trace_id_to_logger(span)
+
+
+class LoggerContextBatchSpanProcessor(BatchSpanProcessor):
+    """Queues ended spans and exports them in bulk from a background thread (configurable with the OTEL_BSP_*
+    environment variables). Lambda freezes the background thread between invocations, so event handlers must call
+    `force_flush()` before they return."""
+
+    def on_start(self, span, parent_context=None):
+        _append_trace_id_to_logger(span)
+
+
+def _create_span_processor(exporter):
+    if os.environ.get(TRACER_SPAN_PROCESSOR_ENV_VARIABLE, "batch").lower() == "simple":
+        return LoggerContextSimpleExportSpanProcessor(exporter)
+    return LoggerContextBatchSpanProcessor(exporter)
+
+
+def force_flush():
+    """Export all queued spans, call this at the end of every invocation before the Lambda runtime freezes"""
+    trace_provider.force_flush(FORCE_FLUSH_TIMEOUT_MILLIS)
 
 
 trace_provider = TracerProvider(
+    sampler=create_sampler(),
     resource=Resource.create(
         {SERVICE_NAME: os.environ.get(TRACER_SERVICE_NAME_ENV_VARIABLE, "TRACER_SERVICE_NAME_UNSPECIFIED")}
-    )
+    ),
 )
-logger_span_exporter = LoggerSpanExporter()
-trace_provider.add_span_processor(LoggerContextSimpleExportSpanProcessor(logger_span_exporter))
+if os.environ.get(TRACER_EXPORT_FORMAT_ENV_VARIABLE, "logger").lower() == "compact":
+    logger_span_exporter = CompactSpanExporter()
+else:
+    logger_span_exporter = LoggerSpanExporter()
+trace_provider.add_span_processor(_create_span_processor(logger_span_exporter))
 trace.set_tracer_provider(trace_provider)
 tracer: Tracer = trace.get_tracer(__name__)
 
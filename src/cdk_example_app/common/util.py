@@ -1,5 +1,17 @@
 import base64
+import codecs
+import queue
+import threading
 import zlib
+from typing import Iterable, Iterator, List
+
+GZIP_MAGIC = b"\x1f\x8b"
+# accept both gzip and zlib headers
+_AUTO_DETECT_WBITS = zlib.MAX_WBITS | 32
+# items that parallel_iter buffers before the producers block
+PARALLEL_ITER_BUFFER_SIZE = 1000
+
+_END = object()
 
 
 def compress_base64(data: str) -> str:
@@ -8,3 +20,124 @@ def compress_base64(data: str) -> str:
 
 def decompress_base64(encoded_data: str) -> str:
     return zlib.decompress(base64.b64decode(encoded_data)).decode()
+
+
+def compress_base64_chunks(chunks: Iterable[str]) -> Iterator[str]:
+    """Streaming variant of compress_base64: the concatenated result equals compress_base64 of the joined chunks"""
+    compressor = zlib.compressobj()
+    pending = b""
+    for chunk in chunks:
+        pending += compressor.compress(chunk.encode())
+        # base64 encodes groups of 3 bytes, keep the remainder for the next chunk
+        split = len(pending) - len(pending) % 3
+        if split:
+            yield base64.b64encode(pending[:split]).decode()
+            pending = pending[split:]
+    pending += compressor.flush()
+    if pending:
+        yield base64.b64encode(pending).decode()
+
+
+def decompress_base64_chunks(encoded_chunks: Iterable[str]) -> Iterator[str]:
+    """Streaming variant of decompress_base64"""
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in encoded_chunks:
+        pending += chunk
+        # base64 decodes groups of 4 characters, keep the remainder for the next chunk
+        split = len(pending) - len(pending) % 4
+        if split:
+            text = decoder.decode(decompressor.decompress(base64.b64decode(pending[:split])))
+            pending = pending[split:]
+            if text:
+                yield text
+    text = decoder.decode(decompressor.decompress(base64.b64decode(pending)) + decompressor.flush(), final=True)
+    if text:
+        yield text
+
+
+def is_gzip(data: bytes) -> bool:
+    return data[:2] == GZIP_MAGIC
+
+
+def decompress_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress gzip, zlib or raw deflate compressed byte chunks without keeping the (de)compressed data in memory.
+
+    Concatenated gzip members (as produced by appending gzip files) are decompressed one after the other. A truncated
+    stream raises a zlib.error.
+    """
+    decompressor = zlib.decompressobj(_AUTO_DETECT_WBITS)
+    # whether the current decompressor received input (and must reach the end of its stream)
+    started = False
+    first = True
+    for chunk in chunks:
+        while chunk:
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error:
+                if not first:
+                    raise
+                # "deflate" content encoding without the zlib header
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = decompressor.decompress(chunk)
+            started = True
+            first = False
+            if data:
+                yield data
+            chunk = b""
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(_AUTO_DETECT_WBITS)
+                started = False
+    data = decompressor.flush()
+    if data:
+        yield data
+    if started and not decompressor.eof:
+        raise zlib.error("incomplete compressed stream")
+
+
+def _put(items: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put the item in the queue unless the consumer stopped, returns whether it was added"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def parallel_iter(iterables: List[Iterable], buffer_size: int = PARALLEL_ITER_BUFFER_SIZE) -> Iterator:
+    """Consume every iterable in its own thread and yield the items in the order in which they are produced.
+
+    At most `buffer_size` items are buffered. The first exception of an iterable is re-raised, and the threads stop
+    when the consumer stops iterating.
+    """
+    items = queue.Queue(buffer_size)
+    stop = threading.Event()
+
+    def produce(iterable: Iterable):
+        try:
+            for item in iterable:
+                if not _put(items, (None, item), stop):
+                    return
+            _put(items, (_END, None), stop)
+        # pylint: disable=broad-except
+        except Exception as e:
+            _put(items, (_END, e), stop)
+
+    for iterable in iterables:
+        threading.Thread(target=produce, args=(iterable,), daemon=True).start()
+    try:
+        remaining = len(iterables)
+        while remaining:
+            marker, item = items.get()
+            if marker is not _END:
+                yield item
+                continue
+            remaining -= 1
+            if item is not None:
+                raise item
+    finally:
+        stop.set()
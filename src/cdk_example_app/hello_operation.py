@@ -1,5 +1,5 @@
-from flask import jsonify
+from cdk_example_app.common.connexion.application_factory import json_response
 
 
 def hello_world():
-    return jsonify(greeting="Hello world!!")
+    return json_response({"greeting": "Hello world!!"})
@@ -0,0 +1,42 @@
+"""Per-request latency of the api_lambda handler: native dispatch versus serverless_wsgi.
+
+Run with `poetry run python -m tests.benchmarks.api_gateway_latency`
+"""
+import timeit
+
+import serverless_wsgi
+
+from cdk_example_app.api_lambda import app, dispatcher
+
+REQUESTS = 5_000
+
+
+def event(path):
+    return {
+        "httpMethod": "GET",
+        "path": path,
+        "headers": {"Host": "example.execute-api.eu-west-1.amazonaws.com", "X-Forwarded-Proto": "https"},
+        "multiValueHeaders": None,
+        "queryStringParameters": None,
+        "multiValueQueryStringParameters": None,
+        "pathParameters": None,
+        "body": None,
+        "isBase64Encoded": False,
+        "requestContext": {"stage": "prod", "identity": {"sourceIp": "127.0.0.1"}},
+    }
+
+
+def benchmark(name, handler, path):
+    request = event(path)
+    seconds = min(timeit.repeat(lambda: handler(request, None), number=REQUESTS, repeat=3))
+    print(f"{name:<8} {path:<8} {seconds / REQUESTS * 1_000_000:8.1f} µs/request")
+
+
+def main():
+    for path in ("/hello", "/info"):
+        benchmark("wsgi", lambda event_, context: serverless_wsgi.handle_request(app, event_, context), path)
+        benchmark("native", dispatcher, path)
+
+
+if __name__ == "__main__":
+    main()
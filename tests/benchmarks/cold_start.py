@@ -0,0 +1,80 @@
+"""Cold start (module import and tracing initialisation) of the Lambda handlers with tracing enabled and disabled.
+
+Every measurement runs in a fresh interpreter, the minimum of a few runs is reported. The import time of the top level
+packages (from `python -X importtime`) shows where the time goes with and without tracing.
+
+Run with `poetry run python -m tests.benchmarks.cold_start`
+"""
+import os
+import subprocess
+import sys
+from collections import Counter
+
+RUNS = 10
+# number of top level packages in the import time breakdown
+TOP_PACKAGES = 12
+HANDLER_MODULES = ["cdk_example_app.s3_integration_event_lambda", "cdk_example_app.api_lambda"]
+
+MEASURE = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from cdk_example_app.common.tracing.lazy_tracer import init_tracing
+init_tracing()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def _env(tracing_enabled: bool) -> dict:
+    return {**os.environ, "TRACING_ENABLED": str(tracing_enabled).lower()}
+
+
+def measure(module: str, tracing_enabled: bool):
+    env = _env(tracing_enabled)
+    results = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(module=module)], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results.append([float(value) for value in output.split()])
+    return min(import_time for import_time, _ in results), min(init_time for _, init_time in results)
+
+
+def import_times(module: str, tracing_enabled: bool) -> Counter:
+    """Self import time in microseconds per top level package, from `python -X importtime` (which logs to stderr)"""
+    code = f"import {module}\nfrom cdk_example_app.common.tracing.lazy_tracer import init_tracing\ninit_tracing()"
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=_env(tracing_enabled),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    times = Counter()
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, name = line[len("import time:") :].split("|")
+        times[name.strip().split(".")[0]] += int(self_time)
+    return times
+
+
+def main():
+    print(f"{'handler':<48} {'tracing':<8} {'import':>10} {'init':>10}")
+    for module in HANDLER_MODULES:
+        for tracing_enabled in (True, False):
+            import_time, init_time = measure(module, tracing_enabled)
+            print(f"{module:<48} {str(tracing_enabled):<8} {import_time * 1000:8.1f}ms {init_time * 1000:8.1f}ms")
+
+    for module in HANDLER_MODULES:
+        enabled, disabled = import_times(module, True), import_times(module, False)
+        print(f"\n{module} import time per package")
+        print(f"{'package':<32} {'tracing':>10} {'no tracing':>10}")
+        for package, _ in (enabled + disabled).most_common(TOP_PACKAGES):
+            print(f"{package:<32} {enabled[package] / 1000:8.1f}ms {disabled[package] / 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Per-call overhead of a traced (botocore like) call with sampling on and off.
+
+Run with `poetry run python -m tests.benchmarks.tracing_overhead`
+"""
+import timeit
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import (
+    ALWAYS_OFF,
+    ALWAYS_ON,
+    ParentBased,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import SpanKind
+
+from cdk_example_app.common.tracing.sampling import RateLimitingSampler
+from cdk_example_app.common.tracing.tracer import LoggerContextBatchSpanProcessor
+
+CALLS = 20_000
+
+
+class NoopSpanExporter(SpanExporter):
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+def traced_call(tracer):
+    with tracer.start_as_current_span("S3.GetObject", kind=SpanKind.CLIENT) as span:
+        span.set_attribute("aws.service", "s3")
+        span.set_attribute("aws.operation", "GetObject")
+        span.set_attribute("s3Key", "my-key")
+
+
+def benchmark(name, sampler):
+    provider = TracerProvider(sampler=sampler)
+    provider.add_span_processor(LoggerContextBatchSpanProcessor(NoopSpanExporter()))
+    tracer = provider.get_tracer(__name__)
+    seconds = min(timeit.repeat(lambda: traced_call(tracer), number=CALLS, repeat=3))
+    provider.shutdown()
+    print(f"{name:<32} {seconds / CALLS * 1_000_000:8.2f} µs/call")
+
+
+def main():
+    benchmark("sampling on (always on)", ParentBased(ALWAYS_ON))
+    benchmark("ratio 0.1", ParentBased(TraceIdRatioBased(0.1)))
+    benchmark("rate limit 10 traces/s", ParentBased(RateLimitingSampler(10)))
+    benchmark("sampling off (always off)", ParentBased(ALWAYS_OFF))
+
+
+if __name__ == "__main__":
+    main()
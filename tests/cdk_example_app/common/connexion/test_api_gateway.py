@@ -0,0 +1,124 @@
+import json
+
+import pytest
+from flask import request
+
+from cdk_example_app.common.connexion.api_gateway import ApiGatewayDispatcher
+from cdk_example_app.common.connexion.application_factory import create_app
+
+# pylint: disable=redefined-outer-name
+
+MODULE = __name__
+
+SPECIFICATION = f"""
+openapi: 3.0.3
+info:
+  title: test
+  version: 0.1.0
+paths:
+  /items/{{item_id}}:
+    parameters:
+      - {{name: item_id, in: path, required: true, schema: {{type: integer}}}}
+    get:
+      operationId: {MODULE}.get_item
+      parameters:
+        - {{name: tags, in: query, schema: {{type: array, items: {{type: string}}}}}}
+        - {{name: verbose, in: query, schema: {{type: boolean, default: false}}}}
+      responses:
+        200:
+          description: item
+    put:
+      operationId: {MODULE}.put_item
+      requestBody:
+        required: true
+        content:
+          application/json:
+            schema: {{type: object, required: [name], properties: {{name: {{type: string}}}}}}
+      responses:
+        200:
+          description: item
+  /wsgi:
+    get:
+      operationId: {MODULE}.get_wsgi
+      x-wsgi: true
+      responses:
+        200:
+          description: uses flask.request
+"""
+
+
+def get_item(item_id, verbose, tags=None):
+    return {"id": item_id, "tags": tags, "verbose": verbose}
+
+
+def put_item(item_id, body):
+    if body["name"] == "fail":
+        raise ValueError("fail")
+    return {"id": item_id, **body}, 201
+
+
+def get_wsgi():
+    return {"path": request.path}
+
+
+@pytest.fixture
+def dispatcher(tmp_path):
+    (tmp_path / "api.yaml").write_text(SPECIFICATION)
+    return ApiGatewayDispatcher(create_app(MODULE, "api.yaml", specification_dir=tmp_path))
+
+
+def event(method, path, query=None, body=None):
+    return {
+        "httpMethod": method,
+        "path": path,
+        "headers": {"Content-Type": "application/json"},
+        "multiValueQueryStringParameters": query,
+        "body": json.dumps(body) if body else None,
+        "isBase64Encoded": False,
+        "requestContext": {},
+    }
+
+
+def invoke(dispatcher, *args, **kwargs):
+    response = dispatcher(event(*args, **kwargs), None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_dispatch_with_parameters(dispatcher):
+    assert [route.operation_id for route in dispatcher.routes] == [f"{MODULE}.get_item", f"{MODULE}.put_item"]
+    assert invoke(dispatcher, "GET", "/items/1", {"tags": ["a", "b"], "verbose": ["true"]}) == (
+        200,
+        {"id": 1, "tags": ["a", "b"], "verbose": True},
+    )
+    assert invoke(dispatcher, "GET", "/items/1/") == (200, {"id": 1, "tags": None, "verbose": False})
+
+
+def test_dispatch_with_body(dispatcher):
+    assert invoke(dispatcher, "PUT", "/items/1", body={"name": "foo"}) == (201, {"id": 1, "name": "foo"})
+
+
+@pytest.mark.parametrize(
+    "args, kwargs, error",
+    [
+        (("GET", "/items/x"), {}, "path parameter 'item_id': 'x' is not of type 'integer'"),
+        (("PUT", "/items/1"), {}, "Request body is required"),
+        (("PUT", "/items/1"), {"body": {"foo": "bar"}}, "body: 'name' is a required property"),
+    ],
+)
+def test_validation_errors(dispatcher, args, kwargs, error):
+    assert invoke(dispatcher, *args, **kwargs) == (
+        400,
+        {"message": "Bad Request", "errors": [error], "code": "VALIDATION_ERROR"},
+    )
+
+
+def test_operation_exception(dispatcher):
+    assert invoke(dispatcher, "PUT", "/items/1", body={"name": "fail"}) == (
+        500,
+        {"message": "Internal Server Error", "code": "INTERNAL_SERVER_ERROR"},
+    )
+
+
+def test_wsgi_fallback(dispatcher):
+    assert invoke(dispatcher, "GET", "/wsgi") == (200, {"path": "/wsgi"})
+    assert invoke(dispatcher, "DELETE", "/items/1")[0] == 405
@@ -0,0 +1,70 @@
+import gzip
+import json
+
+import pytest
+from flask import Response
+
+from cdk_example_app.common.connexion import compression
+from cdk_example_app.common.connexion.api_gateway import ApiGatewayDispatcher
+from cdk_example_app.common.connexion.application_factory import create_app
+
+BODY = json.dumps({"items": list(range(500))})
+
+
+def response(body=BODY, **kwargs):
+    return Response(body, mimetype="application/json", **kwargs)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        ("gzip, deflate", "gzip"),
+        ("deflate", None),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("*;q=0.5, gzip;q=0", None),
+        (None, None),
+    ],
+)
+def test_select_encoding(monkeypatch, accept_encoding, encoding):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert compression.select_encoding(accept_encoding) == encoding
+
+
+def test_compress_response():
+    compressed = compression.compress_response(response(headers={"ETag": '"abc"'}), "gzip")
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert compressed.headers["ETag"] == 'W/"abc"'
+    assert gzip.decompress(compressed.get_data()).decode() == BODY
+
+
+@pytest.mark.parametrize(
+    "uncompressed",
+    [
+        response("{}"),
+        response(status=404),
+        response(headers={"Content-Encoding": "br"}),
+        Response(b"\0" * 2000, mimetype="image/png"),
+    ],
+)
+def test_response_not_compressed(uncompressed):
+    content_encoding = uncompressed.headers.get("Content-Encoding")
+    body = uncompressed.get_data()
+    result = compression.compress_response(uncompressed, "gzip")
+    assert result.headers.get("Content-Encoding") == content_encoding
+    assert result.get_data() == body
+
+
+def test_compressed_api_responses(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    connexion_app = create_app("cdk_example_app.api_lambda", "openApi.yaml", compression_min_size=10)
+    client = connexion_app.app.test_client()
+    assert client.get("/hello").headers.get("Content-Encoding") is None
+    wsgi = client.get("/hello", headers={"Accept-Encoding": "gzip"})
+    assert json.loads(gzip.decompress(wsgi.data)) == {"greeting": "Hello world!!"}
+
+    dispatcher = ApiGatewayDispatcher(connexion_app)
+    native = dispatcher({"httpMethod": "GET", "path": "/hello", "headers": {"accept-encoding": "gzip"}}, None)
+    assert native["isBase64Encoded"]
+    assert native["headers"]["Content-Encoding"] == "gzip"
@@ -0,0 +1,115 @@
+import pytest
+from flask import Response
+
+from cdk_example_app.common.connexion.api_gateway import ApiGatewayDispatcher
+from cdk_example_app.common.connexion.application_factory import create_app
+from cdk_example_app.common.connexion.response_cache import ResponseCache, etag_matches
+
+# pylint: disable=redefined-outer-name
+
+MODULE = __name__
+
+SPECIFICATION = f"""
+openapi: 3.0.3
+info:
+  title: test
+  version: 0.1.0
+paths:
+  /counter:
+    get:
+      operationId: {MODULE}.get_counter
+      x-cache-ttl: 60
+      parameters:
+        - {{name: fail, in: query, schema: {{type: boolean, default: false}}}}
+      responses:
+        200:
+          description: counter
+  /counters/{{step}}:
+    get:
+      operationId: {MODULE}.get_counter_step
+      x-cache-ttl: 60
+      parameters:
+        - {{name: step, in: path, required: true, schema: {{type: integer}}}}
+      responses:
+        200:
+          description: counter
+"""
+
+calls = []
+
+
+def get_counter(fail):
+    calls.append(fail)
+    if fail:
+        return {"calls": len(calls)}, 500
+    return {"calls": len(calls)}
+
+
+def get_counter_step(step):
+    calls.append(step)
+    return {"calls": len(calls), "step": step}
+
+
+@pytest.fixture
+def connexion_app(tmp_path):
+    calls.clear()
+    (tmp_path / "api.yaml").write_text(SPECIFICATION)
+    return create_app(MODULE, "api.yaml", specification_dir=tmp_path)
+
+
+def test_cached_operation(connexion_app):
+    client = connexion_app.app.test_client()
+    first = client.get("/counter")
+    second = client.get("/counter")
+    assert first.json == second.json == {"calls": 1}
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert second.headers["Cache-Control"] == "max-age=60"
+
+    not_modified = client.get("/counter", headers={"If-None-Match": first.headers["ETag"]})
+    assert not_modified.status_code == 304
+    assert not not_modified.data
+
+    assert client.get("/counter?fail=true").status_code == 500
+    assert client.get("/counter?fail=true").status_code == 500
+    assert len(calls) == 3
+
+
+def test_cached_operation_with_path_parameter(connexion_app):
+    client = connexion_app.app.test_client()
+    assert client.get("/counters/2").json == client.get("/counters/2").json == {"calls": 1, "step": 2}
+    assert client.get("/counters/3").json == {"calls": 2, "step": 3}
+
+
+def test_cached_operation_with_dispatcher(connexion_app):
+    dispatcher = ApiGatewayDispatcher(connexion_app)
+    event = {"httpMethod": "GET", "path": "/counter", "headers": {}}
+    first = dispatcher(event, None)
+    assert dispatcher(event, None)["body"] == first["body"]
+    assert len(calls) == 1
+
+    event["headers"] = {"if-none-match": first["headers"]["ETag"]}
+    assert dispatcher(event, None)["statusCode"] == 304
+    # the WSGI path shares the cache
+    assert connexion_app.app.test_client().get("/counter").json == {"calls": 1}
+
+
+def test_response_cache_ttl_and_size(mocker):
+    monotonic = mocker.patch("cdk_example_app.common.connexion.response_cache.time.monotonic", return_value=100.0)
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", Response("a"), ttl=10)
+    cache.put("b", Response("b"), ttl=20)
+    assert cache.get("a").body == b"a"
+    cache.put("c", Response("c"), ttl=20)  # evicts the least recently used entry
+    assert cache.get("b") is None
+
+    monotonic.return_value = 110.0
+    assert cache.get("a") is None
+    assert cache.get("c").to_response().headers["Cache-Control"] == "max-age=10"
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [(None, False), ('"abc"', True), ('W/"abc"', True), ('"xyz", "abc"', True), ("*", True), ('"xyz"', False)],
+)
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches('"abc"', if_none_match) == matches
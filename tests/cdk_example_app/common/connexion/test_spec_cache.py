@@ -0,0 +1,57 @@
+import pathlib
+
+import pytest
+from connexion.exceptions import InvalidSpecification
+
+from cdk_example_app.common import aws_clients
+from cdk_example_app.common.connexion import spec_cache
+from cdk_example_app.common.connexion.application_factory import (
+    aws_client_factories,
+    create_app,
+    warm_up,
+)
+
+SPECIFICATION = pathlib.Path(__file__).parents[4] / "src/cdk_example_app/openApi.yaml"
+
+
+def test_create_app_from_spec_cache(tmp_path, mocker):
+    spec_cache.compile_spec(SPECIFICATION, tmp_path)
+    validate_spec = mocker.spy(spec_cache.Specification, "_validate_spec")
+
+    client = create_app("cdk_example_app.api_lambda", "openApi.yaml", spec_cache_dir=tmp_path).app.test_client()
+
+    assert client.get("/hello").json == {"greeting": "Hello world!!"}
+    validate_spec.assert_not_called()
+    assert spec_cache.Specification.__dict__["_validate_spec"] is validate_spec
+
+
+def test_outdated_spec_cache_is_ignored(tmp_path):
+    specification = tmp_path / "openApi.yaml"
+    specification.write_text(SPECIFICATION.read_text())
+    spec_cache.compile_spec(specification, tmp_path)
+    assert spec_cache.load_spec(specification, tmp_path)["paths"].keys() == {"/hello", "/info"}
+
+    specification.write_text(SPECIFICATION.read_text().replace("/hello", "/bye"))
+    assert spec_cache.load_spec(specification, tmp_path) is None
+
+
+def test_missing_spec_cache(tmp_path):
+    assert spec_cache.load_spec(SPECIFICATION, tmp_path) is None
+
+
+def test_compile_invalid_spec(tmp_path):
+    specification = tmp_path / "openApi.yaml"
+    specification.write_text("openapi: 3.0.3\npaths: 1\n")
+    with pytest.raises(InvalidSpecification):
+        spec_cache.compile_spec(specification, tmp_path)
+
+
+def test_warm_up_creates_aws_clients(monkeypatch, mocker):
+    monkeypatch.setenv("WARM_UP_AWS_CLIENTS", "s3, sqs")
+    client = mocker.patch.object(aws_clients, "client")
+    session = mocker.patch.object(aws_clients, "session")
+
+    warm_up(create_app("cdk_example_app.api_lambda", "openApi.yaml"), *aws_client_factories())
+
+    session.assert_called_once_with()
+    assert [call.args for call in client.call_args_list] == [("s3",), ("sqs",)]
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+import pytest
+
+from cdk_example_app.common import async_http_session
+from cdk_example_app.common.tracing import lazy_tracer
+
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture(autouse=True)
+def flush_spans():
+    yield
+    lazy_tracer.force_flush()
+
+
+@pytest.fixture
+def no_backoff(mocker):
+    return mocker.patch("cdk_example_app.common.async_http_session.asyncio.sleep", new_callable=mocker.AsyncMock)
+
+
+def _get(handler, url="https://example.com/hello"):
+    async def get():
+        async with async_http_session.create_async_session(transport=httpx.MockTransport(handler)) as session:
+            return await session.get(url)
+
+    return asyncio.run(get())
+
+
+def test_retries_failed_statuses(no_backoff):
+    statuses = iter([503, 502, 200])
+    response = _get(lambda request: httpx.Response(next(statuses)))
+    assert response.status_code == 200
+    assert no_backoff.call_count == 2
+
+
+@pytest.mark.usefixtures("no_backoff")
+def test_gives_up_after_max_retries():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    assert _get(handler).status_code == 500
+    assert len(calls) == 3
+
+
+def test_honours_retry_after(no_backoff):
+    statuses = iter([429, 200])
+    response = _get(lambda request: httpx.Response(next(statuses), headers={"Retry-After": "3"}))
+    assert response.status_code == 200
+    no_backoff.assert_called_once_with(3)
+
+
+def test_does_not_retry_client_errors():
+    assert _get(lambda request: httpx.Response(404)).status_code == 404
+
+
+def test_default_timeout():
+    session = async_http_session.create_async_session()
+    assert session.timeout == httpx.Timeout(async_http_session.DEFAULT_TIMEOUT)
+
+
+def test_injects_trace_context():
+    with lazy_tracer.get_tracer().start_as_current_span("parent"):
+        response = _get(lambda request: httpx.Response(200, json=dict(request.headers)))
+    assert "x-b3-traceid" in response.json()
+
+
+def test_no_trace_context_when_tracing_disabled(monkeypatch):
+    monkeypatch.setenv("TRACING_ENABLED", "false")
+    response = _get(lambda request: httpx.Response(200, json=dict(request.headers)))
+    assert "x-b3-traceid" not in response.json()
+
+
+def test_gather_limits_concurrency():
+    running = []
+    peak = []
+
+    async def task(value):
+        running.append(value)
+        peak.append(len(running))
+        await asyncio.sleep(0)
+        running.remove(value)
+        return value
+
+    results = asyncio.run(async_http_session.gather(*(task(value) for value in range(5)), max_concurrency=2))
+    assert results == list(range(5))
+    assert max(peak) == 2
+
+
+def test_run_concurrently(mocker):
+    session = async_http_session.create_async_session(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, text=request.url.path))
+    )
+    mocker.patch("cdk_example_app.common.async_http_session._shared_session", return_value=session)
+    responses = async_http_session.run_concurrently(
+        lambda session: session.get("https://example.com/hello"),
+        lambda session: session.get("https://example.com/info"),
+    )
+    assert [response.text for response in responses] == ["/hello", "/info"]
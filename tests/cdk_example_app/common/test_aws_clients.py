@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import pytest
+
+from cdk_example_app.common import aws_clients
+from cdk_example_app.common.event_log import EventLog
+
+# pylint: disable=redefined-outer-name
+
+
+def clear_clients():
+    # pylint: disable=protected-access
+    aws_clients.botocore_config.cache_clear()
+    aws_clients._create_client.cache_clear()
+    aws_clients._pool_metrics.clear()
+
+
+@pytest.fixture
+def fresh_clients():
+    clear_clients()
+    yield
+    clear_clients()
+
+
+@pytest.mark.usefixtures("fresh_clients")
+def test_shared_client(monkeypatch):
+    monkeypatch.setenv("AWS_MAX_POOL_CONNECTIONS", "20")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        clients = list(executor.map(lambda _: aws_clients.client("s3"), range(8)))
+    assert all(client is clients[0] for client in clients)
+    config = clients[0].meta.config
+    assert config.max_pool_connections == 20
+    assert config.tcp_keepalive
+    assert config.retries["mode"] == "adaptive"
+
+
+@pytest.mark.usefixtures("fresh_clients")
+def test_pool_metrics(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-1")
+    monkeypatch.setenv("AWS_MAX_POOL_CONNECTIONS", "2")
+    events = aws_clients.client("sqs").meta.events
+    for _ in range(3):
+        events.emit("before-send.sqs.SendMessage", request=None)
+    events.emit("response-received.sqs.SendMessage", exception=None)
+
+    assert aws_clients.pool_metrics()["sqs"] == {
+        "maxConnections": 2,
+        "requests": 3,
+        "inFlight": 2,
+        "peakInFlight": 3,
+        "saturatedRequests": 1,
+    }
+    metrics = Mock()
+    aws_clients.add_pool_metrics(metrics)
+    assert {call.kwargs["name"]: call.kwargs["value"] for call in metrics.add_metric.call_args_list} == {
+        "AwsClientPool.sqs.peakInFlight": 3,
+        "AwsClientPool.sqs.saturatedRequests": 1,
+    }
+
+
+@pytest.mark.usefixtures("fresh_clients")
+def test_pool_metrics_are_reset_per_invocation(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-1")
+    monkeypatch.setenv("AWS_MAX_POOL_CONNECTIONS", "2")
+    events = aws_clients.client("sqs").meta.events
+    for _ in range(3):
+        events.emit("before-send.sqs.SendMessage", request=None)
+    events.emit("response-received.sqs.SendMessage", exception=None)
+    aws_clients.add_pool_metrics(Mock())
+
+    # the next invocation only counts its own requests, on top of the ones that are still in flight
+    for _ in range(2):
+        events.emit("response-received.sqs.SendMessage", exception=None)
+    events.emit("before-send.sqs.SendMessage", request=None)
+    metrics = Mock()
+    aws_clients.add_pool_metrics(metrics)
+    assert {call.kwargs["name"]: call.kwargs["value"] for call in metrics.add_metric.call_args_list} == {
+        "AwsClientPool.sqs.peakInFlight": 2,
+        "AwsClientPool.sqs.saturatedRequests": 0,
+    }
+    assert aws_clients.pool_metrics()["sqs"] == {
+        "maxConnections": 2,
+        "requests": 0,
+        "inFlight": 1,
+        "peakInFlight": 1,
+        "saturatedRequests": 0,
+    }
+
+
+def test_pynamodb_settings():
+    assert EventLog.Meta.max_pool_connections == aws_clients.max_pool_connections()
+    assert EventLog.Meta.connect_timeout_seconds == aws_clients.CONNECT_TIMEOUT
@@ -1,7 +1,20 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from aws_lambda_powertools import Logger
 
-from cdk_example_app.common.event_log import EventLog, event_log
+from cdk_example_app.common.event_log import (
+    PROCESSING_LEASE_TIMEOUT,
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_PROCESSING,
+    EventLog,
+    EventLogBatchWriter,
+    event_log,
+    query_status,
+    shard_key,
+)
 from tests.compare import assert_similar
 
 logger = Logger(service="event-log-test")
@@ -50,3 +63,159 @@ def test_with_event_log_raising_exception():
         },
     )
     # TODO check logger output
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_with_batched_event_log(mocker):
+    batch_write = mocker.spy(EventLog, "batch_write")
+    with EventLogBatchWriter(max_items=3) as writer:
+        for key in ["key-1", "key-2"]:
+            with event_log("my-bucket", key, "my-lambda", logger, writer):
+                pass
+        # the PROCESSING and DONE writes of both logs are coalesced in the buffer
+        assert EventLog.count() == 0
+        with pytest.raises(ValueError, match="my-error"):
+            with event_log("my-bucket", "key-3", "my-lambda", logger, writer):
+                raise ValueError("my-error")
+        # the buffer was flushed because it reached max_items
+        assert batch_write.call_count == 1
+        with event_log("my-bucket", "key-4", "my-lambda", logger, writer):
+            pass
+
+    assert batch_write.call_count == 2
+    assert [EventLog.get(key).status for key in ["key-1", "key-2", "key-3", "key-4"]] == [
+        STATUS_DONE,
+        STATUS_DONE,
+        STATUS_FAILED,
+        STATUS_DONE,
+    ]
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_with_event_log_updates_final_state(mocker):
+    save = mocker.spy(EventLog, "save")
+    update = mocker.spy(EventLog, "update")
+    with event_log("my-bucket", "my-key", "my-lambda", logger) as event_log_:
+        assert EventLog.get("my-key").status == STATUS_PROCESSING
+        event_log_.set_functional_key("funky", "music")
+
+    assert save.call_count == 1
+    assert update.call_count == 1
+    assert_similar(
+        EventLog.get("my-key").attribute_values,
+        {"status": STATUS_DONE, "functional_key_value": "music", "function": "my-lambda", "region": "eu-west-1"},
+    )
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_with_deferred_event_log(mocker):
+    save = mocker.spy(EventLog, "save")
+    with event_log("my-bucket", "my-key", "my-lambda", logger, deferred_write_delay=60):
+        assert EventLog.count() == 0
+
+    assert save.call_count == 1
+    assert EventLog.get("my-key").status == STATUS_DONE
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_with_deferred_event_log_exceeding_delay(mocker):
+    update = mocker.spy(EventLog, "update")
+    with event_log("my-bucket", "my-key", "my-lambda", logger, deferred_write_delay=0.01) as event_log_:
+        event_log_._deferred_write.join()  # pylint: disable=protected-access
+        assert EventLog.get("my-key").status == STATUS_PROCESSING
+
+    assert update.call_count == 1
+    assert EventLog.get("my-key").status == STATUS_DONE
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_deferred_write_and_set_attributes_are_serialized(mocker):
+    saving = threading.Event()
+    release = threading.Event()
+    save = EventLog.save
+
+    def slow_save(self, *args, **kwargs):
+        saving.set()
+        release.wait(5)
+        return save(self, *args, **kwargs)
+
+    mocker.patch.object(EventLog, "save", slow_save)
+    with event_log("my-bucket", "my-key", "my-lambda", logger, deferred_write_delay=0.01) as event_log_:
+        assert saving.wait(5)
+        setter = threading.Thread(target=event_log_.set_attributes, kwargs={"trace_id": "my-trace"})
+        setter.start()
+        setter.join(0.1)
+        # waits until the deferred write has serialized the log
+        assert setter.is_alive()
+        release.set()
+        setter.join()
+        assert EventLog.get("my-key").trace_id is None
+
+    assert EventLog.get("my-key").trace_id == "my-trace"
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_claim_rejects_object_that_is_being_processed():
+    def claim():
+        return EventLog(
+            s3_key="my-key",
+            s3_bucket="my-bucket",
+            status=STATUS_PROCESSING,
+            function="my-lambda",
+            region="eu-west-1",
+            received_time=datetime.now(timezone.utc),
+            etag="etag-1",
+        ).claim()
+
+    assert claim()
+    # a concurrent duplicate notification
+    assert not claim()
+
+    # the lease of a crashed invocation expired
+    stale = EventLog.get("my-key")
+    stale.update(actions=[EventLog.claimed_time.set(stale.claimed_time - PROCESSING_LEASE_TIMEOUT)])
+    assert claim()
+
+    EventLog.get("my-key").update(actions=[EventLog.status.set(STATUS_FAILED)])
+    assert claim()
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_idempotent_event_log_without_object_version():
+    for _ in range(2):
+        with event_log("my-bucket", "my-key", "my-lambda", logger, idempotent=True) as event_log_:
+            assert not event_log_.duplicate
+
+
+def test_shard_key(monkeypatch):
+    monkeypatch.setenv("EVENT_LOG_STATUS_INDEX_SHARDS", "4")
+    assert shard_key(STATUS_DONE, "my-key") == shard_key(STATUS_DONE, "my-key")
+    assert {shard_key(STATUS_DONE, f"key-{index}") for index in range(100)} == {f"DONE#{shard}" for shard in range(4)}
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_status_shard_follows_status():
+    with event_log("my-bucket", "my-key", "my-lambda", logger) as event_log_:
+        assert EventLog.get("my-key").status_shard == shard_key(STATUS_PROCESSING, "my-key")
+        event_log_.set_functional_key("funky", "music")
+
+    assert EventLog.get("my-key").status_shard == shard_key(STATUS_DONE, "my-key")
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_query_status():
+    now = datetime.now(timezone.utc)
+    for index in range(20):
+        EventLog(
+            s3_key=f"key-{index}",
+            s3_bucket="my-bucket",
+            status=STATUS_FAILED if index % 2 else STATUS_DONE,
+            function="my-lambda",
+            region="eu-west-1",
+            received_time=now - timedelta(minutes=index),
+        ).save()
+
+    failed = [log.s3_key for log in query_status([STATUS_FAILED], ordered=True)]
+    assert failed == [f"key-{index}" for index in range(19, 0, -2)]
+    recent = query_status([STATUS_DONE, STATUS_FAILED], received_after=now - timedelta(minutes=4, seconds=30))
+    assert sorted(log.s3_key for log in recent) == [f"key-{index}" for index in range(5)]
@@ -0,0 +1,119 @@
+import io
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pynamodb.indexes import IncludeProjection, KeysOnlyProjection
+
+from cdk_example_app.common import event_log_analytics
+from cdk_example_app.common.event_log import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_INDEX_INCLUDED_ATTRIBUTES,
+    STATUS_PROCESSING,
+    EventLog,
+)
+from cdk_example_app.common.event_log_analytics import (
+    EventLogAnalytics,
+    LatencyHistogram,
+)
+
+START = datetime(2021, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def create_log(index: int, function="fn-1", status=STATUS_DONE, latency=1.0) -> EventLog:
+    received_time = START + timedelta(seconds=index)
+    return EventLog(
+        s3_key=f"key-{index}",
+        s3_bucket="my-bucket",
+        status=status,
+        function=function,
+        region="eu-west-1",
+        received_time=received_time,
+        processed_time=None if status == STATUS_PROCESSING else received_time + timedelta(seconds=latency),
+    )
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    latencies = [random.uniform(0.01, 10) for _ in range(10000)]
+    for latency in latencies:
+        histogram.add(latency)
+    latencies.sort()
+    for percentile in (50, 95, 99):
+        exact = latencies[int(len(latencies) * percentile / 100) - 1]
+        assert histogram.percentile(percentile) == pytest.approx(exact, rel=0.03)
+    assert histogram.max == latencies[-1]
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_summary():
+    logs = [create_log(index, latency=index % 10 + 1) for index in range(100)]
+    logs += [create_log(100, status=STATUS_FAILED), create_log(101, status=STATUS_PROCESSING)]
+    logs += [create_log(200, function="fn-2", latency=0.5)]
+
+    summary = EventLogAnalytics().add_all(logs).summary()
+
+    assert len(summary) == 2
+    fn_1, fn_2 = summary[0], summary[1]
+
+    assert fn_1["function"] == "fn-1"
+    assert (fn_1["total"], fn_1["done"], fn_1["failed"], fn_1["processing"]) == (102, 100, 1, 1)
+    assert fn_1["failureRate"] == pytest.approx(1 / 101)
+    assert fn_1["p50Latency"] == pytest.approx(5, rel=0.03)
+    assert fn_1["p99Latency"] == pytest.approx(10, rel=0.03)
+    assert fn_1["maxLatency"] == 10
+    assert fn_1["meanLatency"] == pytest.approx(5.5)
+    # objects received in the first minute that are processed within that minute
+    assert fn_1["peakProcessedPerMinute"] == sum(1 for index in range(60) if index + index % 10 + 1 < 60)
+    assert fn_2["p95Latency"] == 0.5
+
+
+def test_throughput_and_export():
+    analytics = EventLogAnalytics().add_all([create_log(index, latency=30) for index in range(90)])
+    rows = analytics.throughput()
+    assert rows == [
+        {"function": "fn-1", "minute": "2021-06-01T12:00:00+00:00", "received": 60, "processed": 30},
+        {"function": "fn-1", "minute": "2021-06-01T12:01:00+00:00", "received": 30, "processed": 60},
+    ]
+    csv_file = io.StringIO()
+    event_log_analytics.write_csv(rows, csv_file)
+    assert csv_file.getvalue().splitlines()[0] == "function,minute,received,processed"
+    json_file = io.StringIO()
+    event_log_analytics.write_json(rows, json_file)
+    assert json.loads(json_file.getvalue()) == rows
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_scan_logs():
+    for index in range(10):
+        create_log(index, status=STATUS_FAILED if index == 0 else STATUS_DONE).save()
+
+    summary = EventLogAnalytics().add_all(event_log_analytics.scan_logs(segments=3)).summary()[0]
+
+    assert (summary["done"], summary["failed"]) == (9, 1)
+    assert summary["p50Latency"] == pytest.approx(1, rel=0.03)
+
+
+@pytest.mark.usefixtures("event_log_table")
+@pytest.mark.parametrize("projection", [KeysOnlyProjection(), IncludeProjection(STATUS_INDEX_INCLUDED_ATTRIBUTES)])
+def test_recent_logs_are_hydrated_without_all_projection(mocker, projection):
+    mocker.patch.object(EventLog.status_index.Meta, "projection", projection)
+    batch_get = mocker.spy(EventLog, "batch_get")
+    now = datetime.now(timezone.utc)
+    for index, status in enumerate([STATUS_DONE, STATUS_FAILED]):
+        EventLog(
+            s3_key=f"key-{index}",
+            s3_bucket="my-bucket",
+            status=status,
+            function="fn-1",
+            region="eu-west-1",
+            received_time=now - timedelta(seconds=10),
+            processed_time=now,
+        ).save()
+
+    summary = EventLogAnalytics().add_all(event_log_analytics.recent_logs(timedelta(minutes=1))).summary()[0]
+
+    assert (summary["done"], summary["failed"]) == (1, 1)
+    assert batch_get.call_args.kwargs["attributes_to_get"] == event_log_analytics.ANALYTICS_ATTRIBUTES
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from cdk_example_app.common.event_log import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    EventLog,
+    query_status,
+)
+from cdk_example_app.common.event_log_migration import backfill_status_shards
+
+
+@pytest.mark.usefixtures("event_log_table")
+def test_backfill_status_shards():
+    for index in range(10):
+        log = EventLog(
+            s3_key=f"key-{index}",
+            s3_bucket="my-bucket",
+            status=STATUS_FAILED,
+            function="my-lambda",
+            region="eu-west-1",
+            received_time=datetime.now(timezone.utc),
+        )
+        if index < 6:
+            # written before the index was sharded
+            log.status_shard = None
+        elif index == 6:
+            log.status_shard = f"{STATUS_DONE}#0"
+        log.save()
+    assert len(list(query_status([STATUS_FAILED]))) == 3
+
+    assert backfill_status_shards(segments=2, dry_run=True) == {"updated": 7, "unchanged": 3}
+    assert backfill_status_shards(segments=2) == {"updated": 7, "unchanged": 3}
+    assert len(list(query_status([STATUS_FAILED]))) == 10
+    assert backfill_status_shards(segments=2) == {"unchanged": 10}
@@ -0,0 +1,47 @@
+import datetime
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from cdk_example_app.common import fast_json
+
+VALUE = {
+    "int": Decimal("1"),
+    "float": Decimal("1.5"),
+    "date": datetime.date(2021, 9, 1),
+    "datetime": datetime.datetime(2021, 9, 1, 12, 30, tzinfo=datetime.timezone.utc),
+    "uuid": uuid.UUID("12345678123456781234567812345678"),
+    "list": [1, "a", None, True],
+}
+EXPECTED = (
+    '{"int":1,"float":1.5,"date":"2021-09-01","datetime":"2021-09-01T12:30:00+00:00",'
+    '"uuid":"12345678-1234-5678-1234-567812345678","list":[1,"a",null,true]}'
+)
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def implementation(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(fast_json, "orjson", None)
+    elif not fast_json.orjson:
+        pytest.skip("orjson is not installed")
+
+
+@pytest.mark.usefixtures("implementation")
+def test_dumps():
+    assert fast_json.dumps(VALUE) == EXPECTED
+    assert fast_json.dumps_bytes(VALUE) == EXPECTED.encode()
+    assert fast_json.loads(EXPECTED)["list"] == [1, "a", None, True]
+
+
+@pytest.mark.usefixtures("implementation")
+def test_dumps_with_json_kwargs():
+    assert fast_json.dumps({"b": Decimal("1"), "a": [1]}, sort_keys=True) == '{"a":[1],"b":1}'
+    assert fast_json.dumps({"a": [1]}, indent=2) == '{\n  "a": [\n    1\n  ]\n}'
+
+
+@pytest.mark.usefixtures("implementation")
+def test_dumps_unsupported_type():
+    with pytest.raises(TypeError):
+        fast_json.dumps(object())
@@ -0,0 +1,123 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from cdk_example_app.common import http_session, invocation
+
+# pylint: disable=redefined-outer-name
+
+
+class Context:
+    def __init__(self, remaining_millis: int):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+@pytest.fixture(autouse=True)
+def fresh_hosts(mocker, monkeypatch):
+    monkeypatch.setenv("TRACING_ENABLED", "false")
+    mocker.patch.object(http_session, "_hosts", {})
+    mocker.patch("urllib3.util.retry.time.sleep")
+    yield
+    invocation.start(None)
+
+
+@pytest.fixture
+def server():
+    """Local server that responds with the statuses of `server.statuses` (200 when empty)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            status, headers = httpd.statuses.pop(0) if httpd.statuses else (200, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.statuses = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+
+
+def test_retries_failed_status(server):
+    server.statuses = [(503, {})]
+    assert http_session.http.get(server.url).status_code == 200
+    assert http_session.http_metrics()["127.0.0.1"] == {"state": "closed", "requests": 1, "retries": 1}
+
+
+def test_circuit_opens_and_fails_fast(server):
+    server.statuses = [(404, {})] * 10
+    breaker = http_session.host_guard("127.0.0.1").breaker
+    for _ in range(http_session.FAILURE_THRESHOLD):
+        breaker.record_failure()
+    with pytest.raises(http_session.CircuitOpenError):
+        http_session.http.get(server.url)
+    assert len(server.statuses) == 10
+    assert http_session.http_metrics()["127.0.0.1"] == {"state": "open", "rejected": 1}
+
+
+def test_half_open_circuit_closes_after_successful_trial(server, mocker):
+    breaker = http_session.host_guard("127.0.0.1").breaker
+    for _ in range(http_session.FAILURE_THRESHOLD):
+        breaker.record_failure()
+    mocker.patch("cdk_example_app.common.http_session.time.monotonic", return_value=breaker.open_until)
+    assert http_session.http.get(server.url).status_code == 200
+    assert breaker.state == http_session.CLOSED
+
+
+def test_failed_trial_reopens_circuit():
+    breaker = http_session.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert breaker.state == http_session.HALF_OPEN
+    assert not breaker.allow_request()
+    breaker.record_failure(retry_after=60)
+    assert breaker.state == http_session.OPEN
+    assert not breaker.allow_request()
+
+
+def test_retry_budget():
+    budget = http_session.RetryBudget(capacity=2, refill_rate=0)
+    assert [budget.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_no_retry_when_budget_exhausted(server):
+    http_session.host_guard("127.0.0.1").budget = http_session.RetryBudget(capacity=0)
+    server.statuses = [(503, {})]
+    with pytest.raises(requests.exceptions.RetryError):
+        http_session.http.get(server.url)
+    assert http_session.http_metrics()["127.0.0.1"]["retriesDenied"] == 1
+
+
+def test_no_retry_after_the_remaining_time(server):
+    invocation.start(Context(remaining_millis=30_000))
+    server.statuses = [(429, {"Retry-After": "40"})]
+    with pytest.raises(requests.exceptions.RetryError):
+        http_session.http.get(server.url)
+
+
+def test_timeout_limited_to_remaining_time():
+    invocation.start(Context(remaining_millis=3_000))
+    assert http_session._limit_timeout(5) == pytest.approx(2, abs=0.1)  # pylint: disable=protected-access
+    assert http_session._limit_timeout((1, 5)) == pytest.approx((1, 2), abs=0.1)  # pylint: disable=protected-access
+
+
+def test_add_http_metrics(server, mocker):
+    http_session.http.get(server.url)
+    metrics = mocker.Mock()
+    http_session.add_http_metrics(metrics)
+    added = {call.kwargs["name"]: call.kwargs["value"] for call in metrics.add_metric.call_args_list}
+    assert added["HttpClient.127.0.0.1.circuitOpen"] == 0
+    assert added["HttpClient.127.0.0.1.requests"] == 1
+    assert http_session.http_metrics()["127.0.0.1"] == {"state": "closed"}
@@ -0,0 +1,75 @@
+from unittest.mock import Mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from cdk_example_app.common import lambda_
+
+# pylint: disable=redefined-outer-name
+
+ARN_1 = "arn:aws:lambda:eu-west-1:123456789012:function:fn-1"
+ARN_2 = "arn:aws:lambda:eu-west-1:123456789012:function:fn-2"
+MISSING_ARN = "arn:aws:lambda:eu-west-1:123456789012:function:missing"
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "GetFunction")
+
+
+def get_function(FunctionName):  # pylint: disable=invalid-name
+    if FunctionName == MISSING_ARN:
+        raise client_error("ResourceNotFoundException")
+    return {"Configuration": {"LastModified": f"modified-{FunctionName[-4:]}"}}
+
+
+@pytest.fixture
+def client(mocker):
+    lambda_.clear_function_info_cache()
+    client = Mock()
+    client.get_function.side_effect = get_function
+    client.list_tags.side_effect = lambda Resource: {"Tags": {"name": Resource[-4:]}}
+    client.get_paginator.return_value.paginate.return_value = [
+        {"Functions": [{"FunctionArn": ARN_1, "FunctionName": "fn-1", "LastModified": "listed-fn-1"}]},
+        {"Functions": [{"FunctionArn": ARN_2, "FunctionName": "fn-2", "LastModified": "listed-fn-2"}]},
+    ]
+    mocker.patch.object(lambda_, "lambda_client", return_value=client)
+    mocker.patch("cdk_example_app.common.lambda_.time.sleep")
+    yield client
+    lambda_.clear_function_info_cache()
+
+
+def test_get_function_info_is_cached(client):
+    assert lambda_.get_function_info(ARN_1) == {"lastModified": "modified-fn-1", "name": "fn-1"}
+    assert lambda_.get_function_info(ARN_1) == {"lastModified": "modified-fn-1", "name": "fn-1"}
+    assert client.get_function.call_count == 1
+
+
+def test_get_function_info_expires(client):
+    lambda_.get_function_info(ARN_1, ttl=0)
+    lambda_.get_function_info(ARN_1)
+    assert client.get_function.call_count == 2
+
+
+def test_get_function_info_retries_throttling(client):
+    client.list_tags.side_effect = [client_error("TooManyRequestsException"), {"Tags": {}}]
+    assert lambda_.get_function_info(ARN_1) == {"lastModified": "modified-fn-1"}
+
+
+def test_get_functions_info(client):
+    lambda_.get_function_info(ARN_1)
+    info = lambda_.get_functions_info([ARN_1, ARN_2, MISSING_ARN, ARN_2])
+    assert info == {
+        ARN_1: {"lastModified": "modified-fn-1", "name": "fn-1"},
+        ARN_2: {"lastModified": "modified-fn-2", "name": "fn-2"},
+        MISSING_ARN: None,
+    }
+    assert client.get_function.call_count == 3
+
+
+def test_get_functions_info_with_prefetch(client):
+    info = lambda_.get_functions_info([ARN_1, "fn-2"], prefetch=True)
+    assert info == {
+        ARN_1: {"lastModified": "listed-fn-1", "name": "fn-1"},
+        "fn-2": {"lastModified": "listed-fn-2", "name": "fn-2"},
+    }
+    client.get_function.assert_not_called()
@@ -0,0 +1,122 @@
+import cProfile
+import pstats
+import tracemalloc
+from dataclasses import dataclass
+from unittest.mock import Mock
+
+import pytest
+
+from cdk_example_app.common import profiling
+
+# pylint: disable=redefined-outer-name
+
+
+@dataclass
+class Context:
+    aws_request_id: str
+
+
+@pytest.fixture
+def enable_profiling(monkeypatch, tmp_path):
+    def enable(sample_rate=0, output=str(tmp_path)):
+        monkeypatch.setenv(profiling.PROFILING_ENABLED_ENV_VARIABLE, "true")
+        monkeypatch.setenv(profiling.PROFILING_SAMPLE_RATE_ENV_VARIABLE, str(sample_rate))
+        monkeypatch.setenv(profiling.PROFILING_OUTPUT_ENV_VARIABLE, output)
+
+    return enable
+
+
+def test_disabled():
+    logger = Mock()
+    with profiling.profile_invocation("my-lambda", Context("my-request"), logger) as profile:
+        assert profiling.phase(profiling.PHASE_HANDLER) is profiling.phase(profiling.PHASE_DECODE)
+
+    assert profile is None
+    logger.info.assert_not_called()
+
+
+def test_phase_timings(enable_profiling):
+    enable_profiling()
+    logger = Mock()
+    with profiling.profile_invocation("my-lambda", Context("my-request"), logger) as profile:
+        for _ in range(2):
+            with profiling.phase(profiling.PHASE_HANDLER):
+                pass
+        with profiling.phase(profiling.PHASE_DECODE):
+            pass
+
+    assert not profile.sampled
+    summary = logger.info.call_args.args[0]
+    assert summary["message"] == "invocation profile"
+    assert summary["handler"] == "my-lambda"
+    assert summary["phases"].keys() == {"handler", "decode"}
+    assert summary["phases"]["handler"]["count"] == 2
+    assert summary["durationMs"] >= summary["phases"]["handler"]["totalMs"]
+    assert "peakMemoryBytes" not in summary
+    # the phases of the next invocations are not recorded
+    assert profiling.phase(profiling.PHASE_HANDLER) is profiling.phase(profiling.PHASE_DECODE)
+
+
+def test_sampled_profile(enable_profiling, tmp_path):
+    enable_profiling(sample_rate=1)
+    logger = Mock()
+    # like the event handlers with concurrently processed records, cProfile only runs in the "worker"
+    with profiling.profile_invocation("my-lambda", Context("my-request"), logger, in_thread=False):
+        data = [bytes(1000) for _ in range(1000)]
+        with profiling.profile_thread():
+            del data
+
+    summary = logger.info.call_args.args[0]
+    assert summary["peakMemoryBytes"] > 1000 * 1000
+    assert summary["profile"] == str(tmp_path / "my-lambda-my-request.prof")
+    assert pstats.Stats(summary["profile"]).total_calls > 0
+
+
+def test_sampled_profile_with_tracemalloc_running(enable_profiling, monkeypatch):
+    enable_profiling(sample_rate=1)
+    # Python 3.8 (the Lambda runtime) has no reset_peak
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    logger = Mock()
+    tracemalloc.start()
+    try:
+        with profiling.profile_invocation("my-lambda", Context("my-request"), logger):
+            data = [bytes(1000) for _ in range(1000)]
+            del data
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    assert logger.info.call_args.args[0]["peakMemoryBytes"] > 1000 * 1000
+
+
+def test_sampled_profile_with_another_active_profiler(enable_profiling, monkeypatch):
+    enable_profiling(sample_rate=1)
+    # Python 3.12+ allows only one active profiler
+    enable = Mock(side_effect=ValueError("Another profiling tool is already active"))
+    monkeypatch.setattr(cProfile.Profile, "enable", enable)
+    logger = Mock()
+    with profiling.profile_invocation("my-lambda", Context("my-request"), logger) as profile:
+        with profiling.profile_thread():
+            handled = True
+
+    assert handled
+    assert enable.call_count == 2
+    assert not profile.profiles
+    assert "profile" not in logger.info.call_args.args[0]
+
+
+def test_handler_name():
+    assert profiling.handler_name(test_handler_name) == f"{__name__}.test_handler_name"
+
+
+def test_sampled_profile_to_s3(enable_profiling, mocker):
+    enable_profiling(sample_rate=1, output="s3://my-bucket/profiles/")
+    s3_client = mocker.patch.object(profiling, "s3_client")
+    logger = Mock()
+    with profiling.profile_invocation("my-lambda", Context("my-request"), logger):
+        pass
+
+    s3_client().upload_file.assert_called_once_with(
+        "/tmp/my-lambda-my-request.prof", "my-bucket", "profiles/my-lambda-my-request.prof"
+    )
+    assert logger.info.call_args.args[0]["profile"] == "s3://my-bucket/profiles/my-lambda-my-request.prof"
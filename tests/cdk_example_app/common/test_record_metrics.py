@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from unittest.mock import Mock, call
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+from cdk_example_app.common import aws_clients, record_metrics
+from cdk_example_app.common.record_metrics import (
+    HTTP_SESSION_MODULE,
+    InvocationTimings,
+    RecordTimings,
+    add_client_metrics,
+    parse_epoch_millis,
+    parse_event_time,
+)
+
+
+def test_parse_event_time():
+    assert parse_event_time("2021-06-01T12:00:00.123Z") == datetime(2021, 6, 1, 12, 0, 0, 123000, timezone.utc)
+    assert parse_event_time(None) is None
+
+
+def test_parse_epoch_millis():
+    assert parse_epoch_millis("1622548800123") == datetime(2021, 6, 1, 12, 0, 0, 123000, timezone.utc)
+    assert parse_epoch_millis("") is None
+
+
+def test_add_metrics():
+    timings = InvocationTimings()
+    timings.add(RecordTimings(queue_lag=2.5, fetch_time=0.0125))
+    timings.add(RecordTimings(queue_lag=1, handler_time=0.2))
+    timings.log_flush_time = 0.05
+    metrics = Mock()
+
+    timings.add_metrics(metrics)
+
+    assert metrics.add_metric.call_args_list == [
+        call(name="queueLag", unit=MetricUnit.Milliseconds, value=2500.0),
+        call(name="queueLag", unit=MetricUnit.Milliseconds, value=1000),
+        call(name="fetchTime", unit=MetricUnit.Milliseconds, value=12.5),
+        call(name="handlerTime", unit=MetricUnit.Milliseconds, value=200.0),
+        call(name="logFlushTime", unit=MetricUnit.Milliseconds, value=50.0),
+    ]
+
+
+def test_add_client_metrics(mocker):
+    add_pool_metrics = mocker.patch.object(aws_clients, "add_pool_metrics")
+    http_session = Mock()
+    mocker.patch.dict(record_metrics.sys.modules, {HTTP_SESSION_MODULE: http_session})
+    metrics = Mock()
+
+    add_client_metrics(metrics)
+
+    add_pool_metrics.assert_called_once_with(metrics)
+    http_session.add_http_metrics.assert_called_once_with(metrics)
+
+
+def test_add_client_metrics_without_http_session(mocker):
+    mocker.patch.object(aws_clients, "add_pool_metrics")
+    mocker.patch.dict(record_metrics.sys.modules)
+    record_metrics.sys.modules.pop(HTTP_SESSION_MODULE, None)
+
+    add_client_metrics(Mock())
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from unittest.mock import Mock
+
+import pytest
+from botocore.response import StreamingBody
+from pynamodb.indexes import KeysOnlyProjection
+
+from cdk_example_app.common import reprocessing, s3
+from cdk_example_app.common.event_log import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_PROCESSING,
+    EventLog,
+    status_index_projection,
+)
+
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture
+def logs(event_log_table):  # pylint: disable=unused-argument
+    now = datetime.now(timezone.utc)
+    for key, status, function, age in [
+        ("failed-old", STATUS_FAILED, "fn-1", 60),
+        ("failed-new", STATUS_FAILED, "fn-1", 1),
+        ("stuck-old", STATUS_PROCESSING, "fn-2", 60),
+        ("done-old", STATUS_DONE, "fn-1", 60),
+    ]:
+        EventLog(
+            s3_key=key,
+            s3_bucket="my-bucket",
+            status=status,
+            function=function,
+            region="eu-west-1",
+            received_time=now - timedelta(minutes=age),
+            etag=f"etag-{key}",
+        ).save()
+
+
+@pytest.mark.usefixtures("logs")
+def test_find_events():
+    assert sorted(log.s3_key for log in reprocessing.find_events()) == ["failed-new", "failed-old", "stuck-old"]
+    old = reprocessing.find_events(older_than=timedelta(minutes=30))
+    assert sorted(log.s3_key for log in old) == ["failed-old", "stuck-old"]
+    old_fn_1 = reprocessing.find_events(older_than=timedelta(minutes=30), function="fn-1", region="eu-west-1")
+    assert [log.s3_key for log in old_fn_1] == ["failed-old"]
+
+
+@pytest.mark.usefixtures("logs")
+def test_find_events_with_keys_only_projection(mocker):
+    mocker.patch.object(EventLog.status_index.Meta, "projection", KeysOnlyProjection())
+    logs = list(reprocessing.find_events(older_than=timedelta(minutes=30), function="fn-2"))
+    assert [(log.s3_key, log.s3_bucket) for log in logs] == [("stuck-old", "my-bucket")]
+
+
+def test_status_index_projection():
+    assert status_index_projection("keys_only").projection_type == "KEYS_ONLY"
+    assert status_index_projection("INCLUDE").non_key_attributes == [
+        "bucket",
+        "version",
+        "etag",
+        "function",
+        "region",
+        "received",
+    ]
+    with pytest.raises(ValueError):
+        status_index_projection("NONE")
+
+
+@pytest.mark.usefixtures("logs")
+def test_reprocess_counts_failures():
+    handler = Mock(
+        side_effect=lambda event, context: event["Records"][0]["s3"]["object"]["key"] == "stuck-old" or 1 / 0
+    )
+    counts = reprocessing.reprocess(reprocessing.find_events(), handler, max_concurrency=2, rate=100)
+    assert counts == {"reprocessed": 1, "failed": 2}
+    assert {call.args[1].function_name for call in handler.call_args_list} == {"fn-1", "fn-2"}
+
+
+@pytest.mark.usefixtures("logs")
+def test_reprocess_through_s3_event_handler(mocker):
+    s3_client = mocker.patch("cdk_example_app.common.s3.s3_client")
+    s3_client.return_value.get_object.side_effect = lambda Bucket, Key: {
+        "Body": StreamingBody(BytesIO(b'{"foo": "bar"}'), 14),
+        "Metadata": {},
+    }
+    bodies = []
+
+    @s3.s3_event_handler(Mock(), parse_json=True, idempotent=True)
+    def handler(body, **_):
+        bodies.append(body)
+
+    counts = reprocessing.reprocess(reprocessing.find_events(older_than=timedelta(minutes=30)), handler)
+    assert counts == {"reprocessed": 2}
+    assert bodies == [{"foo": "bar"}] * 2
+    assert EventLog.get("failed-old").status == STATUS_DONE
+    assert EventLog.get("stuck-old").function == "fn-2"
+
+
+def test_dry_run():
+    handler = Mock()
+    assert reprocessing.reprocess([Mock(), Mock()], handler, dry_run=True) == {"reprocessed": 2}
+    handler.assert_not_called()
@@ -1,5 +1,9 @@
+import gzip
+import json
 import re
+import zlib
 from dataclasses import dataclass
+from datetime import datetime, timezone
 from io import BytesIO
 from unittest.mock import Mock
 
@@ -7,8 +11,13 @@ import pytest
 from botocore.response import StreamingBody
 from opentelemetry.trace import SpanKind, format_trace_id
 
-from cdk_example_app.common import s3
-from cdk_example_app.common.event_log import STATUS_DONE, STATUS_FAILED, EventLog
+from cdk_example_app.common import event_log, profiling, s3
+from cdk_example_app.common.event_log import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    EventLog,
+    query_status,
+)
 from tests.compare import assert_similar, ignore
 
 # pylint: disable=redefined-outer-name
@@ -27,14 +36,18 @@ def create_event_handler(event_log_table):
     def functional_key_extractor(body):
         return "func_key", str(body)
 
-    def create(parse_json=True):
+    def create(parse_json=True, stream=None, **kwargs):
         handler_args = []
         logger = Mock()
 
-        @s3.s3_event_handler(logger, parse_json=parse_json, functional_key_extractor=functional_key_extractor)
+        @s3.s3_event_handler(
+            logger, parse_json=parse_json, functional_key_extractor=functional_key_extractor, stream=stream, **kwargs
+        )
         def handler(body, s3_obj, record):
             if "handler-error" in record["s3"]["object"]["key"]:
                 raise Exception(record["s3"]["object"]["key"])
+            if stream:
+                body = list(body)
             handler_args.append({"body": body, "s3_obj": s3_obj, "record": record})
 
         return handler, handler_args, logger
@@ -58,6 +71,18 @@ def s3_get_object_mock(mocker):
                 "x-b3-spanid": SPAN_ID,
                 "x-b3-sampled": "1",
             }
+        if "gzip" in Key:
+            compressed = gzip.compress(b'{"foo":"bar"}')
+            if "truncated" in Key:
+                compressed = compressed[: len(compressed) // 2]
+            body = streaming_body(compressed)
+            if "magic" in Key:
+                return {"Body": body, "Metadata": metadata}
+            return {"Body": body, "Metadata": metadata, "ContentEncoding": "gzip"}
+        if "ndjson" in Key:
+            return {"Body": streaming_body(b'{"foo":"bar"}\n{"foo":"baz"}\n'), "Metadata": metadata}
+        if "array" in Key:
+            return {"Body": streaming_body(b'[{"foo":"bar"}, {"foo":"baz"}, invalid]'), "Metadata": metadata}
         if "json" in Key:
             return {"Body": streaming_body(b'{"foo":"bar"}'), "Metadata": metadata}
         return {"Body": streaming_body(b"foo bar"), "Metadata": metadata}
@@ -68,12 +93,12 @@ def s3_get_object_mock(mocker):
 
 @pytest.fixture
 def create_s3_event():
-    def create(keys):
+    def create(keys, etag=None):
         records = [
             {
                 "s3": {
                     "bucket": {"name": "my-bucket"},
-                    "object": {"key": key},
+                    "object": {"key": key, "eTag": etag} if etag else {"key": key},
                 }
             }
             for key in keys
@@ -127,7 +152,7 @@ def test_s3_event_handler_trace_propagation(create_event_handler, create_s3_even
     event = create_s3_event(["my-key-with-parse-error", "my-json-key-with-trace"])
     handler(event, Context(function_name="my-lambda"))
 
-    span_1 = trace_export.call_args_list[0].args[0][0]
+    span_1, span_2 = [span for call in trace_export.call_args_list for span in call.args[0]]
     assert span_1.attributes == {"s3Bucket": "my-bucket", "s3Key": "my-key-with-parse-error"}
     assert format_trace_id(span_1.context.trace_id) != TRACE_ID
     assert span_1.kind == SpanKind.SERVER
@@ -137,7 +162,6 @@ def test_s3_event_handler_trace_propagation(create_event_handler, create_s3_even
         "Expecting value: line 1 column 1 (char 0)"
     )
 
-    span_2 = trace_export.call_args_list[1].args[0][0]
     assert span_2.attributes == {
         "s3Bucket": "my-bucket",
         "s3Key": "my-json-key-with-trace",
@@ -148,13 +172,26 @@ def test_s3_event_handler_trace_propagation(create_event_handler, create_s3_even
     assert span_2.status.is_ok
 
 
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_without_tracing(create_event_handler, create_s3_event, mocker, monkeypatch):
+    monkeypatch.setenv("TRACING_ENABLED", "false")
+    export = mocker.patch("cdk_example_app.common.tracing.tracer.logger_span_exporter.export")
+    handler, handler_args, logger = create_event_handler()
+    handler(create_s3_event(["my-json-key-with-trace"]), Context(function_name="my-lambda"))
+
+    assert len(handler_args) == 1
+    export.assert_not_called()
+    logger.append_keys.assert_any_call(traceId=mocker.ANY)
+    assert re.fullmatch(r"\w{32}", next(query_status([STATUS_DONE])).trace_id)
+
+
 @pytest.mark.usefixtures("s3_get_object_mock")
 def test_s3_event_handler_event_log(create_event_handler, create_s3_event):
     handler, _, _ = create_event_handler()
     event = create_s3_event(["my-key-with-parse-error", "my-json-key-with-trace"])
     handler(event, Context(function_name="my-lambda"))
 
-    done = list(EventLog.status_index.query(STATUS_DONE))
+    done = list(query_status([STATUS_DONE]))
     assert len(done) == 1
     assert_similar(
         done[0].attribute_values,
@@ -169,7 +206,7 @@ def test_s3_event_handler_event_log(create_event_handler, create_s3_event):
         },
     )
 
-    failed = list(EventLog.status_index.query(STATUS_FAILED))
+    failed = list(query_status([STATUS_FAILED]))
     assert len(failed) == 1
     assert_similar(
         failed[0].attribute_values,
@@ -222,7 +259,7 @@ def test_s3_event_handler_with_s3_exception(create_event_handler, create_s3_even
     with pytest.raises(Exception, match="my-key-with-exception"):
         handler(event, Context(function_name="my-lambda"))
 
-    done = list(EventLog.status_index.query(STATUS_DONE))
+    done = list(query_status([STATUS_DONE]))
     assert len(done) == 1
     assert_similar(
         done[0].attribute_values,
@@ -237,7 +274,7 @@ def test_s3_event_handler_with_s3_exception(create_event_handler, create_s3_even
         },
     )
 
-    failed = list(EventLog.status_index.query(STATUS_FAILED))
+    failed = list(query_status([STATUS_FAILED]))
     assert len(failed) == 1
     assert_similar(
         failed[0].attribute_values,
@@ -260,7 +297,7 @@ def test_s3_event_handler_with_handler_exception(create_event_handler, create_s3
     with pytest.raises(Exception, match="my-json-key-with-handler-error-and-trace"):
         handler(event, Context(function_name="my-lambda"))
 
-    done = list(EventLog.status_index.query(STATUS_DONE))
+    done = list(query_status([STATUS_DONE]))
     assert len(done) == 1
     assert_similar(
         done[0].attribute_values,
@@ -275,7 +312,7 @@ def test_s3_event_handler_with_handler_exception(create_event_handler, create_s3
         },
     )
 
-    failed = list(EventLog.status_index.query(STATUS_FAILED))
+    failed = list(query_status([STATUS_FAILED]))
     assert len(failed) == 1
     assert_similar(
         failed[0].attribute_values,
@@ -292,5 +329,272 @@ def test_s3_event_handler_with_handler_exception(create_event_handler, create_s3
     )
 
 
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_concurrent_s3_event_handler(create_event_handler, create_s3_event):
+    handler, handler_args, logger = create_event_handler(max_concurrency=4)
+    keys = [f"my-json-key-{i}" for i in range(8)]
+    handler(create_s3_event(keys), Context(function_name="my-lambda"))
+
+    assert sorted(args["record"]["s3"]["object"]["key"] for args in handler_args) == keys
+    assert sorted(log.s3_key for log in query_status([STATUS_DONE])) == keys
+    # logger keys are passed per record instead of being appended to the shared logger
+    logger.append_keys.assert_not_called()
+    processed_logs = [call for call in logger.method_calls if call[0] == "info"]
+    assert sorted(call.kwargs["extra"]["s3_key"] for call in processed_logs) == keys
+    assert_similar(
+        processed_logs[0],
+        ("info", ("processed s3 object",), {"extra": {"s3_bucket": "my-bucket", "traceId": re.compile(r"\w{32}")}}),
+    )
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_concurrent_s3_event_handler_isolates_failures(create_event_handler, create_s3_event):
+    handler, handler_args, _ = create_event_handler(max_concurrency=4)
+    event = create_s3_event(
+        ["my-json-key-1", "my-json-key-with-handler-error", "my-key-with-exception", "my-json-key-2"]
+    )
+    with pytest.raises(Exception, match="my-json-key-with-handler-error"):
+        handler(event, Context(function_name="my-lambda"))
+
+    assert len(handler_args) == 2
+    assert sorted(log.s3_key for log in query_status([STATUS_DONE])) == ["my-json-key-1", "my-json-key-2"]
+    assert sorted(log.error for log in query_status([STATUS_FAILED])) == [
+        "my-json-key-with-handler-error",
+        "my-key-with-exception",
+    ]
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_with_batched_event_log(create_event_handler, create_s3_event, mocker):
+    save = mocker.spy(EventLog, "save")
+    handler, _, _ = create_event_handler(max_concurrency=4, event_log_batch_size=25)
+    event = create_s3_event(["my-json-key-1", "my-json-key-with-handler-error", "my-json-key-2"])
+    with pytest.raises(Exception, match="my-json-key-with-handler-error"):
+        handler(event, Context(function_name="my-lambda"))
+
+    save.assert_not_called()
+    assert sorted(log.s3_key for log in query_status([STATUS_DONE])) == ["my-json-key-1", "my-json-key-2"]
+    assert [log.s3_key for log in query_status([STATUS_FAILED])] == ["my-json-key-with-handler-error"]
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_with_deferred_event_log(create_event_handler, create_s3_event, mocker):
+    save = mocker.spy(EventLog, "save")
+    update = mocker.spy(EventLog, "update")
+    handler, _, _ = create_event_handler(deferred_write_threshold=60)
+    handler(create_s3_event(["my-json-key-1", "my-json-key-2"]), Context(function_name="my-lambda"))
+
+    # fast records only write their final state
+    assert save.call_count == 2
+    update.assert_not_called()
+    assert sorted(log.s3_key for log in query_status([STATUS_DONE])) == ["my-json-key-1", "my-json-key-2"]
+
+
+def test_idempotent_s3_event_handler(create_event_handler, create_s3_event, s3_get_object_mock, mocker):
+    handler, handler_args, _ = create_event_handler(idempotent=True)
+    handler(create_s3_event(["my-json-key"], etag="etag-1"), Context(function_name="my-lambda"))
+    save = mocker.spy(EventLog, "save")
+
+    # duplicate notification is recognized by the warm container
+    handler(create_s3_event(["my-json-key"], etag="etag-1"), Context(function_name="my-lambda"))
+    save.assert_not_called()
+
+    # duplicate notification is recognized by the conditional write
+    event_log._processed_cache.clear()  # pylint: disable=protected-access
+    handler(create_s3_event(["my-json-key"], etag="etag-1"), Context(function_name="my-lambda"))
+    assert save.call_count == 1
+    assert len(handler_args) == 1
+    s3_get_object_mock.assert_called_once()
+
+    # a new version of the object is processed again
+    handler(create_s3_event(["my-json-key"], etag="etag-2"), Context(function_name="my-lambda"))
+    assert len(handler_args) == 2
+    assert_similar(EventLog.get("my-json-key").attribute_values, {"status": STATUS_DONE, "etag": "etag-2"})
+
+
+def test_deferred_write_delay_respects_remaining_time():
+    context = Mock(get_remaining_time_in_millis=Mock(return_value=3000))
+    assert s3._deferred_write_delay(0.5, context) == 0.5  # pylint: disable=protected-access
+    assert s3._deferred_write_delay(5, context) == 2  # pylint: disable=protected-access
+    assert s3._deferred_write_delay(None, context) is None  # pylint: disable=protected-access
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_streaming_s3_event_handler(create_event_handler, create_s3_event):
+    handler, handler_args, logger = create_event_handler(parse_json=False, stream="ndjson")
+    handler(create_s3_event(["my-ndjson-key"]), Context(function_name="my-lambda"))
+
+    assert handler_args[0]["body"] == [{"foo": "bar"}, {"foo": "baz"}]
+    # the functional key is extracted from the first record only
+    logger.append_keys.assert_any_call(func_key="{'foo': 'bar'}")
+    assert EventLog.get("my-ndjson-key").status == STATUS_DONE
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_streaming_s3_event_handler_with_invalid_json(create_event_handler, create_s3_event):
+    handler, handler_args, _ = create_event_handler(parse_json=False, stream="json-array")
+    handler(create_s3_event(["my-array-key"]), Context(function_name="my-lambda"))
+
+    assert not handler_args
+    assert_similar(
+        EventLog.get("my-array-key").attribute_values,
+        {
+            "status": STATUS_FAILED,
+            "functional_key_value": "{'foo': 'bar'}",
+            "error": re.compile("S3 object my-array-key in bucket my-bucket is not valid Json: Expecting value"),
+        },
+    )
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_gzip_s3_event_handler(create_event_handler, create_s3_event):
+    handler, handler_args, _ = create_event_handler()
+    handler(create_s3_event(["my-gzip-key", "my-gzip-magic-key"]), Context(function_name="my-lambda"))
+
+    assert [args["body"] for args in handler_args] == [{"foo": "bar"}, {"foo": "bar"}]
+    assert EventLog.get("my-gzip-key").gzip
+    assert EventLog.get("my-gzip-magic-key").gzip
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_received_time(create_event_handler, create_s3_event):
+    handler, _, _ = create_event_handler()
+    event = create_s3_event(["my-json-key-with-trace"])
+    event["Records"][0]["eventTime"] = "2021-06-01T12:00:00.123Z"
+    handler(event, Context(function_name="my-lambda"))
+
+    assert EventLog.get("my-json-key-with-trace").received_time == datetime(2021, 6, 1, 12, 0, 0, 123000, timezone.utc)
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_sqs_event(create_event_handler, create_s3_event):
+    handler, handler_args, _ = create_event_handler()
+    sqs_event = {
+        "Records": [
+            {
+                "eventSource": "aws:sqs",
+                "messageId": "my-message",
+                "attributes": {"SentTimestamp": "1622548800123", "ApproximateFirstReceiveTimestamp": "1622548801123"},
+                "body": json.dumps(create_s3_event(["my-json-key-with-trace"])),
+            },
+            {"eventSource": "aws:sqs", "messageId": "my-test-event", "body": json.dumps({"Event": "s3:TestEvent"})},
+        ]
+    }
+    assert handler(sqs_event, Context(function_name="my-lambda")) == {"batchItemFailures": []}
+
+    assert len(handler_args) == 1
+    assert handler_args[0]["record"]["sqs"]["messageId"] == "my-message"
+    assert EventLog.get("my-json-key-with-trace").received_time == datetime(2021, 6, 1, 12, 0, 0, 123000, timezone.utc)
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+@pytest.mark.parametrize("max_concurrency", [1, 2])
+def test_s3_event_handler_sqs_batch_item_failures(create_event_handler, create_s3_event, max_concurrency):
+    handler, handler_args, _ = create_event_handler(max_concurrency=max_concurrency)
+    sqs_event = {
+        "Records": [
+            {
+                "eventSource": "aws:sqs",
+                "messageId": f"message-{index}",
+                "body": json.dumps(create_s3_event(keys)),
+            }
+            for index, keys in enumerate([["my-json-handler-error", "my-json-key"], ["my-json-other-key"]])
+        ]
+    }
+
+    response = handler(sqs_event, Context(function_name="my-lambda"))
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "message-0"}]}
+    assert sorted(args["record"]["s3"]["object"]["key"] for args in handler_args) == [
+        "my-json-key",
+        "my-json-other-key",
+    ]
+    assert EventLog.get("my-json-handler-error").status == STATUS_FAILED
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_sqs_event_with_invalid_json(create_event_handler, create_s3_event):
+    handler, handler_args, logger = create_event_handler()
+    sqs_event = {
+        "Records": [
+            {"eventSource": "aws:sqs", "messageId": "my-invalid-message", "body": "not json"},
+            {"eventSource": "aws:sqs", "messageId": "my-message", "body": json.dumps(create_s3_event(["my-json-key"]))},
+        ]
+    }
+
+    # the invalid message is not retried because it would fail again
+    assert handler(sqs_event, Context(function_name="my-lambda")) == {"batchItemFailures": []}
+    assert [args["record"]["sqs"]["messageId"] for args in handler_args] == ["my-message"]
+    assert_similar(
+        logger.error.call_args.args[0], {"error": "SQS message is not valid Json", "messageId": "my-invalid-message"}
+    )
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_metrics(create_event_handler, create_s3_event, mocker):
+    add_client_metrics = mocker.patch.object(s3, "add_client_metrics")
+    metrics = Mock()
+    handler, _, _ = create_event_handler(metrics=metrics)
+    event = create_s3_event(["my-json-key-with-trace"])
+    event["Records"][0]["eventTime"] = datetime.now(timezone.utc).isoformat()
+    handler(event, Context(function_name="my-lambda"))
+
+    names = [kwargs["name"] for _, kwargs in metrics.add_metric.call_args_list]
+    assert names == ["queueLag", "fetchTime", "handlerTime", "logWriteTime"]
+    add_client_metrics.assert_called_once_with(metrics)
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_metrics_with_batch_writer(create_event_handler, create_s3_event, mocker):
+    mocker.patch.object(s3, "add_client_metrics")
+    metrics = Mock()
+    handler, _, _ = create_event_handler(metrics=metrics, event_log_batch_size=10)
+    handler(create_s3_event(["my-json-key-with-trace", "my-key"]), Context(function_name="my-lambda"))
+
+    names = [kwargs["name"] for _, kwargs in metrics.add_metric.call_args_list]
+    assert names.count("logWriteTime") == 2
+    assert names[-1] == "logFlushTime"
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_s3_event_handler_profiling(create_event_handler, create_s3_event, monkeypatch, tmp_path):
+    monkeypatch.setenv(profiling.PROFILING_ENABLED_ENV_VARIABLE, "true")
+    monkeypatch.setenv(profiling.PROFILING_SAMPLE_RATE_ENV_VARIABLE, "1")
+    monkeypatch.setenv(profiling.PROFILING_OUTPUT_ENV_VARIABLE, str(tmp_path))
+    handler, _, logger = create_event_handler(max_concurrency=2)
+    handler(create_s3_event(["my-json-key-with-trace", "my-key"]), Context(function_name="my-lambda"))
+
+    summary = logger.info.call_args.args[0]
+    assert summary["profile"].startswith(str(tmp_path))
+    assert summary["message"] == "invocation profile"
+    assert summary["handler"] == f"{__name__}.handler"
+    assert summary["phases"].keys() == {"s3Get", "decode", "functionalKey", "handler", "eventLogWrite"}
+    assert summary["phases"]["s3Get"]["count"] == 2
+    # my-key is not valid json
+    assert summary["phases"]["handler"]["count"] == 1
+
+
+@pytest.mark.usefixtures("s3_get_object_mock")
+def test_truncated_gzip_s3_event_handler(create_event_handler, create_s3_event):
+    handler, handler_args, _ = create_event_handler()
+    with pytest.raises(zlib.error, match="incomplete compressed stream"):
+        handler(create_s3_event(["my-truncated-gzip-key"]), Context(function_name="my-lambda"))
+
+    assert not handler_args
+    assert EventLog.get("my-truncated-gzip-key").status == STATUS_FAILED
+
+
+def test_content_charset():
+    assert s3.content_charset({}) == "utf-8"
+    assert s3.content_charset({"ContentType": "text/plain; charset=ISO-8859-1"}) == "ISO-8859-1"
+    assert s3.content_charset({"ContentEncoding": "gzip"}) == "utf-8"
+    assert s3.content_charset({"ContentEncoding": "latin-1"}) == "latin-1"
+
+
+def test_stream_and_parse_json_are_exclusive():
+    with pytest.raises(ValueError, match="parse_json can't be combined with stream"):
+        s3.s3_event_handler(Mock(), parse_json=True, stream="ndjson")
+
+
 def streaming_body(raw):
     return StreamingBody(BytesIO(raw), len(raw))
@@ -0,0 +1,211 @@
+import json
+import threading
+from unittest.mock import Mock
+
+import pytest
+from opentelemetry.trace import format_trace_id
+
+from cdk_example_app.common import profiling
+from cdk_example_app.common.sqs import (
+    BatchSendError,
+    JsonBatchSender,
+    logger,
+    sqs_json_event_handler,
+)
+from cdk_example_app.common.tracing.tracer import force_flush, tracer
+from cdk_example_app.common.util import compress_base64
+
+# pylint: disable=redefined-outer-name
+
+TRACE_ID = "80f198ee56343ba864fe8b2a57d3eff7"
+
+
+def create_sqs_event(bodies, queue="my-queue"):
+    return {
+        "Records": [
+            {
+                "messageId": f"msg-{index}",
+                "body": body,
+                "eventSourceARN": f"arn:aws:sqs:eu-west-1:123456789012:{queue}",
+                "messageAttributes": {
+                    "x-b3-traceid": {"stringValue": TRACE_ID},
+                    "x-b3-spanid": {"stringValue": "05e3ac9a4f6e3b90"},
+                    "x-b3-sampled": {"stringValue": "1"},
+                },
+            }
+            for index, body in enumerate(bodies)
+        ]
+    }
+
+
+def create_handler(**kwargs):
+    handled = []
+
+    @sqs_json_event_handler(**kwargs)
+    def handler(body, record):
+        if body.get("fail"):
+            raise ValueError(record["messageId"])
+        handled.append(body)
+
+    return handler, handled
+
+
+BODIES = [json.dumps({"id": 1}), "invalid json", json.dumps({"id": 2, "fail": True}), json.dumps({"id": 3})]
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_sqs_json_event_handler(max_concurrency):
+    handler, handled = create_handler(max_concurrency=max_concurrency)
+
+    response = handler(create_sqs_event(BODIES), Mock())
+
+    assert sorted(body["id"] for body in handled) == [1, 3]
+    # invalid json is not retried
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-2"}]}
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_sqs_json_event_handler_profiling(monkeypatch, mocker, tmp_path, max_concurrency):
+    monkeypatch.setenv(profiling.PROFILING_ENABLED_ENV_VARIABLE, "true")
+    monkeypatch.setenv(profiling.PROFILING_SAMPLE_RATE_ENV_VARIABLE, "1")
+    monkeypatch.setenv(profiling.PROFILING_OUTPUT_ENV_VARIABLE, str(tmp_path))
+    info = mocker.patch.object(logger, "info")
+    handler, handled = create_handler(max_concurrency=max_concurrency)
+
+    response = handler(create_sqs_event(BODIES), Mock())
+
+    # profiling doesn't fail records
+    assert len(handled) == 2
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-2"}]}
+    summary = info.call_args.args[0]
+    assert summary["profile"].startswith(str(tmp_path))
+    assert summary["message"] == "invocation profile"
+    assert summary["handler"] == f"{__name__}.handler"
+    assert summary["phases"]["decode"]["count"] == 4
+    assert summary["phases"]["handler"]["count"] == 3
+
+
+def test_sqs_json_event_handler_metrics(mocker):
+    add_client_metrics = mocker.patch("cdk_example_app.common.sqs.add_client_metrics")
+    metrics = Mock()
+    handler, _ = create_handler(metrics=metrics)
+
+    handler(create_sqs_event(BODIES), Mock())
+
+    add_client_metrics.assert_called_once_with(metrics)
+
+
+def test_sqs_json_event_handler_fifo():
+    handler, handled = create_handler(max_concurrency=4)
+
+    response = handler(create_sqs_event(BODIES, queue="my-queue.fifo"), Mock())
+
+    assert handled == [{"id": 1}]
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-2"}, {"itemIdentifier": "msg-3"}]}
+
+
+def test_sqs_json_event_handler_without_arguments(mocker):
+    trace_export = mocker.patch("cdk_example_app.common.tracing.tracer.logger_span_exporter.export")
+
+    @sqs_json_event_handler
+    def handler(_body):
+        pass
+
+    # pylint infers the return type of the decorator from its call with keyword arguments only
+    response = handler(create_sqs_event(BODIES[:1]), Mock())  # pylint: disable=too-many-function-args
+    assert response == {"batchItemFailures": []}
+    span = trace_export.call_args.args[0][0]
+    assert format_trace_id(span.context.trace_id) == TRACE_ID
+
+
+def test_sqs_json_event_handler_with_compressed_body():
+    handler, handled = create_handler()
+    event = create_sqs_event([compress_base64(json.dumps({"id": 1}))])
+    event["Records"][0]["messageAttributes"]["content-encoding"] = {"stringValue": "zlib+base64"}
+
+    assert handler(event, Mock()) == {"batchItemFailures": []}
+    assert handled == [{"id": 1}]
+
+
+@pytest.fixture
+def send_message_batch(mocker):
+    return mocker.patch("cdk_example_app.common.sqs.sqs_client").return_value.send_message_batch
+
+
+def test_json_batch_sender(send_message_batch):
+    send_message_batch.return_value = {}
+    with tracer.start_as_current_span("test") as span:
+        with JsonBatchSender("my-queue-url") as sender:
+            for i in range(25):
+                sender.send({"id": i}, MessageGroupId="my-group")
+            sender.send({"big": "x" * 300 * 1024})
+    force_flush()
+
+    assert [len(call.kwargs["Entries"]) for call in send_message_batch.call_args_list] == [10, 10, 6]
+    entry = send_message_batch.call_args_list[0].kwargs["Entries"][0]
+    assert entry["MessageBody"] == '{"id": 0}'
+    assert entry["MessageGroupId"] == "my-group"
+    assert entry["MessageAttributes"]["x-b3-traceid"]["StringValue"] == format_trace_id(
+        span.get_span_context().trace_id
+    )
+    compressed_entry = send_message_batch.call_args_list[2].kwargs["Entries"][5]
+    assert compressed_entry["MessageAttributes"]["content-encoding"]["StringValue"] == "zlib+base64"
+    assert len(compressed_entry["MessageBody"]) < 1024
+
+
+def test_json_batch_sender_retries_failed_entries(send_message_batch, mocker):
+    mocker.patch("cdk_example_app.common.sqs.RETRY_BACKOFF", 0)
+    send_message_batch.side_effect = [
+        {"Failed": [{"Id": "1", "SenderFault": False}, {"Id": "2", "SenderFault": True}]},
+        {"Failed": [{"Id": "1", "SenderFault": False}]},
+        {},
+    ]
+    sender = JsonBatchSender("my-queue-url")
+    for i in range(3):
+        sender.send({"id": i})
+    with pytest.raises(BatchSendError) as e:
+        sender.flush()
+
+    assert e.value.failed == [{"Id": "2", "SenderFault": True}]
+    assert [entry["MessageBody"] for entry in e.value.entries] == ['{"id": 2}']
+    assert [[entry["Id"] for entry in call.kwargs["Entries"]] for call in send_message_batch.call_args_list] == [
+        ["0", "1", "2"],
+        ["1"],
+        ["1"],
+    ]
+
+
+def test_json_batch_sender_keeps_messages_of_failed_batches(send_message_batch):
+    send_message_batch.side_effect = [Exception("my-error"), {}]
+    sender = JsonBatchSender("my-queue-url")
+    for i in range(11):
+        sender.send({"id": i})
+
+    with pytest.raises(BatchSendError) as e:
+        sender.close()
+    assert [entry["MessageBody"] for entry in e.value.entries] == [json.dumps({"id": i}) for i in range(10)]
+    # the message that was sent after the failed batch is not lost
+    assert [entry["MessageBody"] for entry in send_message_batch.call_args.kwargs["Entries"]] == ['{"id": 10}']
+
+
+def test_json_batch_sender_sends_outside_the_buffer_lock(send_message_batch):
+    sending = threading.Event()
+    release = threading.Event()
+
+    def slow_send_message_batch(**_):
+        sending.set()
+        release.wait(5)
+        return {}
+
+    send_message_batch.side_effect = slow_send_message_batch
+    sender = JsonBatchSender("my-queue-url")
+    producer = threading.Thread(target=lambda: [sender.send({"id": i}) for i in range(10)])
+    producer.start()
+    assert sending.wait(5)
+    # buffering doesn't wait for the batch that is being sent
+    sender.send({"id": 10})
+    release.set()
+    producer.join()
+    sender.close()
+
+    assert [len(call.kwargs["Entries"]) for call in send_message_batch.call_args_list] == [10, 1]
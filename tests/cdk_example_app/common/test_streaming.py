@@ -0,0 +1,77 @@
+import json
+from io import BytesIO
+from json import JSONDecodeError
+
+import pytest
+
+from cdk_example_app.common.streaming import (
+    STREAM_BYTES,
+    STREAM_JSON_ARRAY,
+    STREAM_LINES,
+    STREAM_NDJSON,
+    iter_json_array,
+    stream_body,
+)
+
+ITEMS = [1, 22.5, -3e-2, 'a"b,]', {"x": [1, 2, {"y": "é"}]}, None, True, [], {}, 12345678901234]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1024])
+def test_stream_json_array(chunk_size):
+    raw = json.dumps(ITEMS, ensure_ascii=False).encode()
+    assert list(stream_body(BytesIO(raw), STREAM_JSON_ARRAY, chunk_size=chunk_size)) == ITEMS
+    assert list(stream_body(BytesIO(b" [ ] "), STREAM_JSON_ARRAY, chunk_size=chunk_size)) == []
+
+
+@pytest.mark.parametrize(
+    ("raw", "error"),
+    [
+        (b"[1,2", "Unterminated json array"),
+        (b"[1 2]", "Expecting ',' delimiter"),
+        (b"{}", "Expecting '\\['"),
+        (b"[1]x", "Extra data"),
+        (b"[1,]", "Expecting value"),
+    ],
+)
+def test_stream_invalid_json_array(raw, error):
+    with pytest.raises(JSONDecodeError, match=error):
+        list(stream_body(BytesIO(raw), STREAM_JSON_ARRAY, chunk_size=1))
+
+
+def test_stream_invalid_json_array_item_fails_early():
+    def chunks():
+        yield '[{"a": 1}, {"a": x'
+        for _ in range(3):
+            yield " " * 1024
+        pytest.fail("the rest of the object was read")
+
+    items = iter_json_array(chunks())
+    assert next(items) == {"a": 1}
+    with pytest.raises(JSONDecodeError, match="Expecting value"):
+        next(items)
+
+
+def test_stream_json_array_max_item_size():
+    raw = json.dumps([1, "x" * 100]).encode()
+    with pytest.raises(ValueError, match="json array item exceeds 50 characters"):
+        list(iter_json_array((chr(byte) for byte in raw), max_item_size=50))
+
+
+def test_stream_large_json_array_item():
+    items = [{"x": "y" * 1_000_000}, list(range(100_000)), 1]
+    raw = json.dumps(items).encode()
+    assert list(stream_body(BytesIO(raw), STREAM_JSON_ARRAY, chunk_size=4096)) == items
+
+
+def test_stream_ndjson():
+    raw = b'{"a": 1}\n\n{"b": "\xc3\xa9"}\r\n'
+    assert list(stream_body(BytesIO(raw), STREAM_NDJSON, chunk_size=3)) == [{"a": 1}, {"b": "é"}]
+
+
+def test_stream_lines():
+    raw = "a\r\nbé\n\nc".encode()
+    assert list(stream_body(BytesIO(raw), STREAM_LINES, chunk_size=1)) == ["a", "bé", "", "c"]
+
+
+def test_stream_bytes():
+    assert list(stream_body(BytesIO(b"abcde"), STREAM_BYTES, chunk_size=2)) == [b"ab", b"cd", b"e"]
@@ -0,0 +1,70 @@
+import gzip
+import zlib
+
+import pytest
+
+from cdk_example_app.common.util import (
+    compress_base64,
+    compress_base64_chunks,
+    decompress_base64,
+    decompress_base64_chunks,
+    decompress_chunks,
+    parallel_iter,
+)
+
+TEXT = "Streaming is the way to go! €é\n" * 1000
+
+
+def chunked(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_compress_base64():
+    assert decompress_base64(compress_base64(TEXT)) == TEXT
+
+
+def test_compress_base64_chunks():
+    assert "".join(compress_base64_chunks(chunked(TEXT, 100))) == compress_base64(TEXT)
+
+
+def test_decompress_base64_chunks():
+    assert "".join(decompress_base64_chunks(chunked(compress_base64(TEXT), 7))) == TEXT
+
+
+def test_decompress_chunks():
+    assert b"".join(decompress_chunks(chunked(gzip.compress(TEXT.encode()), 5))) == TEXT.encode()
+    assert b"".join(decompress_chunks(chunked(zlib.compress(TEXT.encode()), 5))) == TEXT.encode()
+    # concatenated gzip members
+    assert b"".join(decompress_chunks([gzip.compress(b"foo") + gzip.compress(b"bar")])) == b"foobar"
+
+
+def test_decompress_raw_deflate_chunks():
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    raw_deflate = compressor.compress(TEXT.encode()) + compressor.flush()
+    assert b"".join(decompress_chunks(chunked(raw_deflate, 5))) == TEXT.encode()
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, zlib.compress])
+def test_decompress_truncated_chunks(compress):
+    compressed = compress(TEXT.encode())
+    with pytest.raises(zlib.error, match="incomplete compressed stream"):
+        b"".join(decompress_chunks(chunked(compressed[: len(compressed) // 2], 5)))
+
+
+def test_parallel_iter():
+    assert sorted(parallel_iter([range(0, 50), range(50, 100), []], buffer_size=4)) == list(range(100))
+
+
+def test_parallel_iter_raises():
+    def failing():
+        yield 1
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        list(parallel_iter([failing(), range(10)]))
+
+
+def test_parallel_iter_stops():
+    items = parallel_iter([iter(int, 1)], buffer_size=1)  # infinite iterator
+    assert next(items) == 0
+    items.close()
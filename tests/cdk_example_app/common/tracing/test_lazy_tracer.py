@@ -0,0 +1,40 @@
+import re
+
+import pytest
+
+from cdk_example_app.common.tracing import lazy_tracer
+
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture
+def tracing_disabled(monkeypatch):
+    monkeypatch.setenv("TRACING_ENABLED", "false")
+
+
+@pytest.mark.parametrize("value, enabled", [(None, True), ("true", True), ("false", False), ("0", False)])
+def test_tracing_enabled(monkeypatch, value, enabled):
+    if value is None:
+        monkeypatch.delenv("TRACING_ENABLED", raising=False)
+    else:
+        monkeypatch.setenv("TRACING_ENABLED", value)
+    assert lazy_tracer.tracing_enabled() == enabled
+
+
+@pytest.mark.usefixtures("tracing_disabled")
+def test_untraced_root_span():
+    with lazy_tracer.start_sqs_root_span("my-handler", {"messageAttributes": {}}) as span:
+        assert not span.is_recording()
+        lazy_tracer.set_error_status(span, "failed")
+        assert re.fullmatch(r"[0-9a-f]{32}", lazy_tracer.format_trace_id(span.get_span_context().trace_id))
+
+
+@pytest.mark.usefixtures("tracing_disabled")
+def test_no_trace_context_injected():
+    assert not lazy_tracer.inject_sqs_trace_context({})
+
+
+def test_trace_context_injected():
+    with lazy_tracer.get_tracer().start_as_current_span("parent"):
+        assert "x-b3-traceid" in lazy_tracer.inject_sqs_trace_context({})
+    lazy_tracer.force_flush()
@@ -0,0 +1,55 @@
+import json
+from io import StringIO
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from cdk_example_app.common.tracing.logger_span_exporter import (
+    CompactSpanExporter,
+    decode_span_batch,
+    span_to_dict,
+)
+
+
+def create_spans(count=3):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer(__name__)
+    with tracer.start_as_current_span("root", kind=SpanKind.SERVER, attributes={"s3Key": "my-key"}):
+        for i in range(count):
+            with tracer.start_as_current_span("S3.GetObject", kind=SpanKind.CLIENT) as span:
+                span.set_attribute("s3Key", f"key-{i}")
+                span.set_attribute("retries", i)
+        with tracer.start_as_current_span("failing") as span:
+            span.set_status(Status(StatusCode.ERROR, "boom"))
+    return exporter.get_finished_spans()
+
+
+def test_compact_span_exporter():
+    spans = create_spans()
+    out = StringIO()
+
+    CompactSpanExporter(out).export(spans)
+
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 1
+    batch = json.loads(lines[0])
+    assert batch["names"] == ["S3.GetObject", "failing", "root"]
+    assert batch["keys"] == ["s3Key", "retries"]
+    assert decode_span_batch(batch) == [span_to_dict(span) for span in spans]
+
+
+def test_compact_span_exporter_splits_large_batches():
+    spans = create_spans(count=2000)
+    out = StringIO()
+
+    CompactSpanExporter(out, max_line_bytes=20 * 1024).export(spans)
+
+    lines = out.getvalue().splitlines()
+    assert len(lines) > 1
+    assert all(len(line.encode()) <= 20 * 1024 for line in lines)
+    decoded = [span for line in lines for span in decode_span_batch(json.loads(line))]
+    assert decoded == [span_to_dict(span) for span in spans]
@@ -0,0 +1,56 @@
+from unittest.mock import patch
+
+from opentelemetry.propagators.b3 import B3MultiFormat
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF, Decision, ParentBased
+
+from cdk_example_app.common.tracing.sampling import RateLimitingSampler, create_sampler
+
+TRACE_ID = 0x80F198EE56343BA864FE8B2A57D3EFF7
+
+
+def decisions(sampler, count, parent_context=None):
+    return [sampler.should_sample(parent_context, TRACE_ID, "span").decision for _ in range(count)]
+
+
+def test_rate_limiting_sampler():
+    with patch("cdk_example_app.common.tracing.sampling.time.monotonic", return_value=100.0) as monotonic:
+        sampler = RateLimitingSampler(2)
+        assert decisions(sampler, 3) == [Decision.RECORD_AND_SAMPLE, Decision.RECORD_AND_SAMPLE, Decision.DROP]
+        monotonic.return_value = 100.5
+        assert decisions(sampler, 2) == [Decision.RECORD_AND_SAMPLE, Decision.DROP]
+
+
+def test_rate_limiting_sampler_below_one_trace_per_second():
+    with patch("cdk_example_app.common.tracing.sampling.time.monotonic", return_value=100.0) as monotonic:
+        sampler = RateLimitingSampler(0.5)
+        assert decisions(sampler, 2) == [Decision.RECORD_AND_SAMPLE, Decision.DROP]
+        monotonic.return_value = 101.0
+        assert decisions(sampler, 1) == [Decision.DROP]
+        monotonic.return_value = 102.0
+        assert decisions(sampler, 2) == [Decision.RECORD_AND_SAMPLE, Decision.DROP]
+
+
+def test_rate_limiting_sampler_only_limits_sampled_traces():
+    sampler = RateLimitingSampler(1, ALWAYS_OFF)
+    assert decisions(sampler, 1) == [Decision.DROP]
+    assert sampler._tokens == 1  # pylint: disable=protected-access
+
+
+def test_create_sampler_honours_b3_sampled_flag(monkeypatch):
+    monkeypatch.setenv("TRACER_SAMPLING_RATIO", "0")
+    sampler = create_sampler()
+    assert isinstance(sampler, ParentBased)
+
+    def b3_context(sampled):
+        headers = {"x-b3-traceid": f"{TRACE_ID:032x}", "x-b3-spanid": "05e3ac9a4f6e3b90", "x-b3-sampled": sampled}
+        return B3MultiFormat().extract(headers)
+
+    assert decisions(sampler, 1) == [Decision.DROP]
+    assert decisions(sampler, 1, b3_context("1")) == [Decision.RECORD_AND_SAMPLE]
+    assert decisions(sampler, 1, b3_context("0")) == [Decision.DROP]
+
+
+def test_create_sampler_without_configuration(monkeypatch):
+    monkeypatch.delenv("TRACER_SAMPLING_RATIO", raising=False)
+    monkeypatch.delenv("TRACER_MAX_TRACES_PER_SECOND", raising=False)
+    assert create_sampler() is None